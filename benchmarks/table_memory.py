@@ -0,0 +1,43 @@
+import sys
+import os
+import json
+import random
+import tracemalloc
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from carla_nuscenes.table import Table,SCHEMAS
+from carla_nuscenes.utils import generate_token
+
+def make_row(key,i):
+    token = generate_token(key,i)
+    if key == "ego_pose":
+        return {"token":token,"timestamp":1000000+i,"rotation":[random.random() for _ in range(4)],
+                "translation":[random.random()*100 for _ in range(3)]}
+    elif key == "sample_data":
+        return {"token":token,"sample_token":generate_token("sample",i//60),"ego_pose_token":token,
+                "calibrated_sensor_token":generate_token("calibrated_sensor",i%12),"timestamp":1000000+i,
+                "fileformat":"jpg","is_key_frame":i%5==0,"height":900,"width":1600,
+                "prev":generate_token(key,i-1) if i else "","next":generate_token(key,i+1),
+                "filename":"sweeps/CAM_FRONT/c0003-2023-01-09-10-45-20+0800_CAM_FRONT_"+str(1000000+i)+".jpg"}
+    return {"token":token,"sample_token":generate_token("sample",i//60),"instance_token":generate_token("instance",i%80),
+            "visibility_token":str(i%5),"attribute_tokens":[generate_token("attribute","vehicle.moving")],
+            "translation":[random.random()*100 for _ in range(3)],"rotation":[random.random() for _ in range(4)],
+            "size":[1.8,4.5,1.5],"prev":generate_token(key,i-80) if i >= 80 else "","next":"",
+            "num_lidar_pts":random.randint(0,500),"num_radar_pts":random.randint(0,10)}
+
+def measure(build):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    result = build()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result,after-before
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    for key in SCHEMAS:
+        rows = [make_row(key,i) for i in range(num_rows)]
+        payload = json.dumps(rows)
+        dicts,dict_bytes = measure(lambda:json.loads(payload))
+        table,table_bytes = measure(lambda:Table.from_list(SCHEMAS[key],dicts))
+        assert table.to_list() == dicts
+        print(f"{key:<18} dict: {dict_bytes/num_rows:8.1f} B/row  columnar: {table_bytes/num_rows:8.1f} B/row  ratio: {dict_bytes/table_bytes:5.2f}x")
@@ -0,0 +1,50 @@
+import sys
+import os
+import time
+import subprocess
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from carla_nuscenes.utils import generate_token
+from carla_nuscenes.tokens import mint_token,mint_tokens,get_instance_key
+
+def timed(function,repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result,(time.perf_counter()-start)/repeat
+
+def instance_tokens_in_subprocess(hash_seed,stable):
+    # 在不同 PYTHONHASHSEED 的子进程中生成 instance token，检查续跑时是否一致
+    key = "get_instance_key(scene_token,42)" if stable else "hash((scene_token,42))"
+    code = ("import sys;sys.path.insert(0,'"+os.path.join(os.path.dirname(os.path.abspath(__file__)),"..")+"');"
+            "from carla_nuscenes.utils import generate_token;from carla_nuscenes.tokens import get_instance_key;"
+            "scene_token=generate_token('scene','scene-0-0');print(generate_token('instance',"+key+"))")
+    return subprocess.check_output([sys.executable,"-c",code],env=dict(os.environ,PYTHONHASHSEED=str(hash_seed))).decode().strip()
+
+if __name__ == "__main__":
+    num_rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    repeat = 3
+    scene_token = generate_token("scene","scene-0-0")
+    calibrated_sensor_token = generate_token("calibrated_sensor",scene_token+"LIDAR_TOP")
+    timestamps = list(range(1000000,1000000+num_rows))
+    instance_tokens = [generate_token("instance",get_instance_key(scene_token,i%200)) for i in range(num_rows)]
+    sample_token = generate_token("sample",scene_token+"1000000")
+    _,md5_time = timed(lambda:[generate_token("ego_pose",scene_token+calibrated_sensor_token+str(timestamp)) for timestamp in timestamps],repeat)
+    _,batch_time = timed(lambda:mint_tokens("ego_pose",scene_token,calibrated_sensor_token,timestamps),repeat)
+    print(f"ego_pose          generate_token: {md5_time/num_rows*1e9:7.1f} ns/token  mint_tokens: {batch_time/num_rows*1e9:7.1f} ns/token  speedup: {md5_time/batch_time:5.2f}x")
+    _,md5_time = timed(lambda:[generate_token("sample_annotation",sample_token+instance_token) for instance_token in instance_tokens],repeat)
+    _,batch_time = timed(lambda:mint_tokens("sample_annotation",sample_token,instance_tokens),repeat)
+    print(f"sample_annotation generate_token: {md5_time/num_rows*1e9:7.1f} ns/token  mint_tokens: {batch_time/num_rows*1e9:7.1f} ns/token  speedup: {md5_time/batch_time:5.2f}x")
+    # 每个关键帧的实际批次大小：单行（mint_token）与 10/50 行
+    _,md5_time = timed(lambda:generate_token("sample_annotation",sample_token+instance_tokens[0]),10000)
+    _,batch_time = timed(lambda:mint_token("sample_annotation",sample_token,instance_tokens[0]),10000)
+    print(f"keyframe (1)      generate_token: {md5_time*1e9:7.1f} ns/token  mint_token:  {batch_time*1e9:7.1f} ns/token  speedup: {md5_time/batch_time:5.2f}x")
+    for size in [10,50]:
+        keyframe_tokens = instance_tokens[:size]
+        _,md5_time = timed(lambda:[generate_token("sample_annotation",sample_token+instance_token) for instance_token in keyframe_tokens],1000)
+        _,batch_time = timed(lambda:mint_tokens("sample_annotation",sample_token,keyframe_tokens),1000)
+        print(f"keyframe ({size:<2})     generate_token: {md5_time/size*1e9:7.1f} ns/token  mint_tokens: {batch_time/size*1e9:7.1f} ns/token  speedup: {md5_time/batch_time:5.2f}x")
+    tokens = mint_tokens("sample_annotation",sample_token,instance_tokens[:200])
+    print("unique tokens per keyframe:",len(set(tokens)) == len(tokens))
+    for stable in [False,True]:
+        results = set(instance_tokens_in_subprocess(seed,stable) for seed in [1,2,3])
+        print("instance token stable across restarts ("+("get_instance_key" if stable else "hash")+"):",len(results) == 1)
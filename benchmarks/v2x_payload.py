@@ -0,0 +1,55 @@
+import sys
+import os
+import time
+import numpy as np
+sys.path.insert(0,os.path.join(os.path.dirname(os.path.abspath(__file__)),".."))
+from carla_nuscenes.v2x import encode_points,decode_points,encode_boxes,decode_boxes,V2XChannel
+
+def make_cloud(num_points,seed=0):
+    # 近似 32 线激光雷达：距离 2-80 米、方位角均匀、俯仰角 -30~10 度
+    rng = np.random.default_rng(seed)
+    distance = rng.uniform(2,80,num_points)
+    azimuth = rng.uniform(-np.pi,np.pi,num_points)
+    elevation = np.deg2rad(rng.uniform(-30,10,num_points))
+    points = np.empty((num_points,5),dtype=np.float64)
+    points[:,0] = distance*np.cos(elevation)*np.cos(azimuth)
+    points[:,1] = distance*np.cos(elevation)*np.sin(azimuth)
+    points[:,2] = distance*np.sin(elevation)
+    points[:,3] = rng.random(num_points)
+    points[:,4] = rng.integers(0,32,num_points)
+    return points
+
+def make_boxes(num_boxes,seed=0):
+    rng = np.random.default_rng(seed)
+    matrices = np.tile(np.eye(4),(num_boxes,1,1))
+    yaw = rng.uniform(-np.pi,np.pi,num_boxes)
+    matrices[:,0,0],matrices[:,0,1],matrices[:,1,0],matrices[:,1,1] = np.cos(yaw),-np.sin(yaw),np.sin(yaw),np.cos(yaw)
+    matrices[:,:3,3] = rng.uniform(-70,70,(num_boxes,3))+[100,-50,0]
+    extents = np.tile([2.3,1.0,0.8],(num_boxes,1))
+    return np.arange(num_boxes),matrices,extents
+
+def timed(function,repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result,(time.perf_counter()-start)/repeat
+
+if __name__ == "__main__":
+    num_points = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    bandwidth = float(sys.argv[2]) if len(sys.argv) > 2 else 6e6
+    repeat = 5
+    points = make_cloud(num_points)
+    budget = bandwidth*0.1/8
+    print(f"{num_points} points, {bandwidth/1e6:.1f} Mbit/s, 100 ms budget = {budget/1e3:.1f} kB")
+    for mode in ["raw","quantized","voxel"]:
+        payload,encode_time = timed(lambda:encode_points(points,mode),repeat)
+        decoded,decode_time = timed(lambda:decode_points(payload),repeat)
+        channel = V2XChannel(latency=0.0,jitter=0.0,bandwidth=bandwidth,loss=0.0)
+        _,delay = channel.send(0.0,len(payload))
+        print(f"points/{mode:<10} {len(payload)/1e3:10.1f} kB  points: {len(decoded):7d}  encode: {encode_time*1e3:7.2f} ms  "
+              f"decode: {decode_time*1e3:7.2f} ms  airtime: {delay*1e3:8.1f} ms  fits: {len(payload) <= budget}")
+    ids,matrices,extents = make_boxes(100)
+    payload,encode_time = timed(lambda:encode_boxes(ids,matrices,extents,[100,-50,0]),repeat)
+    (_,boxes),decode_time = timed(lambda:decode_boxes(payload),repeat)
+    error = np.abs(boxes[:,:3]-matrices[:,:3,3]).max()
+    print(f"boxes/100        {len(payload)/1e3:10.1f} kB  max center error: {error:.3f} m  encode: {encode_time*1e3:7.2f} ms  decode: {decode_time*1e3:7.2f} ms")
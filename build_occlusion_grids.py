@@ -0,0 +1,16 @@
+from carla_nuscenes.client import Client
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+config_path = "./configs/config.yaml"
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+grid_config = config["annotation"]["occlusion_grid"]
+client = Client(config["client"])
+for world_config in config["worlds"]:
+    try:
+        client.generate_world(world_config)
+        client.load_occlusion_grid(world_config["map_name"],**grid_config)
+        print("occlusion grid ready:",world_config["map_name"],client.occlusion_grid.heights.shape)
+    finally:
+        client.destroy_world()
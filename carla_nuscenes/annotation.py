@@ -0,0 +1,225 @@
+import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from .utils import get_nuscenes_rt_batch
+from .tokens import mint_tokens
+
+def transform_points(points,matrix):
+    return points@matrix[:3,:3].T+matrix[:3,3]
+
+def count_points_in_boxes(points,box_matrices,extents):
+    counts = np.zeros(len(box_matrices),dtype=np.int64)
+    if len(points) == 0:
+        return counts
+    for i in range(len(box_matrices)):
+        local = (points-box_matrices[i,:3,3])@box_matrices[i,:3,:3]
+        counts[i] = np.count_nonzero(np.all(np.abs(local)<=extents[i],axis=1))
+    return counts
+
+def count_agent_points_in_boxes(points,agent_ids,box_matrices,extents,num_agents):
+    counts = np.zeros((len(box_matrices),num_agents),dtype=np.int64)
+    if len(points) == 0:
+        return counts
+    for i in range(len(box_matrices)):
+        local = (points-box_matrices[i,:3,3])@box_matrices[i,:3,:3]
+        counts[i] = np.bincount(agent_ids[np.all(np.abs(local)<=extents[i],axis=1)],minlength=num_agents)
+    return counts
+
+def count_points_by_actor(object_ids,actor_ids):
+    # object_idx 可能是很大的 id（静态物体等），按排序后的 actor id 查找计数，不按最大 id 分配数组
+    actor_ids = np.asarray(actor_ids,dtype=np.int64)
+    if len(actor_ids) == 0:
+        return np.zeros(0,dtype=np.int64)
+    object_ids = np.asarray(object_ids,dtype=np.int64)
+    sorted_ids = np.unique(actor_ids)
+    positions = np.minimum(np.searchsorted(sorted_ids,object_ids),len(sorted_ids)-1)
+    counts = np.bincount(positions[sorted_ids[positions] == object_ids],minlength=len(sorted_ids))
+    return counts[np.searchsorted(sorted_ids,actor_ids)]
+
+def get_visibility_levels(num_pts,visibility_points):
+    return np.searchsorted(np.asarray(visibility_points),num_pts,side="right")
+
+# get_box_corners 的顶点序号按 x,y,z 符号编码，只差一位的两个顶点构成一条棱
+BOX_EDGES = [(i,j) for i in range(8) for j in range(i+1,8) if bin(i^j).count("1") == 1]
+
+def get_box_corners(box_matrices,extents):
+    signs = np.array([[x,y,z] for x in (-1,1) for y in (-1,1) for z in (-1,1)],dtype=np.float64)
+    local = signs[None,:,:]*extents[:,None,:]
+    return np.einsum("nij,nkj->nki",box_matrices[:,:3,:3],local)+box_matrices[:,None,:3,3]
+
+def get_segment_box_hits(start,end,box_matrices,extents):
+    # 线段 start->end 与各定向包围盒的 slab 相交测试
+    if len(box_matrices) == 0:
+        return np.zeros(0,dtype=bool)
+    start = np.asarray(start,dtype=np.float64)
+    local_start = np.einsum("nji,nj->ni",box_matrices[:,:3,:3],start-box_matrices[:,:3,3])
+    direction = np.einsum("nji,j->ni",box_matrices[:,:3,:3],np.asarray(end,dtype=np.float64)-start)
+    parallel = direction == 0
+    inside = np.abs(local_start) <= extents
+    with np.errstate(divide="ignore",invalid="ignore"):
+        t1 = (-extents-local_start)/direction
+        t2 = (extents-local_start)/direction
+    t_near = np.where(parallel,np.where(inside,-np.inf,np.inf),np.minimum(t1,t2)).max(axis=1)
+    t_far = np.where(parallel,np.where(inside,np.inf,-np.inf),np.maximum(t1,t2)).min(axis=1)
+    return (t_near <= t_far) & (t_far >= 0) & (t_near <= 1)
+
+def get_near_clipped_points(local,near=0.1):
+    # 长方体在近平面 x=near 处截断：保留近平面前的顶点，加上跨越近平面的棱与近平面的交点
+    front = local[:,0] >= near
+    points = [local[front]]
+    for i,j in BOX_EDGES:
+        if front[i] != front[j]:
+            t = (near-local[i,0])/(local[j,0]-local[i,0])
+            points.append(local[i:i+1]+t*(local[j:j+1]-local[i:i+1]))
+    return np.concatenate(points)
+
+def get_convex_hull(points):
+    # 单调链算法，返回逆时针顶点
+    points = sorted(set(map(tuple,points)))
+    if len(points) < 3:
+        return points
+    cross = lambda o,a,b:(a[0]-o[0])*(b[1]-o[1])-(a[1]-o[1])*(b[0]-o[0])
+    lower,upper = [],[]
+    for point in points:
+        while len(lower) >= 2 and cross(lower[-2],lower[-1],point) <= 0:
+            lower.pop()
+        lower.append(point)
+    for point in reversed(points):
+        while len(upper) >= 2 and cross(upper[-2],upper[-1],point) <= 0:
+            upper.pop()
+        upper.append(point)
+    return lower[:-1]+upper[:-1]
+
+def clip_polygon(polygon,width,height):
+    # Sutherland-Hodgman：依次用图像的四条边裁剪凸多边形
+    for axis,limit,keep_below in [(0,0,False),(0,width,True),(1,0,False),(1,height,True)]:
+        inside = lambda point:point[axis] <= limit if keep_below else point[axis] >= limit
+        clipped = []
+        for k,point in enumerate(polygon):
+            previous = polygon[k-1]
+            if inside(point) != inside(previous):
+                t = (limit-previous[axis])/(point[axis]-previous[axis])
+                clipped.append((previous[0]+t*(point[0]-previous[0]),previous[1]+t*(point[1]-previous[1])))
+            if inside(point):
+                clipped.append(point)
+        polygon = clipped
+    return polygon
+
+def get_polygon_area(polygon):
+    if len(polygon) < 3:
+        return 0.0
+    x,y = np.array(polygon,dtype=np.float64).T
+    return 0.5*abs(np.dot(x,np.roll(y,-1))-np.dot(y,np.roll(x,-1)))
+
+def get_projected_box_areas(corners,camera_matrix,intrinsic,width,height,near=0.1):
+    # 长方体投影轮廓（近平面截断后顶点投影的凸包）在图像内的面积；相机坐标系：x 向前，y 向右，z 向上
+    local = (corners-camera_matrix[:3,3])@camera_matrix[:3,:3]
+    areas = np.zeros(len(corners),dtype=np.float64)
+    for i,box in enumerate(local):
+        if not np.any(box[:,0] >= near):
+            continue
+        points = get_near_clipped_points(box,near)
+        uv = np.stack([intrinsic[0,0]*points[:,1]/points[:,0]+intrinsic[0,2],-intrinsic[1,1]*points[:,2]/points[:,0]+intrinsic[1,2]],axis=1)
+        areas[i] = get_polygon_area(clip_polygon(get_convex_hull(uv),width,height))
+    return areas
+
+def count_visible_pixels(image,actor_ids):
+    # 实例分割图像为 BGRA，G 与 B 通道编码 actor id 的低 16 位
+    ids = image[:,:,1].astype(np.int64)|(image[:,:,0].astype(np.int64)<<8)
+    counts = np.bincount(ids.ravel(),minlength=1<<16)
+    return counts[np.asarray(actor_ids,dtype=np.int64)&0xFFFF]
+
+def get_camera_visibility_levels(cameras,actor_ids,box_matrices,extents,bands=(0.4,0.6,0.8)):
+    # 每个相机单独计算可见像素占投影轮廓面积的比例，取各相机中的最大值（重叠视野不累加）
+    corners = get_box_corners(box_matrices,extents)
+    visible_pixels = np.zeros(len(actor_ids),dtype=np.int64)
+    fraction = np.zeros(len(actor_ids),dtype=np.float64)
+    for camera_matrix,intrinsic,image in cameras:
+        height,width = image.shape[:2]
+        pixels = count_visible_pixels(image,actor_ids)
+        areas = get_projected_box_areas(corners,camera_matrix,intrinsic,width,height)
+        visible_pixels = np.maximum(visible_pixels,pixels)
+        fraction = np.maximum(fraction,np.divide(pixels,areas,out=np.zeros(len(actor_ids),dtype=np.float64),where=areas>0))
+    levels = np.searchsorted(np.asarray(bands),fraction,side="right")+1
+    return np.where(visible_pixels>0,levels,0)
+
+def compute_sample_annotations(snapshot):
+    matrices = snapshot["matrices"]
+    extents = snapshot["extents"]
+    num_lidar_pts = np.zeros(len(matrices),dtype=np.int64)
+    num_radar_pts = np.zeros(len(matrices),dtype=np.int64)
+    if snapshot.get("semantic") is not None:
+        for object_ids in snapshot["semantic"]:
+            num_lidar_pts += count_points_by_actor(object_ids,snapshot["ids"])
+        levels = get_visibility_levels(num_lidar_pts,snapshot["visibility_points"])
+        snapshot["visibility_tokens"] = [str(level) for level in levels]
+    elif snapshot.get("cameras") is not None:
+        levels = get_camera_visibility_levels(snapshot["cameras"],snapshot["ids"],matrices,extents)
+        snapshot["visibility_tokens"] = [str(level) for level in levels]
+    for sensor_matrix,points in snapshot["lidar"]:
+        num_lidar_pts += count_points_in_boxes(transform_points(points,sensor_matrix),matrices,extents)
+    for sensor_matrix,points in snapshot["radar"]:
+        num_radar_pts += count_points_in_boxes(transform_points(points,sensor_matrix),matrices,extents)
+    agent_pts = None
+    if snapshot.get("fused") is not None:
+        reference_matrix,fused = snapshot["fused"]
+        agent_ids = fused[:,5].astype(np.int64)
+        agent_pts = count_agent_points_in_boxes(transform_points(fused[:,:3],reference_matrix),agent_ids,matrices,extents,
+                                                int(agent_ids.max())+1 if len(agent_ids) else 1)
+    rotations,translations = get_nuscenes_rt_batch(matrices)
+    sizes = (extents[:,[1,0,2]]*2).tolist()#xyz to whl
+    rotations,translations = rotations.tolist(),translations.tolist()
+    annotations = []
+    for i,actor_id in enumerate(snapshot["ids"]):
+        if snapshot["visibility_tokens"][i] == "0":
+            continue
+        annotations.append((actor_id,(snapshot["visibility_tokens"][i],snapshot["attribute_tokens"][i],
+                            translations[i],rotations[i],sizes[i],int(num_lidar_pts[i]),int(num_radar_pts[i])),
+                            None if agent_pts is None else agent_pts[i].tolist()))
+    return annotations
+
+class AnnotationPool:
+    def __init__(self,workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.pending = deque()
+
+    def submit(self,sample_token,snapshot):
+        ids = list(snapshot["ids"])
+        if self.executor is None:
+            self.pending.append((sample_token,compute_sample_annotations(snapshot),ids))
+        else:
+            self.pending.append((sample_token,self.executor.submit(compute_sample_annotations,snapshot),ids))
+
+    def done(self,result):
+        return not hasattr(result,"done") or result.done()
+
+    def commit(self,dataset,instances_token,samples_annotation_token,block=False,protect=None,collected=None):
+        # protect(actor_ids,count)：首次被标注的实体保留到场景结束，快照中的实体在该关键帧提交后解除临时保留
+        # collected 不为 None 时追加 (token,sample_token,instance_token,prev,translation,rotation,size)，供 sweep 插值使用
+        while self.pending and (block or self.done(self.pending[0][1])):
+            sample_token,result,ids = self.pending.popleft()
+            if hasattr(result,"result"):
+                result = result.result()
+            # 整个关键帧的标注 token 一次生成
+            tokens = mint_tokens("sample_annotation",sample_token,[instances_token[actor_id] for actor_id,_,_ in result])
+            annotated = [actor_id for actor_id,_,_ in result if samples_annotation_token[actor_id] == ""]
+            for (actor_id,annotation,agent_pts),token in zip(result,tokens):
+                if collected is not None:
+                    collected.append((token,sample_token,instances_token[actor_id],samples_annotation_token[actor_id],*annotation[2:5]))
+                samples_annotation_token[actor_id] = dataset.update_sample_annotation(samples_annotation_token[actor_id],sample_token,instances_token[actor_id],*annotation,token=token)
+                if agent_pts is not None:
+                    dataset.update_sample_annotation_agent(samples_annotation_token[actor_id],agent_pts)
+            if protect is not None:
+                protect(annotated,1)
+                protect(ids,-1)
+
+    def discard(self):
+        while self.pending:
+            _,result,_ = self.pending.popleft()
+            if hasattr(result,"cancel"):
+                result.cancel()
+
+    def shutdown(self):
+        self.discard()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
@@ -2,16 +2,64 @@ import carla
 from .sensor import *
 from .vehicle import Vehicle
 from .walker import Walker
+from .occlusion import load_occlusion_grid
+from .spawn_plan import load_spawn_plan
+from .cooperative import collect_agent_lidar
+from .trajectory import TrajectoryLog
+from .ingest import RingSlot,release_slots
+from .tokens import get_instance_key
+from .annotation import get_segment_box_hits
 import math
-from .utils import generate_token,get_nuscenes_rt,get_intrinsic,transform_timestamp,clamp
+import numpy as np
+from .utils import generate_token,get_nuscenes_rt,get_nuscenes_rt_batch,get_transform_matrices,get_intrinsic,transform_timestamp,clamp
 import random
+import time
 import logging
+import threading
+from collections import deque,Counter
+
+# 交通设置默认值与原先硬编码的参数一致，可在 world 配置的 traffic 中覆盖
+DEFAULT_TRAFFIC = {
+    "distance_to_leading_vehicle":1.0,
+    "hybrid_physics":True,
+    "hybrid_physics_radius":200,
+    "respawn_dormant_vehicles":True,
+    "respawn_bounds":[21,70],
+    "speed_difference":None, # 全局限速偏差百分比（TM global_percentage_speed_difference）
+    "spawn_center":"origin", # origin: 世界原点为中心的方形区域; ego: 距主车起点/行驶路径 spawn_radius 以内
+    "spawn_radius":200,
+    "step_budget":None, # 每个 tick 的耗时预算（秒），超出时剔除远处的背景实体
+    "budget_window":20, # 统计平均 tick 耗时的帧数
+    "shed_fraction":0.1, # 每次超预算剔除的背景实体比例
+    "shed_min_distance":80 # 距主车该距离以内的实体不会被剔除
+}
+
+WEATHER_KEYS = ["cloudiness","precipitation","precipitation_deposits","wind_intensity","sun_azimuth_angle","sun_altitude_angle",
+                "fog_density","fog_distance","wetness","fog_falloff","scattering_intensity","mie_scattering_scale",
+                "rayleigh_scattering_scale","dust_storm"]
 
 class Client:
     def __init__(self,client_config):
+        self.client_config = client_config
         self.client = carla.Client(client_config["host"],client_config["port"])
         self.client.set_timeout(client_config["time_out"])# 设置连接超时时间
 
+    def reconnect(self):
+        # 服务器重启后旧连接与所有实体句柄均失效，重新建立连接并清空场景状态
+        self.client = carla.Client(self.client_config["host"],self.client_config["port"])
+        self.client.set_timeout(self.client_config["time_out"])
+        self.client.get_server_version()
+        self.ego_vehicle = None
+        self.sensors = None
+        self.instance_cameras = None
+        self.vehicles = None
+        self.walkers = None
+        self.rsu_sensors = []
+        self.replay_actors = None
+        for i in range(1,5):
+            setattr(self,"aux_sensors"+str(i),None)
+            setattr(self,"aux_vehicle"+str(i),None)
+
     def generate_world(self,world_config):
         print("generate world start!")
         self.client.load_world(world_config["map_name"])# 加载配置中指定的地图（如 "Town05_Opt"）
@@ -20,8 +68,14 @@ class Client:
         self.world.unload_map_layer(carla.MapLayer.ParkedVehicles)# 卸载地图中的静态停放车辆（避免干扰自定义场景的实体布局）
         self.ego_vehicle = None # 初始化实体容器（后续会存储主车、传感器、其他车辆、行人）
         self.sensors = None
+        self.instance_cameras = None
         self.vehicles = None
         self.walkers = None
+        self.occlusion_grid = None
+        self.dynamic_boxes = None
+        self.spawn_plan = None
+        self.rsu_sensors = []
+        self.replay_actors = None
 
         # 定义匿名函数：根据蓝图 ID 判断实体类别
         get_category = lambda bp: "vehicle.car" if bp.id.split(".")[0] == "vehicle" else "human.pedestrian.adult" if bp.id.split(".")[0] == "walker" else None
@@ -32,21 +86,36 @@ class Client:
         # 生成属性字典：{蓝图 ID: 属性列表}（用于标注实体动态特征）
         self.attribute_dict = {bp.id: get_attribute(bp) for bp in self.world.get_blueprint_library()}
 
+        self.traffic = dict(DEFAULT_TRAFFIC,**world_config.get("traffic",{}))
+        self.tick_times = deque(maxlen=self.traffic["budget_window"])
+        # actor id -> 保留计数：待提交关键帧快照中的实体与已有标注的实体不会被剔除，避免标注链在场景中途断开
+        self.shed_protected = Counter()
+        self.shed_lock = threading.Lock()
         self.trafficmanager = self.client.get_trafficmanager()# 获取交通管理器（控制车辆自动驾驶行为的模块）
-        self.trafficmanager.set_global_distance_to_leading_vehicle(1.0)
+        self.trafficmanager.set_global_distance_to_leading_vehicle(self.traffic["distance_to_leading_vehicle"])
         self.trafficmanager.set_synchronous_mode(True) # 启用同步模式（与模拟器帧同步，确保数据一致性）
-        self.trafficmanager.set_hybrid_physics_mode(True)
-        self.trafficmanager.set_hybrid_physics_radius(200)
-        self.trafficmanager.set_respawn_dormant_vehicles(True) # 自动重新激活静止车辆（避免道路空驶）
-        self.trafficmanager.set_boundaries_respawn_dormant_vehicles(21, 70)
+        self.trafficmanager.set_hybrid_physics_mode(self.traffic["hybrid_physics"])
+        self.trafficmanager.set_hybrid_physics_radius(self.traffic["hybrid_physics_radius"])
+        self.trafficmanager.set_respawn_dormant_vehicles(self.traffic["respawn_dormant_vehicles"]) # 自动重新激活静止车辆（避免道路空驶）
+        self.trafficmanager.set_boundaries_respawn_dormant_vehicles(*self.traffic["respawn_bounds"])
+        if self.traffic["speed_difference"] is not None:
+            self.trafficmanager.global_percentage_speed_difference(self.traffic["speed_difference"])
 
         self.settings = carla.WorldSettings(**world_config["settings"])# 应用世界运行参数（从配置文件读取，如帧间隔 fixed_delta_seconds=0.01）
         self.settings.synchronous_mode = True # 强制启用同步模式（关键！确保传感器数据与实体状态严格对应）
         self.settings.no_rendering_mode = False# 关闭无渲染模式（否则传感器无法生成图像/点云）
         self.world.apply_settings(self.settings)
         self.world.set_pedestrians_cross_factor(1)# 设置行人过马路概率为 100%（确保场景中行人行为更真实）
+        self.spawn_rsu_sensors(world_config.get("rsus",[]))# 路侧单元传感器在整个世界生命周期内保持不变
         print("generate world success!")
 
+    def set_seed(self,seed):
+        # 场景级随机种子：Python/numpy 随机数、交通管理器与行人 AI 使用同一种子，使单个场景可以重新生成
+        random.seed(seed)
+        np.random.seed(seed)
+        self.trafficmanager.set_random_device_seed(seed)
+        self.world.set_pedestrians_seed(seed)
+
     def generate_scene(self,scene_config):
         print("generate scene start!")
         if scene_config["custom"]:
@@ -113,6 +182,67 @@ class Client:
         self.aux_vehicle4.spawn_actor()  
         self.aux_vehicle4.get_actor().set_autopilot()  
 
+        # 环境车辆与行人：加载了生成计划时从计划中采样并批量生成
+        if self.spawn_plan is not None:
+            self.spawn_background_from_plan(scene_config)
+        else:
+            self.spawn_background(scene_config)
+
+        # 1. 根据配置创建传感器实例列表（类型、安装位置等由配置指定）
+        # 所有传感器均挂载到主车（attach_to=self.ego_vehicle.get_actor()）
+        self.sensors = [Sensor(world=self.world, attach_to=self.ego_vehicle.get_actor(), **sensor_config) for
+                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
+        sensors_batch = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.sensors]
+        for i, response in enumerate(self.client.apply_batch_sync(sensors_batch)):
+            if not response.error:
+                self.sensors[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.sensors = list(filter(lambda sensor: sensor.get_actor(), self.sensors))
+
+        ## 辅助车辆的传感器
+        self.aux_sensors1 = [Sensor(world=self.world, attach_to=self.aux_vehicle1.get_actor(), **sensor_config) for
+                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
+        aux_sensors_batch1 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors1]
+        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch1)):
+            if not response.error:
+                self.aux_sensors1[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.aux_sensors1 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors1))
+
+        self.aux_sensors2 = [Sensor(world=self.world, attach_to=self.aux_vehicle2.get_actor(), **sensor_config) for
+                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
+        aux_sensors_batch2 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors2]
+        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch2)):
+            if not response.error:
+                self.aux_sensors2[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.aux_sensors2 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors2))
+
+        self.aux_sensors3 = [Sensor(world=self.world, attach_to=self.aux_vehicle3.get_actor(), **sensor_config) for
+                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
+        aux_sensors_batch3 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors3]
+        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch3)):
+            if not response.error:
+                self.aux_sensors3[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.aux_sensors3 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors3))
+
+        self.aux_sensors4 = [Sensor(world=self.world, attach_to=self.aux_vehicle4.get_actor(), **sensor_config) for
+                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
+        aux_sensors_batch4 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors4]
+        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch4)):
+            if not response.error:
+                self.aux_sensors4[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.aux_sensors4 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors4))
+
+    def spawn_background(self,scene_config):
+        SpawnActor = carla.command.SpawnActor
         # --------------------------
         # 环境车辆生成（核心修改部分）
         # --------------------------
@@ -121,10 +251,7 @@ class Client:
 
         #  筛选有效随机生成点（原始范围）
         spawn_points_all = self.world.get_map().get_spawn_points()
-        spawn_points = [
-            t for t in spawn_points_all
-            if -200 < t.location.x < 200 and -200 < t.location.y < 200
-        ]
+        spawn_points = [t for t in spawn_points_all if self.in_spawn_region(t.location)]
         number_of_spawn_points = len(spawn_points)
         if number_of_spawn_points == 0:
             logging.warning("未找到有效生成点，无法生成环境车辆")
@@ -227,9 +354,6 @@ class Client:
             max_attempts = NUM_OF_WALKERS * 10  # 增加尝试次数
             attempt = 0
 
-            # 扩大行人坐标范围，增加找到有效点的概率
-            x_min, x_max = -200, 200  # 扩大x范围
-            y_min, y_max = -200, 200  # 扩大y范围
 
             def is_safe_spawn(blueprint, transform):
                 try:
@@ -244,7 +368,7 @@ class Client:
                 loc = self.world.get_random_location_from_navigation()
 
                 # 放宽位置限制
-                while loc is None or not (x_min < loc.x < x_max and y_min < loc.y < y_max):
+                while loc is None or not self.in_spawn_region(loc):
                     loc = self.world.get_random_location_from_navigation()
                     attempt += 1
                     if attempt >= max_attempts:
@@ -389,59 +513,74 @@ class Client:
             else:
                 print("未找到有效行人生成点，跳过行人生成")
 
-        # 1. 根据配置创建传感器实例列表（类型、安装位置等由配置指定）
-        # 所有传感器均挂载到主车（attach_to=self.ego_vehicle.get_actor()）
-        self.sensors = [Sensor(world=self.world, attach_to=self.ego_vehicle.get_actor(), **sensor_config) for
-                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
-        sensors_batch = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.sensors]
-        for i, response in enumerate(self.client.apply_batch_sync(sensors_batch)):
-            if not response.error:
-                self.sensors[i].set_actor(response.actor_id)
-            else:
-                print(response.error)
-        self.sensors = list(filter(lambda sensor: sensor.get_actor(), self.sensors))
+    def get_spawn_region_mask(self,locations):
+        # in_spawn_region 的批量版本，locations 为 [N,>=3] 数组
+        radius = self.traffic["spawn_radius"]
+        if self.traffic["spawn_center"] == "ego" and self.ego_vehicle is not None:
+            route = np.array([[point.x,point.y,point.z] for point in [self.ego_vehicle.transform.location]+self.ego_vehicle.path])
+            return np.linalg.norm(locations[:,None,:3]-route[None],axis=2).min(axis=1) < radius
+        return (np.abs(locations[:,0]) < radius) & (np.abs(locations[:,1]) < radius)
 
-        ## 辅助车辆的传感器
-        self.aux_sensors1 = [Sensor(world=self.world, attach_to=self.aux_vehicle1.get_actor(), **sensor_config) for
-                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
-        aux_sensors_batch1 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors1]
-        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch1)):
-            if not response.error:
-                self.aux_sensors1[i].set_actor(response.actor_id)
-            else:
-                print(response.error)
-        self.aux_sensors1 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors1))
+    def spawn_background_from_plan(self,scene_config):
+        # 从生成计划中按区域筛选后随机采样；车辆与行人一次批量生成，随后批量生成行人控制器
+        SpawnActor = carla.command.SpawnActor
+        SetAutopilot = carla.command.SetAutopilot
+        FutureActor = carla.command.FutureActor
+        plan = self.spawn_plan
+        vehicle_indices = np.flatnonzero(self.get_spawn_region_mask(plan.vehicle_transforms)).tolist()
+        walker_indices = np.flatnonzero(self.get_spawn_region_mask(plan.walker_locations)).tolist()
+        random.shuffle(vehicle_indices)
+        random.shuffle(walker_indices)
+        vehicle_indices = vehicle_indices[:scene_config.get("num_vehicles",80)]
+        walker_indices = walker_indices[:scene_config.get("num_walkers",8)]
 
-        self.aux_sensors2 = [Sensor(world=self.world, attach_to=self.aux_vehicle2.get_actor(), **sensor_config) for
-                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
-        aux_sensors_batch2 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors2]
-        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch2)):
+        self.vehicles = []
+        for x,y,z,pitch,yaw,roll in plan.vehicle_transforms[vehicle_indices]:
+            vehicle = Vehicle(world=self.world,bp_name=random.choice(plan.vehicle_blueprints),
+                              location={"x":x,"y":y,"z":z},rotation={"pitch":pitch,"yaw":yaw,"roll":roll})
+            for attribute in ["color","driver_id"]:
+                if vehicle.blueprint.has_attribute(attribute):
+                    vehicle.blueprint.set_attribute(attribute,random.choice(vehicle.blueprint.get_attribute(attribute).recommended_values))
+            vehicle.blueprint.set_attribute('role_name','autopilot')
+            self.vehicles.append(vehicle)
+        self.walkers = []
+        walker_speeds = []
+        for x,y,z in plan.walker_locations[walker_indices]:
+            walker = Walker(world=self.world,bp_name=random.choice(plan.walker_blueprints),
+                            location={"x":x,"y":y,"z":z},rotation={"pitch":0.0,"yaw":0.0,"roll":0.0})
+            walker_speeds.append(float(walker.blueprint.get_attribute('speed').recommended_values[1]) if walker.blueprint.has_attribute('speed') else 0.0)
+            self.walkers.append(walker)
+
+        batch = [SpawnActor(vehicle.blueprint,vehicle.transform).then(SetAutopilot(FutureActor,True,self.trafficmanager.get_port()))
+                 for vehicle in self.vehicles]
+        batch += [SpawnActor(walker.blueprint,walker.transform) for walker in self.walkers]
+        for actor,response in zip(self.vehicles+self.walkers,self.client.apply_batch_sync(batch,True)):
             if not response.error:
-                self.aux_sensors2[i].set_actor(response.actor_id)
+                actor.set_actor(response.actor_id)
             else:
                 print(response.error)
-        self.aux_sensors2 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors2))
+        self.vehicles = list(filter(lambda vehicle:vehicle.get_actor(),self.vehicles))
+        walkers = [(walker,speed) for walker,speed in zip(self.walkers,walker_speeds) if walker.get_actor()]
 
-        self.aux_sensors3 = [Sensor(world=self.world, attach_to=self.aux_vehicle3.get_actor(), **sensor_config) for
-                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
-        aux_sensors_batch3 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors3]
-        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch3)):
+        walker_controller_bp = self.world.get_blueprint_library().find('controller.ai.walker')
+        controllers_batch = [SpawnActor(walker_controller_bp,carla.Transform(),walker.get_actor()) for walker,_ in walkers]
+        self.walkers = []
+        speeds = []
+        for (walker,speed),response in zip(walkers,self.client.apply_batch_sync(controllers_batch,True)):
             if not response.error:
-                self.aux_sensors3[i].set_actor(response.actor_id)
+                walker.set_controller(response.actor_id)
+                self.walkers.append(walker)
+                speeds.append(speed)
             else:
                 print(response.error)
-        self.aux_sensors3 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors3))
+                walker.destroy()
+        self.world.tick()
+        self.world.set_pedestrians_cross_factor(0.0)
+        for walker,speed in zip(self.walkers,speeds):
+            walker.start()
+            walker.controller.set_max_speed(speed)
+        print("环境实体生成完成：车辆",len(self.vehicles),"/",len(vehicle_indices),"，行人",len(self.walkers),"/",len(walker_indices))
 
-        self.aux_sensors4 = [Sensor(world=self.world, attach_to=self.aux_vehicle4.get_actor(), **sensor_config) for
-                        sensor_config in scene_config["calibrated_sensors"]["sensors"]]
-        aux_sensors_batch4 = [SpawnActor(sensor.blueprint, sensor.transform, sensor.attach_to) for sensor in self.aux_sensors4]
-        for i, response in enumerate(self.client.apply_batch_sync(aux_sensors_batch4)):
-            if not response.error:
-                self.aux_sensors4[i].set_actor(response.actor_id)
-            else:
-                print(response.error)
-        self.aux_sensors4 = list(filter(lambda sensor: sensor.get_actor(), self.aux_sensors4))
-        
 
     # def generate_custom_scene(self,scene_config):
     #
@@ -528,8 +667,58 @@ class Client:
     #             print(response.error)
     #     self.sensors = list(filter(lambda sensor:sensor.get_actor(),self.sensors))
 
+    def in_spawn_region(self,location):
+        radius = self.traffic["spawn_radius"]
+        if self.traffic["spawn_center"] == "ego" and self.ego_vehicle is not None:
+            route = [self.ego_vehicle.transform.location]+self.ego_vehicle.path
+            return min(location.distance(point) for point in route) < radius
+        return -radius < location.x < radius and -radius < location.y < radius
+
     def tick(self):
+        start = time.perf_counter()
         self.world.tick()
+        self.tick_times.append(time.perf_counter()-start)
+        if self.traffic["step_budget"] is not None and self.replay_actors is None and len(self.tick_times) == self.tick_times.maxlen:
+            if sum(self.tick_times)/len(self.tick_times) > self.traffic["step_budget"]:
+                self.shed_actors()
+                self.tick_times.clear()
+
+    def protect_actors(self,actor_ids,count=1):
+        # 可在关键帧处理线程中调用；count 为 -1 时解除一次保留
+        with self.shed_lock:
+            for actor_id in actor_ids:
+                self.shed_protected[actor_id] += count
+                if self.shed_protected[actor_id] <= 0:
+                    del self.shed_protected[actor_id]
+
+    def shed_actors(self):
+        # 超出耗时预算时，按距离主车由远到近剔除一部分从未被标注的背景车辆与行人（主车、辅助车辆不受影响）
+        ego_location = self.ego_vehicle.get_actor().get_location()
+        candidates = []
+        with self.shed_lock:
+            protected = set(self.shed_protected)
+        for actor in (self.vehicles or [])+(self.walkers or []):
+            if actor.get_actor().id in protected:
+                continue
+            distance = actor.get_actor().get_location().distance(ego_location)
+            if distance > self.traffic["shed_min_distance"]:
+                candidates.append((distance,actor))
+        candidates.sort(key=lambda item:item[0],reverse=True)
+        count = int(math.ceil(len(candidates)*self.traffic["shed_fraction"]))
+        shed = [actor for _,actor in candidates[:count]]
+        if not shed:
+            return
+        destroy_batch = []
+        for actor in shed:
+            if isinstance(actor,Walker) and actor.controller is not None:
+                actor.controller.stop()
+                destroy_batch.append(carla.command.DestroyActor(actor.controller.id))
+            destroy_batch.append(carla.command.DestroyActor(actor.get_actor().id))
+        self.client.apply_batch_sync(destroy_batch)
+        shed_ids = set(id(actor) for actor in shed)
+        self.vehicles = [vehicle for vehicle in self.vehicles or [] if id(vehicle) not in shed_ids]
+        self.walkers = [walker for walker in self.walkers or [] if id(walker) not in shed_ids]
+        print("tick over budget, shed",len(shed),"actors, remaining",len(self.vehicles)+len(self.walkers))
 
     def generate_random_scene(self,scene_config):
         print("generate random scene start!")
@@ -619,10 +808,137 @@ class Client:
         self.sensors = list(filter(lambda sensor:sensor.get_actor(),self.sensors))
         print("generate random scene success!")        
 
+    def get_trajectory_log(self):
+        # 按固定顺序登记需要记录轨迹的实体：主车、辅助车辆、背景车辆、行人
+        actors = [("ego",self.ego_vehicle)]
+        actors += [("aux"+str(i),getattr(self,"aux_vehicle"+str(i),None)) for i in range(1,5)]
+        actors += [("vehicle",vehicle) for vehicle in self.vehicles]+[("walker",walker) for walker in self.walkers]
+        actors = [(role,actor) for role,actor in actors if actor is not None and actor.get_actor() is not None]
+        weather = {key:getattr(self.weather,key) for key in WEATHER_KEYS if hasattr(self.weather,key)}
+        return TrajectoryLog([actor.get_actor().id for _,actor in actors],[role for role,_ in actors],[actor.bp_name for _,actor in actors],weather)
+
+    def record_tick(self,trajectory_log):
+        snapshot = self.world.get_snapshot()
+        transforms = []
+        for actor_id in trajectory_log.ids:
+            actor_snapshot = snapshot.find(int(actor_id))
+            if actor_snapshot is None:
+                transforms.append([np.nan]*6)
+                continue
+            transform = actor_snapshot.get_transform()
+            transforms.append([transform.location.x,transform.location.y,transform.location.z,
+                               transform.rotation.pitch,transform.rotation.yaw,transform.rotation.roll])
+        trajectory_log.append(snapshot.timestamp.elapsed_seconds,transforms)
+
+    def generate_replay_scene(self,scene_config,trajectory_log):
+        # 按轨迹日志重建场景：实体关闭物理、不挂交通管理器，每个 tick 前由 apply_replay_frame 写入记录的位姿
+        print("generate replay scene start!")
+        self.weather = carla.WeatherParameters(**trajectory_log.weather)
+        self.world.set_weather(self.weather)
+        SpawnActor = carla.command.SpawnActor
+        SetSimulatePhysics = carla.command.SetSimulatePhysics
+        FutureActor = carla.command.FutureActor
+        self.replay_actors = []
+        for role,bp_name,(x,y,z,pitch,yaw,roll) in zip(trajectory_log.roles,trajectory_log.blueprints,trajectory_log.get_frame(0).tolist()):
+            location = {"x":x,"y":y,"z":z}
+            rotation = {"pitch":pitch,"yaw":yaw,"roll":roll}
+            if role == "walker":
+                actor = Walker(world=self.world,bp_name=bp_name,location=location,rotation=rotation,destination=location)
+            else:
+                actor = Vehicle(world=self.world,bp_name=bp_name,location=location,rotation=rotation)
+                if role == "ego":
+                    actor.blueprint.set_attribute('role_name','hero')
+                elif role.startswith("aux"):
+                    actor.blueprint.set_attribute('role_name','hero'+role[3:])
+            self.replay_actors.append(actor)
+        replay_batch = [SpawnActor(actor.blueprint,actor.transform).then(SetSimulatePhysics(FutureActor,False)) for actor in self.replay_actors]
+        for i,response in enumerate(self.client.apply_batch_sync(replay_batch)):
+            if not response.error:
+                self.replay_actors[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+                self.replay_actors[i] = None
+        spawned = [(role,actor) for role,actor in zip(trajectory_log.roles,self.replay_actors) if actor is not None]
+        self.ego_vehicle = next(actor for role,actor in spawned if role == "ego")
+        for role,actor in spawned:
+            if role.startswith("aux"):
+                setattr(self,"aux_vehicle"+role[3:],actor)
+        self.vehicles = [actor for role,actor in spawned if role == "vehicle"]
+        self.walkers = [actor for role,actor in spawned if role == "walker"]
+
+        self.sensors = self.spawn_sensors(self.ego_vehicle,scene_config["calibrated_sensors"]["sensors"])
+        for role,actor in spawned:
+            if role.startswith("aux"):
+                setattr(self,"aux_sensors"+role[3:],self.spawn_sensors(actor,scene_config["calibrated_sensors"]["sensors"]))
+        print("generate replay scene success!")
+
+    def spawn_sensors(self,vehicle,sensors_config):
+        SpawnActor = carla.command.SpawnActor
+        sensors = [Sensor(world=self.world,attach_to=vehicle.get_actor(),**sensor_config) for sensor_config in sensors_config]
+        sensors_batch = [SpawnActor(sensor.blueprint,sensor.transform,sensor.attach_to) for sensor in sensors]
+        for i,response in enumerate(self.client.apply_batch_sync(sensors_batch)):
+            if not response.error:
+                sensors[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        return list(filter(lambda sensor:sensor.get_actor(),sensors))
+
+    def apply_replay_frame(self,trajectory_log,index):
+        ApplyTransform = carla.command.ApplyTransform
+        frame = trajectory_log.get_frame(min(index,len(trajectory_log)-1))
+        batch = []
+        for actor,(x,y,z,pitch,yaw,roll) in zip(self.replay_actors,frame.tolist()):
+            if actor is not None and not math.isnan(x):
+                batch.append(ApplyTransform(actor.get_actor().id,carla.Transform(carla.Location(x=x,y=y,z=z),carla.Rotation(pitch=pitch,yaw=yaw,roll=roll))))
+        self.client.apply_batch(batch)
+
+    def spawn_instance_cameras(self):
+        # 为每个 CAM_* 通道生成同位姿、同内参的实例分割相机（仅用于可见性计算，不保存数据）
+        SpawnActor = carla.command.SpawnActor
+        self.instance_cameras = []
+        for sensor in self.sensors:
+            if sensor.bp_name == 'sensor.camera.rgb' and sensor.name.startswith("CAM_"):
+                options = {key:sensor.blueprint.get_attribute(key).as_str() for key in ["image_size_x","image_size_y","fov","sensor_tick"]}
+                self.instance_cameras.append(Sensor(world=self.world,attach_to=sensor.attach_to,name=sensor.name,
+                                                    bp_name='sensor.camera.instance_segmentation',
+                                                    location={attr:getattr(sensor.transform.location,attr) for attr in ["x","y","z"]},
+                                                    rotation={attr:getattr(sensor.transform.rotation,attr) for attr in ["yaw","pitch","roll"]},
+                                                    options=options))
+        cameras_batch = [SpawnActor(camera.blueprint,camera.transform,camera.attach_to) for camera in self.instance_cameras]
+        for i,response in enumerate(self.client.apply_batch_sync(cameras_batch)):
+            if not response.error:
+                self.instance_cameras[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.instance_cameras = list(filter(lambda camera:camera.get_actor(),self.instance_cameras))
+
+    def spawn_rsu_sensors(self,rsus_config):
+        SpawnActor = carla.command.SpawnActor
+        self.rsu_sensors = [RoadsideSensor(world=self.world,rsu_name=rsu["name"],rsu_location=rsu["location"],rsu_rotation=rsu["rotation"],**sensor_config)
+                            for rsu in rsus_config for sensor_config in rsu["sensors"]]
+        rsu_batch = [SpawnActor(sensor.blueprint,sensor.spawn_transform) for sensor in self.rsu_sensors]
+        for i,response in enumerate(self.client.apply_batch_sync(rsu_batch)):
+            if not response.error:
+                self.rsu_sensors[i].set_actor(response.actor_id)
+            else:
+                print(response.error)
+        self.rsu_sensors = list(filter(lambda sensor:sensor.get_actor(),self.rsu_sensors))
+
+    def set_ingest_ring(self,ring):
+        # 只有写入数据集的传感器使用共享内存；辅助车辆传感器仅用于融合
+        for sensor in (self.sensors or [])+self.rsu_sensors:
+            if sensor.bp_name in SENSOR_MODALITIES:
+                sensor.ring = ring
+
+    def set_rsu_listening(self,listening):
+        for sensor in self.rsu_sensors:
+            sensor.set_listening(listening)
+
     def destroy_scene(self):
         if self.walkers is not None:
             for walker in self.walkers:
-                walker.controller.stop()
+                if walker.controller is not None:# 重放场景中的行人没有 AI 控制器
+                    walker.controller.stop()
                 walker.destroy()
         if self.vehicles is not None:
             for vehicle in self.vehicles:
@@ -630,14 +946,61 @@ class Client:
         if self.sensors is not None:
             for sensor in self.sensors:
                 sensor.destroy()
+        if self.instance_cameras is not None:
+            for camera in self.instance_cameras:
+                camera.destroy()
+            self.instance_cameras = None
+        for i in range(1,5):
+            # 自定义场景中的辅助车辆及其传感器，随场景一起销毁
+            for sensor in getattr(self,"aux_sensors"+str(i),None) or []:
+                sensor.destroy()
+            aux_vehicle = getattr(self,"aux_vehicle"+str(i),None)
+            if aux_vehicle is not None:
+                aux_vehicle.destroy()
+            setattr(self,"aux_sensors"+str(i),None)
+            setattr(self,"aux_vehicle"+str(i),None)
         if self.ego_vehicle is not None:
             self.ego_vehicle.destroy()
+        self.replay_actors = None
+        self.tick_times.clear()
+        with self.shed_lock:
+            self.shed_protected.clear()
+        self.set_rsu_listening(False)
+
+    def get_agent_sensors(self):
+        # agent 0 为主车，1-4 为自定义场景中的辅助车辆
+        agents = [(0,self.sensors or [])]
+        for i in range(1,5):
+            sensors = getattr(self,"aux_sensors"+str(i),None)
+            if sensors is not None:
+                agents.append((i,sensors))
+        return agents
+
+    def collect_agent_lidar(self,lidar_name):
+        return collect_agent_lidar(self.get_agent_sensors(),lidar_name)
+
+    def drop_sweeps(self):
+        # 内存超预算时每个 tick 只保留最新一帧，关键帧之间的 sweep 不再写入
+        for sensor in (self.sensors or [])+self.rsu_sensors+[sensor for _,sensors in self.get_agent_sensors()[1:] for sensor in sensors]:
+            data_list = sensor.get_data_list()
+            dropped = data_list[:-1]
+            del data_list[:len(dropped)]
+            release_slots(dropped)
+
+    def clear_agent_data(self):
+        for _,sensors in self.get_agent_sensors()[1:]:
+            for sensor in sensors:
+                sensor.get_data_list().clear()
 
 
     def destroy_world(self):
+        for sensor in self.rsu_sensors:
+            sensor.destroy()
+        self.rsu_sensors = []
         self.trafficmanager.set_synchronous_mode(False)
         self.ego_vehicle = None
         self.sensors = None
+        self.instance_cameras = None
         self.vehicles = None
         self.walkers = None
         self.world.apply_settings(self.original_settings)
@@ -655,29 +1018,44 @@ class Client:
             rotation,translation = get_nuscenes_rt(sensor.transform)
         return sensor_token,channel,translation,rotation,intrinsic
         
+    def start_scene_clock(self):
+        # 时间戳相对场景开始的帧计算，与服务器已运行的时间无关，重新生成的场景与原场景时间戳一致
+        self.scene_start_frame = self.world.get_snapshot().frame
+
+    def get_scene_timestamp(self,frame):
+        return transform_timestamp((frame-self.scene_start_frame)*self.settings.fixed_delta_seconds)
+
     def get_ego_pose(self,sample_data):
-        timestamp = transform_timestamp(sample_data[1].timestamp)
+        timestamp = self.get_scene_timestamp(sample_data[1].frame)
         rotation,translation = get_nuscenes_rt(sample_data[0])
         return timestamp,translation,rotation
+
+    def get_ego_poses(self,sample_data_list):
+        locations = [[data[0].location.x,data[0].location.y,data[0].location.z] for data in sample_data_list]
+        rotations = [[data[0].rotation.pitch,data[0].rotation.yaw,data[0].rotation.roll] for data in sample_data_list]
+        rotations,translations = get_nuscenes_rt_batch(get_transform_matrices(locations,rotations))
+        timestamps = [self.get_scene_timestamp(data[1].frame) for data in sample_data_list]
+        return list(zip(timestamps,translations.tolist(),rotations.tolist()))
     
     def get_sample_data(self,sample_data):
         height = 0
         width = 0
-        if isinstance(sample_data[1],carla.Image):
+        if isinstance(sample_data[1],(carla.Image,RingSlot)):
             height = sample_data[1].height
             width = sample_data[1].width
         return sample_data,height,width
 
     def get_sample(self):
-        return (transform_timestamp(self.world.get_snapshot().timestamp.elapsed_seconds),)
+        return (self.get_scene_timestamp(self.world.get_snapshot().frame),)
 
-    def get_instance(self,scene_token,instance):
+    def get_instance(self,scene_token,instance,index):
+        # index 为实体在 walkers+vehicles 中的生成顺序；actor id 由服务器分配，重新生成场景时会变化
         category_token = generate_token("category",self.category_dict[instance.blueprint.id])
-        id = hash((scene_token,instance.get_actor().id))
+        id = get_instance_key(scene_token,index)
         return category_token,id
 
-    def get_sample_annotation(self,scene_token,instance):
-        instance_token = generate_token("instance",hash((scene_token,instance.get_actor().id)))
+    def get_sample_annotation(self,scene_token,instance,index):
+        instance_token = generate_token("instance",get_instance_key(scene_token,index))
         visibility_token = str(self.get_visibility(instance))
         
         attribute_tokens = [generate_token("attribute",attribute) for attribute in self.get_attributes(instance)]
@@ -692,6 +1070,54 @@ class Client:
                 num_radar_pts += self.get_num_radar_pts(instance,sensor.get_last_data(),sensor.get_transform())
         return instance_token,visibility_token,attribute_tokens,translation,rotation,size,num_lidar_pts,num_radar_pts
 
+    def get_annotation_snapshot(self,instances,mode="raycast",visibility_points=(1,10,30,60)):
+        if mode in ["semantic_lidar","instance_camera"]:
+            # 语义激光雷达/实例分割相机模式：可见性与点数均由 object_idx 统计得到，不再调用 cast_ray
+            visible = [(instance,None) for instance in instances]
+        else:
+            # 仅在主线程执行依赖 cast_ray 的可见性判断，其余标注计算交给工作线程
+            visible = []
+            self.dynamic_boxes = self.get_dynamic_boxes(instances)
+            try:
+                for instance in instances:
+                    visibility = self.get_visibility(instance)
+                    if visibility > 0:
+                        visible.append((instance,visibility))
+            finally:
+                self.dynamic_boxes = None
+        snapshot = {
+            "ids":[instance.get_actor().id for instance,_ in visible],
+            "visibility_tokens":[str(visibility) for _,visibility in visible],
+            "attribute_tokens":[[generate_token("attribute",attribute) for attribute in self.get_attributes(instance)] for instance,_ in visible],
+            "matrices":np.array([instance.get_transform().get_matrix() for instance,_ in visible]).reshape(-1,4,4),
+            "extents":np.array([[extent.x,extent.y,extent.z] for extent in (instance.get_actor().bounding_box.extent for instance,_ in visible)]).reshape(-1,3),
+            "lidar":[],
+            "radar":[],
+            "semantic":None,
+            "cameras":None
+        }
+        if mode == "semantic_lidar":
+            snapshot["semantic"] = []
+            snapshot["visibility_points"] = list(visibility_points)
+        elif mode == "instance_camera":
+            snapshot["cameras"] = []
+            for camera in self.instance_cameras:
+                data = camera.get_last_data()
+                if data is not None:
+                    intrinsic = get_intrinsic(float(camera.get_actor().attributes["fov"]),data[1].width,data[1].height)
+                    snapshot["cameras"].append((np.array(camera.get_transform().get_matrix()),intrinsic,parse_image(data[1])))
+        for sensor in self.sensors:
+            data = sensor.get_last_data()
+            if data is None:
+                continue
+            if sensor.bp_name == 'sensor.lidar.ray_cast' and mode != "semantic_lidar":
+                snapshot["lidar"].append((np.array(sensor.get_transform().get_matrix()),get_lidar_points(data[1])))
+            elif sensor.bp_name == 'sensor.lidar.ray_cast_semantic' and mode == "semantic_lidar":
+                snapshot["semantic"].append(get_semantic_lidar_ids(data[1]))
+            elif sensor.bp_name == 'sensor.other.radar':
+                snapshot["radar"].append((np.array(sensor.get_transform().get_matrix()),get_radar_points(data[1])))
+        return snapshot
+
     def get_visibility(self,instance):
         max_visible_point_count = 0
         for sensor in self.sensors:
@@ -705,25 +1131,47 @@ class Client:
                     size = instance.get_size()
                     size.z = 0
                     check_point = instance_position-(i-2)*size*0.5
-                    ray_points =  self.world.cast_ray(ego_position,check_point)
-                    points = list(filter(lambda point:not self.ego_vehicle.get_actor().bounding_box.contains(point.location,self.ego_vehicle.get_actor().get_transform()) 
-                                        and not instance.get_actor().bounding_box.contains(point.location,instance.get_actor().get_transform()) 
-                                        and point.label is not carla.libcarla.CityObjectLabel.NONE,ray_points))
-                    if not points:
+                    if not self.is_ray_blocked(ego_position,check_point,instance):
                         visible_point_count1+=1
                     size.x = -size.x
                     check_point = instance_position-(i-2)*size*0.5
-                    ray_points =  self.world.cast_ray(ego_position,check_point)
-                    points = list(filter(lambda point:not self.ego_vehicle.get_actor().bounding_box.contains(point.location,self.ego_vehicle.get_actor().get_transform()) 
-                                        and not instance.get_actor().bounding_box.contains(point.location,instance.get_actor().get_transform()) 
-                                        and point.label is not carla.libcarla.CityObjectLabel.NONE,ray_points))
-                    if not points:
+                    if not self.is_ray_blocked(ego_position,check_point,instance):
                         visible_point_count2+=1
                 if max(visible_point_count1,visible_point_count2)>max_visible_point_count:
                     max_visible_point_count = max(visible_point_count1,visible_point_count2)
         visibility_dict = {0:0,1:1,2:1,3:2,4:3,5:4}
         return visibility_dict[max_visible_point_count]
 
+    def load_occlusion_grid(self,map_name,cache_dir,resolution=0.5,labels=("Buildings","Walls","Fences","Vegetation")):
+        self.occlusion_grid = load_occlusion_grid(self.world,map_name,cache_dir,resolution,labels)
+
+    def load_spawn_plan(self,map_name,cache_dir,walker_locations=1000,max_attempts=None):
+        self.spawn_plan = load_spawn_plan(self.world,map_name,cache_dir,walker_locations,max_attempts)
+
+    def get_dynamic_boxes(self,instances):
+        # 当前关键帧所有动态实体（场景实体与辅助车辆）的包围盒，供 is_ray_blocked 在本地判断射线是否经过动态实体
+        actors = list(instances)+[vehicle for vehicle in (getattr(self,"aux_vehicle"+str(i),None) for i in range(1,5)) if vehicle is not None]
+        return (np.array([actor.get_actor().id for actor in actors],dtype=np.int64),
+                np.array([actor.get_transform().get_matrix() for actor in actors],dtype=np.float64).reshape(-1,4,4),
+                np.array([[extent.x,extent.y,extent.z] for extent in (actor.get_actor().bounding_box.extent for actor in actors)],dtype=np.float64).reshape(-1,3))
+
+    def is_ray_blocked(self,start,end,instance):
+        # 静态遮挡（建筑、墙体等）查询本地栅格；栅格判断未遮挡时，只有线段经过其它动态实体的包围盒才用 cast_ray 确认
+        if self.occlusion_grid is not None:
+            start_point,end_point = [start.x,start.y,start.z],[end.x,end.y,end.z]
+            if self.occlusion_grid.is_occluded(start_point,end_point):
+                return True
+            if self.dynamic_boxes is not None:
+                ids,matrices,extents = self.dynamic_boxes
+                others = (ids != instance.get_actor().id)&(ids != self.ego_vehicle.get_actor().id)
+                if not np.any(get_segment_box_hits(start_point,end_point,matrices[others],extents[others])):
+                    return False
+        ray_points = self.world.cast_ray(start,end)
+        points = list(filter(lambda point:not self.ego_vehicle.get_actor().bounding_box.contains(point.location,self.ego_vehicle.get_actor().get_transform()) 
+                            and not instance.get_actor().bounding_box.contains(point.location,instance.get_actor().get_transform()) 
+                            and point.label is not carla.libcarla.CityObjectLabel.NONE,ray_points))
+        return len(points) > 0
+
     def get_attributes(self,instance):
         return self.attribute_dict[instance.bp_name]
 
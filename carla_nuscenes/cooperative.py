@@ -0,0 +1,62 @@
+import time
+import numpy as np
+from .sensor import parse_lidar_buffer,get_channel_counts
+from .utils import get_transform_matrices
+from .v2x import encode_points,encode_boxes
+
+AGENT_COLUMN = 5
+
+def get_sensor_matrices(sample_data_list,sensor_transforms):
+    # 传感器世界位姿 = 采集时刻父节点（车辆）位姿 @ 传感器安装位姿
+    parents = get_transform_matrices([[data[0].location.x,data[0].location.y,data[0].location.z] for data in sample_data_list],
+                                    [[data[0].rotation.pitch,data[0].rotation.yaw,data[0].rotation.roll] for data in sample_data_list])
+    mounts = get_transform_matrices([[t.location.x,t.location.y,t.location.z] for t in sensor_transforms],
+                                    [[t.rotation.pitch,t.rotation.yaw,t.rotation.roll] for t in sensor_transforms])
+    return parents@mounts
+
+def fuse_point_clouds(clouds,reference_matrix):
+    # clouds: [(agent_id,sensor_matrix,points)]，points 为 parse_lidar_data 格式的 (N,5)
+    # 返回参考传感器坐标系下的 (N,6) 点云，最后一列为 agent id
+    world_to_reference = np.linalg.inv(reference_matrix)
+    fused = []
+    for agent_id,sensor_matrix,points in clouds:
+        matrix = world_to_reference@sensor_matrix
+        cloud = np.empty((len(points),AGENT_COLUMN+1),dtype=np.float64)
+        cloud[:,:3] = points[:,:3]@matrix[:3,:3].T+matrix[:3,3]
+        cloud[:,3:AGENT_COLUMN] = points[:,3:AGENT_COLUMN]
+        cloud[:,AGENT_COLUMN] = agent_id
+        fused.append(cloud)
+    if not fused:
+        return np.zeros((0,AGENT_COLUMN+1),dtype=np.float64)
+    return np.concatenate(fused)
+
+def collect_agent_lidar(agent_sensors,lidar_name):
+    # agent_sensors: [(agent_id,sensors)]，agent 0 为主车；只取引用，不做解析，便于在主线程快速完成
+    return [(agent_id,sensor.get_last_data(),sensor.transform) for agent_id,sensors in agent_sensors
+            for sensor in sensors if sensor.name == lidar_name and sensor.get_last_data() is not None]
+
+def fuse_agent_lidar(agent_lidar):
+    if not agent_lidar or agent_lidar[0][0] != 0:
+        return None
+    matrices = get_sensor_matrices([data for _,data,_ in agent_lidar],[transform for _,_,transform in agent_lidar])
+    clouds = [(agent_id,matrix,parse_lidar_buffer(data[1].raw_data,get_channel_counts(data[1])))
+              for (agent_id,data,_),matrix in zip(agent_lidar,matrices)]
+    return agent_lidar[0][1],matrices[0],fuse_point_clouds(clouds,matrices[0])
+
+def build_v2x_messages(agent_lidar,snapshot,encoding=None,box_range=70.0):
+    # 每个辅助车辆发送两条消息：压缩后的激光雷达点云与感知范围内的目标框列表，附带编码耗时
+    messages = []
+    agent_lidar = [item for item in agent_lidar if item[0] != 0]
+    if not agent_lidar:
+        return messages
+    matrices = get_sensor_matrices([data for _,data,_ in agent_lidar],[transform for _,_,transform in agent_lidar])
+    for (agent_id,data,_),matrix in zip(agent_lidar,matrices):
+        start = time.perf_counter()
+        points = parse_lidar_buffer(data[1].raw_data,get_channel_counts(data[1]))
+        messages.append((agent_id,"points",encode_points(points,**(encoding or {})),time.perf_counter()-start))
+        start = time.perf_counter()
+        origin = matrix[:3,3]
+        in_range = np.linalg.norm(snapshot["matrices"][:,:3,3]-origin,axis=1) <= box_range
+        payload = encode_boxes(np.asarray(snapshot["ids"])[in_range],snapshot["matrices"][in_range],snapshot["extents"][in_range],origin)
+        messages.append((agent_id,"boxes",payload,time.perf_counter()-start))
+    return messages
@@ -1,38 +1,67 @@
 import os
-from .utils import load,dump,generate_token
+import numpy as np
+from .utils import load,dump,append_json,generate_token
 import carla
-from .sensor import parse_lidar_data,parse_radar_data
+from .sensor import parse_lidar_buffer,get_channel_counts,parse_radar_data,process_point_cloud
+from .table import Table,SCHEMAS
+from .shards import ShardWriter,ShardIndex
+from .ingest import RingSlot
+from .tokens import mint_token,mint_tokens
+from .reader import LIDAR_COLUMNS,RADAR_COLUMNS
 from copy import deepcopy
 
 def save_image(image,path):
     image.save_to_disk(path)
 
-def save_lidar_data(lidar_data,path):
-    points = parse_lidar_data(lidar_data)
+def save_lidar_data(lidar_data,path,processing=None):
+    points = parse_lidar_buffer(lidar_data.raw_data,get_channel_counts(lidar_data))
+    return save_points(points,path,processing)
+
+def save_points(points,path,processing=None):
+    # 返回处理前后的点数；num_lidar_pts 在快照阶段基于完整点云计算，不受影响
+    num_points = len(points)
+    if processing:
+        points = process_point_cloud(points,**processing)
     points.tofile(path)
+    return num_points,len(points)
 
 def save_radar_data(radar_data,path):
     points = parse_radar_data(radar_data)
     points.tofile(path)
 
-def save_sensor_data(data,path):
+def save_sensor_data(data,path,processing=None):
     if isinstance(data,carla.Image):
         save_image(data,path)
     elif isinstance(data,carla.RadarMeasurement):
         save_radar_data(data,path)
     elif isinstance(data,carla.LidarMeasurement):
-        save_lidar_data(data,path)   
+        return save_lidar_data(data,path,processing)
+    elif isinstance(data,np.ndarray):
+        return save_points(data,path,processing)
+
+LARGE_TABLES = ["ego_pose","sample_data","sample_annotation","sample","instance","sample_annotation_agent","v2x_message","sweep_annotation","lidar_processing"]
+# 点云文件每个点的列数，写入 sensor 表供读取与校验使用
+SENSOR_COLUMNS = {"lidar":LIDAR_COLUMNS,"radar":RADAR_COLUMNS}
+# 扩展表：不属于 nuScenes 标准表，首次写入时才创建
+AUX_TABLES = ["sample_annotation_agent","v2x_message","sweep_annotation","lidar_processing"]
 
 def mkdir(path):
     if not os.path.exists(path):
         os.mkdir(path)
 
 class Dataset:
-    def __init__(self,root,version,load=False):
+    def __init__(self,root,version,load=False,columnar=False,lazy=False,storage="files",shard_size=1<<30,shard_tmp_dir=None):
         self.root = root
         self.version = version
+        self.columnar = columnar
+        self.lazy = lazy
+        self.on_disk = set()
         self.json_dir = os.path.join(root,version)
         mkdir(self.root)
+        self.shard_writer = ShardWriter(root,shard_size,shard_tmp_dir) if storage == "shards" else None
+        self.ingest = None
+        self.lidar_processing = {} # 通道名 -> 激光雷达写盘前的处理参数（roi、voxel_size）
+        self.pending_processing = {}
         mkdir(self.json_dir)
         mkdir(os.path.join(self.root,"maps"))
         mkdir(os.path.join(self.root,"samples"))
@@ -57,35 +86,101 @@ class Dataset:
                         "current_scene_count":0
                         }
         }
+        for key in SCHEMAS:
+            self.data[key] = self.new_table(key)
         self.data_cache = {}
         if load:
+            for key in AUX_TABLES:
+                if os.path.exists(os.path.join(self.json_dir,key+".json")):
+                    self.data[key] = self.new_table(key)
+
             self.load()
         else:
             self.save()
 
+    def new_table(self,key,items=None):
+        items = [] if items is None else items
+        if self.columnar and key in SCHEMAS:
+            return Table.from_list(SCHEMAS[key],items)
+        return items
+
     def load(self):
         for key in self.data:
             json_path = os.path.join(self.json_dir,key+".json")
-            self.data[key] = load(json_path)
+            if self.lazy and key in LARGE_TABLES:
+                # 大表不在恢复时解析，新行在保存时追加写入已有文件
+                self.data[key] = self.new_table(key)
+                self.on_disk.add(key)
+                continue
+            self.data[key] = self.new_table(key,load(json_path))
+
+    def get_table(self,key):
+        if key in self.on_disk:
+            self.materialize(key)
+        return self.data[key]
+
+    def materialize(self,key):
+        json_path = os.path.join(self.json_dir,key+".json")
+        rows = self.data[key].to_list() if isinstance(self.data[key],Table) else self.data[key]
+        self.data[key] = self.new_table(key,load(json_path)+rows)
+        self.on_disk.discard(key)
+
+    def flush(self,key):
+        json_path = os.path.join(self.json_dir,key+".json")
+        rows = self.data[key].to_list() if isinstance(self.data[key],Table) else self.data[key]
+        if key in self.on_disk:
+            append_json(rows,json_path)
+        else:
+            dump(rows,json_path)
+        self.data[key] = self.new_table(key)
+        self.on_disk.add(key)
+
+    def flush_large_tables(self):
+        # 在场景边界把大表写出磁盘，之后与 lazy 模式一样追加写入
+        for key in LARGE_TABLES:
+            if key in self.data:
+                self.flush(key)
 
     def save(self):
+        if self.ingest is not None:
+            # 等待写盘进程完成，分片模式下把写好的临时文件加入分片
+            for filename,path,counts in self.ingest.flush():
+                if filename in self.pending_processing:
+                    self.set_lidar_processing_counts(self.pending_processing.pop(filename),counts)
+                if self.shard_writer is not None:
+                    self.shard_writer.add_file(filename,path)
+        if self.shard_writer is not None:
+            self.shard_writer.close()
         for key in self.data:
             json_path = os.path.join(self.json_dir,key+".json")
-            dump(self.data[key],json_path)
+            if key in self.on_disk or (self.lazy and key in LARGE_TABLES):
+                self.flush(key)
+            elif isinstance(self.data[key],Table):
+                dump(self.data[key].to_list(),json_path)
+            else:
+                dump(self.data[key],json_path)
             print(json_path)
 
     def get_item(self,key,token):
+        if isinstance(self.data[key],Table):
+            return self.data[key].get(token)
         for item in self.data[key]:
             if item["token"] == token:
                 return item
         return None
 
+    def get_map_token(self,name):
+        return generate_token("map",name)
+
     def update_map(self,name,category,replace=True):
         map_item = {}
         map_item["category"] = category
-        map_item["token"] = generate_token("map",name)
+        map_item["token"] = self.get_map_token(name)
         map_item["filename"] = os.path.join("maps",map_item["token"]+".png")
         map_item["log_tokens"] = []
+        if self.get_item("map",map_item["token"]) is not None:
+            # 每个场景前重新加载世界时会再次调用，保留已记录的 log
+            map_item["log_tokens"] = self.get_item("map",map_item["token"])["log_tokens"]
         if self.get_item("map",map_item["token"]) is None:
             self.data["map"].append(map_item)
         elif replace:
@@ -93,15 +188,19 @@ class Dataset:
             self.data["map"].append(map_item)
         return map_item["token"]
 
+    def get_log_token(self,map_token,date,time,timezone,vehicle):
+        return generate_token("log",map_token+vehicle+"-"+date+"-"+time+timezone)
+
     def update_log(self,map_token,date,time,timezone,vehicle,location,replace=True):
         log_item = {}
         log_item["logfile"] = vehicle+"-"+date+"-"+time+timezone
-        log_item["token"] = generate_token("log",map_token+log_item["logfile"])
+        log_item["token"] = self.get_log_token(map_token,date,time,timezone,vehicle)
         log_item["vehicle"] = vehicle
         log_item["date_captured"] = date
         log_item["location"] = location
         map_item = self.get_item("map",map_token)
-        map_item["log_tokens"].append(log_item["token"])
+        if log_item["token"] not in map_item["log_tokens"]:# 续跑、重新生成场景时同一 log 会再次更新
+            map_item["log_tokens"].append(log_item["token"])
         if self.get_item("log",log_item["token"]) is None:
             self.data["log"].append(log_item)
         elif replace:
@@ -109,11 +208,14 @@ class Dataset:
             self.data["log"].append(log_item)
         return log_item["token"]
 
-    def update_sensor(self,channel,modality,replace=True):
+    def update_sensor(self,channel,modality,replace=True,columns=None):
         sensor_item = {}
         sensor_item["token"] = generate_token("sensor",channel)
         sensor_item["channel"] = channel
         sensor_item["modality"] = modality
+        columns = SENSOR_COLUMNS.get(modality) if columns is None else columns
+        if columns is not None:
+            sensor_item["columns"] = columns
         if self.get_item("sensor",sensor_item["token"]) is None:
             self.data["sensor"].append(sensor_item)
         elif replace:
@@ -154,15 +256,32 @@ class Dataset:
             self.data["calibrated_sensor"].append(calibrated_sensor_item)
         return calibrated_sensor_item["token"]
 
-    def update_scene(self,log_token,description,replace=True):
+    def get_scene_name(self,scene_index=None,scene_count=None):
+        scene_index = self.data["progress"]["current_scene_index"] if scene_index is None else scene_index
+        scene_count = self.data["progress"]["current_scene_count"] if scene_count is None else scene_count
+        return "scene-"+str(scene_index)+"-"+str(scene_count)
+
+    def get_scene_seed(self,base_seed):
+        # 由 (world,capture,scene,count) 进度派生的 32 位场景种子
+        progress = self.data["progress"]
+        key = "-".join(str(value) for value in [base_seed,progress["current_world_index"],progress["current_capture_index"],
+                                                progress["current_scene_index"],progress["current_scene_count"]])
+        return int(generate_token("seed",key)[:8],16)
+
+    def get_scene_token(self,log_token,scene_index=None,scene_count=None):
+        return generate_token("scene",log_token+self.get_scene_name(scene_index,scene_count))
+
+    def update_scene(self,log_token,description,replace=True,seed=None):
         scene_item = {}
-        scene_item["name"] = "scene-"+str(self.data["progress"]["current_scene_index"])+"-"+str(self.data["progress"]["current_scene_count"])
-        scene_item["token"] = generate_token("scene",log_token+scene_item["name"])
+        scene_item["name"] = self.get_scene_name()
+        scene_item["token"] = self.get_scene_token(log_token)
         scene_item["description"] = description
         scene_item["log_token"] = log_token
         scene_item["nbr_samples"] = 0
         scene_item["first_sample_token"] = ""
         scene_item["last_sample_token"] = ""
+        if seed is not None:
+            scene_item["seed"] = seed
         if self.get_item("scene",scene_item["token"]) is None:
             self.data["scene"].append(scene_item)
         elif replace:
@@ -211,7 +330,10 @@ class Dataset:
         sample_data_item["prev"] = prev
         sample_data_item["next"] = ""
         filename = self.get_filename(sample_data_item)
-        save_sensor_data(sample_data[1],os.path.join(self.root,filename))
+        processing = self.lidar_processing.get(sensor["channel"]) if sensor["modality"] == "lidar" else None
+        counts = self.save_sensor_file(sample_data[1],filename,processing)
+        if processing:
+            self.update_lidar_processing(sample_data_item["token"],filename,counts)
         print(filename)
         sample_data_item["filename"] = filename
         if prev != "":
@@ -223,9 +345,77 @@ class Dataset:
             self.data["sample_data"].append(sample_data_item)
         return sample_data_item["token"]
 
-    def update_ego_pose(self,scene_token,calibrated_sensor_token,timestamp,translation,rotation,replace=True):
+    def update_sample_annotation_agent(self,sample_annotation_token,num_lidar_pts):
+        # 协同感知：融合点云中各 agent（0 为主车）落入该标注框的点数
+        if "sample_annotation_agent" not in self.data:
+            self.data["sample_annotation_agent"] = self.new_table("sample_annotation_agent")
+        agent_item = {}
+        agent_item["token"] = sample_annotation_token
+        agent_item["sample_annotation_token"] = sample_annotation_token
+        agent_item["num_lidar_pts"] = num_lidar_pts
+        self.data["sample_annotation_agent"].append(agent_item)
+        return agent_item["token"]
+
+    def update_v2x_message(self,sample_token,agent_id,kind,size,encode_time,arrived,delay):
+        # 模拟 V2X 链路：记录每个关键帧各 agent 消息的大小、编码耗时、是否在时延预算内到达（时间单位微秒）
+        if "v2x_message" not in self.data:
+            self.data["v2x_message"] = self.new_table("v2x_message")
+        message_item = {}
+        message_item["token"] = generate_token("v2x_message",sample_token+str(agent_id)+kind)
+        message_item["sample_token"] = sample_token
+        message_item["agent_id"] = agent_id
+        message_item["kind"] = kind
+        message_item["size"] = size
+        message_item["encode_time"] = int(encode_time*1e6)
+        message_item["arrived"] = arrived
+        message_item["delay"] = int(delay*1e6)
+        self.data["v2x_message"].append(message_item)
+        return message_item["token"]
+
+    def update_lidar_processing(self,sample_data_token,filename,counts):
+        # 记录裁剪/降采样前后的点数；共享内存写盘时点数在写盘进程完成后补上
+        if "lidar_processing" not in self.data:
+            self.data["lidar_processing"] = self.new_table("lidar_processing")
+        processing_item = {}
+        processing_item["token"] = sample_data_token
+        processing_item["sample_data_token"] = sample_data_token
+        processing_item["num_points_original"] = None
+        processing_item["num_points_retained"] = None
+        if counts is None:
+            self.pending_processing[filename] = processing_item
+        else:
+            self.set_lidar_processing_counts(processing_item,counts)
+        self.data["lidar_processing"].append(processing_item)
+        return processing_item["token"]
+
+    def set_lidar_processing_counts(self,processing_item,counts):
+        processing_item["num_points_original"],processing_item["num_points_retained"] = counts
+
+    def update_sweep_annotations(self,interpolated):
+        # 非关键帧 sample_data 的插值标注，prev/next 指向用于插值的相邻关键帧 sample_annotation
+        if "sweep_annotation" not in self.data:
+            self.data["sweep_annotation"] = self.new_table("sweep_annotation")
+        tokens = mint_tokens("sweep_annotation",interpolated["sample_data_tokens"],interpolated["instance_tokens"])
+        rows = zip(tokens,interpolated["sample_data_tokens"],interpolated["instance_tokens"],interpolated["prev_tokens"],interpolated["next_tokens"],
+                   interpolated["timestamps"].tolist(),interpolated["translations"].tolist(),interpolated["rotations"].tolist(),interpolated["sizes"].tolist())
+        for token,sample_data_token,instance_token,prev,next,timestamp,translation,rotation,size in rows:
+            sweep_annotation_item = {}
+            sweep_annotation_item["token"] = token
+            sweep_annotation_item["sample_data_token"] = sample_data_token
+            sweep_annotation_item["instance_token"] = instance_token
+            sweep_annotation_item["timestamp"] = timestamp
+            sweep_annotation_item["translation"] = translation
+            sweep_annotation_item["rotation"] = rotation
+            sweep_annotation_item["size"] = size
+            sweep_annotation_item["prev_annotation_token"] = prev
+            sweep_annotation_item["next_annotation_token"] = next
+            self.data["sweep_annotation"].append(sweep_annotation_item)
+        return len(interpolated["sample_data_tokens"])
+
+    def update_ego_pose(self,scene_token,calibrated_sensor_token,timestamp,translation,rotation,replace=True,token=None):
+        # token 可由调用方按关键帧批量生成（mint_tokens("ego_pose",scene_token,calibrated_sensor_token,timestamps)）
         ego_pose_item = {}
-        ego_pose_item["token"] = generate_token("ego_pose",scene_token+calibrated_sensor_token+str(timestamp))
+        ego_pose_item["token"] = token or mint_token("ego_pose",scene_token,calibrated_sensor_token,timestamp)
         ego_pose_item["timestamp"] = timestamp
         ego_pose_item["rotation"] = rotation
         ego_pose_item["translation"] = translation
@@ -288,9 +478,9 @@ class Dataset:
 
     def update_sample_annotation(self,prev,sample_token,instance_token,visibility_token,
                             attribute_tokens,translation,rotation,
-                            size,num_lidar_pts,num_radar_pts,replace=True):
+                            size,num_lidar_pts,num_radar_pts,replace=True,token=None):
         sample_annotation_item = {}
-        sample_annotation_item["token"] = generate_token("sample_annotation",sample_token+instance_token)
+        sample_annotation_item["token"] = token or mint_token("sample_annotation",sample_token,instance_token)
         sample_annotation_item["sample_token"] = sample_token
         sample_annotation_item["instance_token"] = instance_token
         sample_annotation_item["visibility_token"] = visibility_token
@@ -316,13 +506,33 @@ class Dataset:
             self.data["sample_annotation"].append(sample_annotation_item)
         return sample_annotation_item["token"]
 
+    def save_sensor_file(self,data,filename,processing=None):
+        if isinstance(data,RingSlot):
+            # 共享内存中的数据交给写盘进程异步处理
+            path = os.path.join(self.root,filename) if self.shard_writer is None else self.shard_writer.get_tmp_path(filename)
+            self.ingest.write(data,path,filename,processing)
+            return None
+        elif self.shard_writer is None:
+            return save_sensor_data(data,os.path.join(self.root,filename),processing)
+        tmp_path = self.shard_writer.get_tmp_path(filename)
+        counts = save_sensor_data(data,tmp_path,processing)
+        self.shard_writer.add_file(filename,tmp_path)
+        return counts
+
+    def read_file(self,filename):
+        if not hasattr(self,"shard_index"):
+            self.shard_index = ShardIndex(self.root)
+        return self.shard_index.read(filename)
+
     def get_filename(self,sample_data_item):
         channel = self.get_item("sensor",self.get_item("calibrated_sensor",sample_data_item["calibrated_sensor_token"])["sensor_token"])["channel"]
         if sample_data_item["is_key_frame"]:
             dir = "samples"
         else:
             dir = "sweeps"
-        log_file = self.get_item("log",self.get_item("scene",self.get_item("sample",sample_data_item["sample_token"])["scene_token"])["log_token"])["logfile"]
-        name = log_file+"_"+channel+"_"+str(sample_data_item["timestamp"])+"."+sample_data_item["fileformat"]
+        scene_item = self.get_item("scene",self.get_item("sample",sample_data_item["sample_token"])["scene_token"])
+        log_file = self.get_item("log",scene_item["log_token"])["logfile"]
+        # 时间戳相对场景开始，同一 log 下不同场景的时间戳会重复，文件名中加入场景名
+        name = log_file+"_"+scene_item["name"]+"_"+channel+"_"+str(sample_data_item["timestamp"])+"."+sample_data_item["fileformat"]
         filename = os.path.join(dir,channel,name)
         return filename
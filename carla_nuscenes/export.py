@@ -0,0 +1,199 @@
+import os
+import json
+import shutil
+import multiprocessing
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from .reader import DatasetReader
+from .annotation import get_box_corners
+from .utils import load,get_pose_matrices,rotation_matrices_to_quaternions
+
+# 按类别名最长前缀匹配，未匹配的类别记为 Misc
+KITTI_TYPES = {
+    "vehicle.car":"Car",
+    "vehicle.truck":"Truck",
+    "vehicle.construction":"Truck",
+    "vehicle.bus":"Bus",
+    "vehicle.bicycle":"Cyclist",
+    "vehicle.motorcycle":"Cyclist",
+    "human.pedestrian":"Pedestrian"
+}
+# visibility token（1-4 对应可见度由低到高，0 的标注不写入）到 KITTI occluded（0 完全可见，1 部分遮挡，2 大部分遮挡，3 未知）
+KITTI_OCCLUSION = {"1":2,"2":1,"3":1,"4":0}
+
+worker_state = {}
+
+def get_kitti_type(category,types=KITTI_TYPES):
+    prefixes = [prefix for prefix in types if category == prefix or category.startswith(prefix+".")]
+    return types[max(prefixes,key=len)] if prefixes else "Misc"
+
+def link_file(reader,filename,target):
+    # 普通文件优先硬链接（跨设备时复制），分片中的文件只能读出写入
+    os.makedirs(os.path.dirname(target),exist_ok=True)
+    if os.path.exists(target):
+        os.remove(target)
+    path,_,size = reader.shard_index.resolve(filename)
+    if size is not None:
+        with open(target,"wb") as f:
+            f.write(reader.shard_index.read(filename))
+        return
+    try:
+        os.link(path,target)
+    except OSError:
+        shutil.copyfile(path,target)
+
+def get_sensor_matrix(reader,sample_data):
+    # 全局坐标系 <- 传感器坐标系：采集时刻 ego_pose @ calibrated_sensor
+    calibrated_sensor = reader.get("calibrated_sensor",sample_data["calibrated_sensor_token"])
+    ego_pose = reader.get("ego_pose",sample_data["ego_pose_token"])
+    ego_matrix,sensor_matrix = get_pose_matrices([ego_pose["translation"],calibrated_sensor["translation"]],
+                                                 [ego_pose["rotation"],calibrated_sensor["rotation"]])
+    return ego_matrix@sensor_matrix
+
+def get_box_matrices(anns):
+    return get_pose_matrices([ann["translation"] for ann in anns],[ann["rotation"] for ann in anns])
+
+def get_kitti_labels(anns,categories,camera_from_global,intrinsic,width,height,types=KITTI_TYPES):
+    if not anns:
+        return []
+    boxes = camera_from_global@get_box_matrices(anns)
+    sizes = np.array([ann["size"] for ann in anns],dtype=np.float64) # nuScenes 尺寸顺序为 w,l,h，长度沿框的 x 轴
+    corners = get_box_corners(boxes,sizes[:,[1,0,2]]/2)
+    in_front = np.all(corners[...,2] > 0.1,axis=1)
+    projected = corners@intrinsic.T
+    uv = projected[...,:2]/np.maximum(projected[...,2:3],1e-6)
+    box_min,box_max = uv.min(axis=1),uv.max(axis=1)
+    clipped_min = np.clip(box_min,0,[width,height])
+    clipped_max = np.clip(box_max,0,[width,height])
+    area = np.prod(box_max-box_min,axis=1)
+    clipped_area = np.prod(clipped_max-clipped_min,axis=1)
+    keep = in_front & (clipped_area > 0)
+    truncated = 1-clipped_area/np.maximum(area,1e-6)
+    # KITTI 位置为框底面中心，rotation_y 为绕相机 y 轴（向下）的朝向角
+    locations = boxes[:,:3,3]-boxes[:,:3,2]*sizes[:,2:3]/2
+    rotation_y = np.arctan2(-boxes[:,2,0],boxes[:,0,0])
+    alpha = rotation_y-np.arctan2(locations[:,0],locations[:,2])
+    alpha = (alpha+np.pi)%(2*np.pi)-np.pi
+    labels = []
+    for i in np.flatnonzero(keep):
+        labels.append(" ".join([get_kitti_type(categories.get(anns[i]["instance_token"],""),types),
+                                "%.2f"%truncated[i],str(KITTI_OCCLUSION.get(anns[i]["visibility_token"],3)),"%.2f"%alpha[i]]
+                               +["%.2f"%value for value in [*clipped_min[i],*clipped_max[i],sizes[i,2],sizes[i,0],sizes[i,1],*locations[i],rotation_y[i]]]))
+    return labels
+
+def get_kitti_calib(intrinsic,camera_from_lidar,lidar_from_ego):
+    projection = np.hstack([intrinsic,np.zeros((3,1))])
+    lines = ["P"+str(i)+": "+" ".join("%.12e"%value for value in projection.flatten()) for i in range(4)]
+    lines.append("R0_rect: "+" ".join("%.12e"%value for value in np.identity(3).flatten()))
+    lines.append("Tr_velo_to_cam: "+" ".join("%.12e"%value for value in camera_from_lidar[:3].flatten()))
+    lines.append("Tr_imu_to_velo: "+" ".join("%.12e"%value for value in lidar_from_ego[:3].flatten()))
+    return lines
+
+def export_kitti_scene(reader,scene_token,out_dir,categories,camera="CAM_FRONT",lidar="LIDAR_TOP",types=KITTI_TYPES):
+    # 每个场景一个 KITTI 目录，帧号为场景内关键帧序号；图像硬链接（保留 jpg），点云转为 float32 x,y,z,intensity
+    scene_dir = os.path.join(out_dir,reader.get("scene",scene_token)["name"])
+    for name in ["image_2","velodyne","label_2","calib"]:
+        os.makedirs(os.path.join(scene_dir,name),exist_ok=True)
+    frame = 0
+    for sample_token in reader.sample_tokens(scene_token):
+        sample = reader.get_sample(sample_token)
+        if camera not in sample["data"] or lidar not in sample["data"]:
+            continue
+        camera_data,lidar_data = sample["data"][camera],sample["data"][lidar]
+        camera_calibration = reader.get("calibrated_sensor",camera_data["calibrated_sensor_token"])
+        lidar_calibration = reader.get("calibrated_sensor",lidar_data["calibrated_sensor_token"])
+        intrinsic = np.array(camera_calibration["camera_intrinsic"],dtype=np.float64)
+        camera_from_global = np.linalg.inv(get_sensor_matrix(reader,camera_data.record))
+        camera_from_lidar = camera_from_global@get_sensor_matrix(reader,lidar_data.record)
+        lidar_from_ego = np.linalg.inv(get_pose_matrices(lidar_calibration["translation"],lidar_calibration["rotation"])[0])
+        name = str(frame).zfill(6)
+        link_file(reader,camera_data["filename"],os.path.join(scene_dir,"image_2",name+os.path.splitext(camera_data["filename"])[1]))
+        np.ascontiguousarray(lidar_data.load()[:,:4],dtype=np.float32).tofile(os.path.join(scene_dir,"velodyne",name+".bin"))
+        labels = get_kitti_labels(sample["anns"],categories,camera_from_global,intrinsic,camera_data["width"],camera_data["height"],types)
+        with open(os.path.join(scene_dir,"label_2",name+".txt"),"w") as f:
+            f.write("\n".join(labels)+("\n" if labels else ""))
+        with open(os.path.join(scene_dir,"calib",name+".txt"),"w") as f:
+            f.write("\n".join(get_kitti_calib(intrinsic,camera_from_lidar,lidar_from_ego))+"\n")
+        frame += 1
+    return frame
+
+def export_openlabel_scene(reader,scene_token,out_dir,categories,lidar="LIDAR_TOP"):
+    # 每个场景一个 OpenLABEL JSON：目标框位于关键帧激光雷达坐标系，各传感器位姿作为逐帧 transform，传感器文件硬链接到 data/
+    scene = reader.get("scene",scene_token)
+    scene_dir = os.path.join(out_dir,scene["name"])
+    objects = {}
+    frames = {}
+    streams = {}
+    frame = 0
+    for sample_token in reader.sample_tokens(scene_token):
+        sample = reader.get_sample(sample_token)
+        if lidar not in sample["data"]:
+            continue
+        lidar_from_global = np.linalg.inv(get_sensor_matrix(reader,sample["data"][lidar].record))
+        frame_objects = {}
+        if sample["anns"]:
+            boxes = lidar_from_global@get_box_matrices(sample["anns"])
+            quaternions = rotation_matrices_to_quaternions(boxes[:,:3,:3])
+            for ann,box,quaternion in zip(sample["anns"],boxes,quaternions):
+                uid = ann["instance_token"]
+                if uid not in objects:
+                    objects[uid] = {"name":uid,"type":categories.get(uid,"")}
+                width,length,height = ann["size"]
+                frame_objects[uid] = {"object_data":{"cuboid":[{"name":"box3d","coordinate_system":lidar,
+                                                                "val":[*box[:3,3].tolist(),*quaternion[[1,2,3,0]].tolist(),length,width,height]}]}}
+        frame_streams = {}
+        transforms = {}
+        for channel,sample_data in sample["data"].items():
+            if channel not in streams:
+                streams[channel] = {"type":"camera" if sample_data["fileformat"] == "jpg" else "lidar" if sample_data["fileformat"] == "pcd.bin" else "radar"}
+            uri = os.path.join("data",channel,os.path.basename(sample_data["filename"]))
+            link_file(reader,sample_data["filename"],os.path.join(scene_dir,uri))
+            frame_streams[channel] = {"uri":uri,"stream_properties":{"sync":{"timestamp":sample_data["timestamp"]}}}
+            # 传感器坐标系 -> 全局坐标系（odom）
+            transforms[channel+"_to_odom"] = {"src":channel,"dst":"odom",
+                                              "transform_src_to_dst":{"matrix4x4":get_sensor_matrix(reader,sample_data.record).flatten().tolist()}}
+        frames[str(frame)] = {"objects":frame_objects,
+                              "frame_properties":{"timestamp":sample["timestamp"],"streams":frame_streams,"transforms":transforms}}
+        frame += 1
+    coordinate_systems = {"odom":{"type":"scene_cs","parent":"","children":list(streams)}}
+    for channel in streams:
+        coordinate_systems[channel] = {"type":"sensor_cs","parent":"odom","children":[]}
+    openlabel = {"openlabel":{"metadata":{"schema_version":"1.0.0","name":scene["name"],"comment":scene["description"]},
+                              "coordinate_systems":coordinate_systems,
+                              "streams":streams,
+                              "objects":objects,
+                              "frames":frames,
+                              "frame_intervals":[{"frame_start":0,"frame_end":frame-1}] if frame > 0 else []}}
+    os.makedirs(scene_dir,exist_ok=True)
+    with open(os.path.join(scene_dir,scene["name"]+".json"),"w") as f:
+        json.dump(openlabel,f,separators=(',',':'))
+    return frame
+
+EXPORTERS = {"kitti":export_kitti_scene,"openlabel":export_openlabel_scene}
+
+def get_instance_categories(json_dir):
+    categories = {category["token"]:category["name"] for category in load(os.path.join(json_dir,"category.json"))}
+    return {instance["token"]:categories.get(instance["category_token"],"") for instance in load(os.path.join(json_dir,"instance.json"))}
+
+def init_worker(root,version,categories):
+    worker_state["reader"] = DatasetReader(root,version)
+    worker_state["categories"] = categories
+
+def export_scene(format,scene_token,out_dir,options):
+    return EXPORTERS[format](worker_state["reader"],scene_token,out_dir,worker_state["categories"],**options)
+
+def export_dataset(root,version,out_dir,format="kitti",workers=4,scene_tokens=None,**options):
+    # 按场景分发到进程池；索引在主进程中先建立并缓存，工作进程直接加载
+    reader = DatasetReader(root,version)
+    categories = get_instance_categories(reader.json_dir)
+    scene_tokens = [scene["token"] for scene in reader.scenes()] if scene_tokens is None else scene_tokens
+    os.makedirs(out_dir,exist_ok=True)
+    if workers <= 0:
+        worker_state["reader"] = reader
+        worker_state["categories"] = categories
+        return {scene_token:export_scene(format,scene_token,out_dir,options) for scene_token in scene_tokens}
+    del reader
+    with ProcessPoolExecutor(max_workers=workers,mp_context=multiprocessing.get_context("fork"),
+                             initializer=init_worker,initargs=(root,version,categories)) as executor:
+        futures = {scene_token:executor.submit(export_scene,format,scene_token,out_dir,options) for scene_token in scene_tokens}
+        return {scene_token:future.result() for scene_token,future in futures.items()}
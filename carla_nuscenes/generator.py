@@ -1,19 +1,128 @@
 from .client import Client
 from .dataset import Dataset
+from .annotation import AnnotationPool
+from .v2x import V2XNetwork
+from .trajectory import TrajectoryLog,get_trajectory_path
+from .utils import generate_token
+from .sensor import SENSOR_MODALITIES
+from .supervisor import ServerSupervisor,ServerFailure
+from .pipeline import KeyframePipeline
+from .cooperative import fuse_agent_lidar,build_v2x_messages
+from .ingest import IngestRing,IngestFailure,release_slots
+from .interpolation import collect_scene_rows,interpolate_sweep_annotations
+from .memory import MemoryMonitor,MemoryBudgetExceeded,get_buffer_sizes,merge_peak_sizes
+from .tokens import mint_tokens
+from .reader import FUSED_LIDAR_COLUMNS
 import traceback
 
 class Generator:
     def __init__(self,config):
         self.config = config
+        self.check_annotation_mode()
+        # 共享内存采集：回调只拷贝原始数据，解码与写盘在独立进程中完成
+        # 写盘进程在启动/探测服务器之前创建：probe_server 会创建 carla.Client，fork 时不能复制客户端线程
+        ingest_config = self.config.get("ingest",{})
+        self.ingest_ring = None
+        if ingest_config.get("enabled",False):
+            self.ingest_ring = IngestRing(ingest_config.get("slot_size",8<<20),ingest_config.get("slots",64),ingest_config.get("workers",4),
+                                          ingest_config.get("context","fork"))
+        # 服务器监控：RPC 超时或进程退出时重启（或等待外部重启）服务器，重连后从最近保存的场景继续
+        supervisor_config = self.config.get("supervisor",{})
+        self.supervisor = ServerSupervisor(self.config["client"]["host"],self.config["client"]["port"],**supervisor_config)
+        self.supervisor.start()
+        if not self.supervisor.wait_ready():
+            if self.ingest_ring is not None:
+                self.ingest_ring.close()
+            raise ServerFailure("server not ready at "+self.supervisor.host+":"+str(self.supervisor.port)+" after "+str(self.supervisor.startup_timeout)+"s")
         self.collect_client = Client(self.config["client"])
+        self.annotation_config = self.config.get("annotation",{})
+        self.annotation_pool = AnnotationPool(self.annotation_config.get("workers",4))
+        self.cooperative_config = self.config.get("cooperative",{})
+        self.v2x_config = self.config.get("v2x",{})
+        self.trajectory_config = self.config.get("trajectory",{})
+        # 流水线：关键帧写盘/标注在独立线程中执行，与后续帧的 tick 重叠；depth 为 0 时串行执行
+        self.pipeline = KeyframePipeline(self.config.get("pipeline",{}).get("depth",0))
+        # 内存统计：每个场景保存后记录 RSS 与各数据结构大小，超出预算时逐级写出大表、丢弃 sweep、在场景边界停止
+        self.memory_monitor = MemoryMonitor(**self.config.get("memory",{}))
+        self.drop_sweeps = False
+        self.scene_buffers = {}
+        self.v2x_network = None
+        if self.v2x_config.get("enabled",False):
+            self.v2x_network = V2XNetwork(self.v2x_config.get("links"),self.v2x_config.get("encoding"),self.v2x_config.get("max_delay",0.1),
+                                          self.v2x_config.get("box_range",70.0),self.v2x_config.get("seed",0))
         print('111',self.collect_client.client.get_available_maps())
 
+    def check_annotation_mode(self):
+        # semantic_lidar 模式的点数与可见性只来自语义激光雷达，未配置时所有标注都会被丢弃，启动前检查每个场景
+        if self.config.get("annotation",{}).get("mode","raycast") != "semantic_lidar":
+            return
+        missing = []
+        for world_index,world_config in enumerate(self.config["worlds"]):
+            for capture_index,capture_config in enumerate(world_config["captures"]):
+                for scene_index,scene_config in enumerate(capture_config["scenes"]):
+                    sensors = scene_config.get("calibrated_sensors",{}).get("sensors",[])
+                    if not any(sensor.get("bp_name") == "sensor.lidar.ray_cast_semantic" for sensor in sensors):
+                        missing.append(str(world_index)+","+str(capture_index)+","+str(scene_index))
+        if missing:
+            raise ValueError("annotation.mode is semantic_lidar but no sensor.lidar.ray_cast_semantic is configured in calibrated_sensors of scenes "
+                             +"; ".join(missing))
+
     def generate_dataset(self,load=False):
         #初始化数据集（指定保存路径、版本，是否加载已有进度）
         self.dataset = Dataset(**self.config["dataset"],load=load)
+        self.dataset.ingest = self.ingest_ring
         print("self.dataset.data",self.dataset.data["progress"])
+        self.update_metadata()
+        try:
+            while True:
+                try:
+                    self.generate_worlds()
+                    break
+                except ServerFailure:
+                    traceback.print_exc()
+                    self.recover()
+                except MemoryBudgetExceeded as e:
+                    # 进度已保存，可以加载已有数据集继续生成
+                    print("stopped:",e)
+                    break
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        # 无论正常结束还是放弃恢复都要结束工作线程、写盘进程并释放共享内存
+        self.pipeline.shutdown()
+        self.annotation_pool.shutdown()
+        if self.ingest_ring is not None:
+            self.ingest_ring.close()
+
+    def recover(self):
+        # 重启/等待服务器并重连，丢弃未保存的场景，从磁盘上的检查点（progress）继续
+        self.annotation_pool.discard()
+        if self.ingest_ring is not None:
+            self.ingest_ring.reset(clear_written=True)
+        if self.dataset.shard_writer is not None:
+            self.dataset.shard_writer.discard()
+        self.supervisor.recover(self.collect_client.reconnect)
+        self.dataset = Dataset(**self.config["dataset"],load=True)
+        self.dataset.ingest = self.ingest_ring
+        self.update_metadata()
+        print("resume from",self.dataset.data["progress"])
+
+    def teardown(self,destroy):
+        # 卡死的服务器端口仍然打开，只有 RPC 探测能判断；清理失败只记录，不能替换正在传播的 ServerFailure
+        try:
+            if self.supervisor.is_ready():
+                destroy()
+        except Exception:
+            traceback.print_exc()
+
+    def update_metadata(self):
         for sensor in self.config["sensors"]:
             self.dataset.update_sensor(sensor["name"],sensor["modality"])
+            if sensor["modality"] == "lidar" and sensor.get("processing"):
+                self.dataset.lidar_processing[sensor["name"]] = sensor["processing"]
+        if self.cooperative_config.get("fuse_lidar",False):
+            self.dataset.update_sensor(self.cooperative_config.get("channel","LIDAR_TOP_FUSED"),"lidar",columns=FUSED_LIDAR_COLUMNS)
         for category in self.config["categories"]:
             self.dataset.update_category(category["name"],category["description"])
         for attribute in self.config["attributes"]:
@@ -21,12 +130,13 @@ class Generator:
         for visibility in self.config["visibility"]:
             self.dataset.update_visibility(visibility["description"],visibility["level"])
 
+    def generate_worlds(self):
         ## 循环生成每个世界（地图）的数据集
         print("self.config", self.config["worlds"])
         for world_config in self.config["worlds"][self.dataset.data["progress"]["current_world_index"]:]:
             try:
-                self.collect_client.generate_world(world_config)# # 生成CARLA世界（加载地图、设置同步模式等）
-                map_token = self.dataset.update_map(world_config["map_name"],world_config["map_category"])# 更新地图信息到数据集
+                map_token = self.setup_world(world_config)
+                fresh = True
                 for capture_config in world_config["captures"][self.dataset.data["progress"]["current_capture_index"]:]:
                     log_token = self.dataset.update_log(map_token,capture_config["date"],capture_config["time"],
                                             capture_config["timezone"],capture_config["capture_vehicle"],capture_config["location"])
@@ -41,81 +151,302 @@ class Generator:
                         # 循环生成 scene_config["count"] 次场景（这里是 1 次）
                         for scene_count in range(self.dataset.data["progress"]["current_scene_count"],scene_config["count"]):
                             self.dataset.update_scene_count()
+                            if self.config.get("seed") is not None and not fresh:
+                                map_token = self.reset_world(world_config)
+                            fresh = False
                             self.add_one_scene(log_token,scene_config)
                             self.dataset.save()
+                            self.supervisor.restarts = 0 # max_restarts 只限制连续失败次数
+                            self.check_memory()
                         self.dataset.update_scene_index()
                     self.dataset.update_capture_index()
                 self.dataset.update_world_index()
-            except:
+            except (MemoryBudgetExceeded,IngestFailure):
+                raise
+            except Exception as e:
+                if self.supervisor.is_failure(e):
+                    raise ServerFailure(str(e)) from e
                 traceback.print_exc()
             finally:
-                self.collect_client.destroy_world()
+                self.teardown(self.collect_client.destroy_world)
+
+    def setup_world(self,world_config):
+        self.collect_client.generate_world(world_config)# # 生成CARLA世界（加载地图、设置同步模式等）
+        if "occlusion_grid" in self.annotation_config:
+            self.collect_client.load_occlusion_grid(world_config["map_name"],**self.annotation_config["occlusion_grid"])
+        if "spawn_plan" in self.config:
+            # 在生成场景实体之前加载（首次使用时构建并缓存），之后每个场景只从计划中采样
+            self.collect_client.load_spawn_plan(world_config["map_name"],**self.config["spawn_plan"])
+        map_token = self.dataset.update_map(world_config["map_name"],world_config["map_category"])# 更新地图信息到数据集
+        # 路侧单元传感器的标定按地图记录一次，同一地图的所有场景共用
+        self.rsu_calibrated_sensors_token = {}
+        for sensor in self.collect_client.rsu_sensors:
+            self.dataset.update_sensor(sensor.name,SENSOR_MODALITIES[sensor.bp_name])
+            self.rsu_calibrated_sensors_token[sensor.name] = self.dataset.update_calibrated_sensor(map_token,*self.collect_client.get_calibrated_sensor(sensor))
+        return map_token
+
+    def get_scene_token(self,world_index,capture_index,scene_index,scene_count):
+        world_config = self.config["worlds"][world_index]
+        capture_config = world_config["captures"][capture_index]
+        log_token = self.dataset.get_log_token(self.dataset.get_map_token(world_config["map_name"]),capture_config["date"],capture_config["time"],
+                                               capture_config["timezone"],capture_config["capture_vehicle"])
+        return self.dataset.get_scene_token(log_token,scene_index,scene_count)
+
+    def reset_world(self,world_config):
+        # 带种子时每个场景都在重新加载的世界中生成，上一场景残留的交通/行人状态不影响当前场景，与单独重新生成时一致
+        self.collect_client.destroy_world()
+        return self.setup_world(world_config)
+
+    def regenerate_scenes(self,scenes,load=False):
+        # 按 (world_index,capture_index,scene_index,scene_count) 单独重新生成场景，scene_count 与场景名 scene-<index>-<count> 一致
+        # 场景种子与 token 只依赖这些序号，可在不同机器上并行生成到各自的 dataset.root 后用 compare_scenes 比较；返回生成的场景 token
+        try:
+            self.dataset = Dataset(**self.config["dataset"],load=load)
+            self.dataset.ingest = self.ingest_ring
+            self.update_metadata()
+            scenes = sorted(scenes)
+            # 已有的场景不覆盖：旧场景的 sample/sample_data/标注行会与新行混在一起
+            existing = [scene for scene in scenes if self.dataset.get_item("scene",self.get_scene_token(*scene)) is not None]
+            if existing:
+                raise ValueError("scenes already exist in "+self.dataset.root+": "+", ".join(",".join(map(str,scene)) for scene in existing))
+            # 重新生成不改变续跑进度：每个场景生成后恢复 progress 再保存
+            progress = dict(self.dataset.data["progress"])
+            scene_tokens = []
+            for world_index in sorted(set(scene[0] for scene in scenes)):
+                world_config = self.config["worlds"][world_index]
+                try:
+                    map_token = self.setup_world(world_config)
+                    fresh = True
+                    for _,capture_index,scene_index,scene_count in [scene for scene in scenes if scene[0] == world_index]:
+                        if self.config.get("seed") is not None and not fresh:
+                            map_token = self.reset_world(world_config)
+                        fresh = False
+                        capture_config = world_config["captures"][capture_index]
+                        log_token = self.dataset.update_log(map_token,capture_config["date"],capture_config["time"],
+                                                capture_config["timezone"],capture_config["capture_vehicle"],capture_config["location"])
+                        self.dataset.data["progress"].update({"current_world_index":world_index,"current_capture_index":capture_index,
+                                                              "current_scene_index":scene_index,"current_scene_count":scene_count})
+                        try:
+                            self.add_one_scene(log_token,capture_config["scenes"][scene_index])
+                        finally:
+                            self.dataset.data["progress"] = dict(progress)
+                        self.dataset.save()
+                        scene_tokens.append(self.dataset.get_scene_token(log_token,scene_index,scene_count))
+                finally:
+                    self.teardown(self.collect_client.destroy_world)
+        finally:
+            self.shutdown()
+        return scene_tokens
+
+    def check_memory(self):
+        record = self.memory_monitor.report(self.dataset.get_scene_name(),self.dataset,self.scene_buffers)
+        action = self.memory_monitor.check(record["rss"])
+        if action == "flush":
+            self.dataset.flush_large_tables()
+        elif action == "drop_sweeps":
+            self.drop_sweeps = True
+        elif action == "stop":
+            raise MemoryBudgetExceeded("rss "+str(record["rss"]>>20)+" MB exceeds budget after "+record["scene"])
                 
     def add_one_scene(self,log_token,scene_config):
+        self.scene_buffers = {}
         try:
             calibrated_sensors_token = {}
             samples_data_token = {}
             instances_token = {}
             samples_annotation_token = {}
 
-            self.collect_client.generate_scene(scene_config)
-            scene_token = self.dataset.update_scene(log_token,scene_config["description"])
+            # 轨迹日志：record 模式下记录每个 tick 的实体位姿；replay 模式下按日志重建场景，只重新渲染传感器
+            trajectory_path = get_trajectory_path(self.trajectory_config.get("dir","./trajectories"),log_token,self.dataset.get_scene_name())
+            trajectory_log = None
+            # 场景种子在生成任何实体之前设置
+            seed = None
+            if self.config.get("seed") is not None:
+                seed = self.dataset.get_scene_seed(self.config["seed"])
+                self.collect_client.set_seed(seed)
+            if self.trajectory_config.get("replay",False):
+                trajectory_log = TrajectoryLog.load(trajectory_path)
+                self.collect_client.generate_replay_scene(scene_config,trajectory_log)
+            else:
+                self.collect_client.generate_scene(scene_config)
+                if self.trajectory_config.get("record",False):
+                    trajectory_log = self.collect_client.get_trajectory_log()
+            self.collect_client.set_ingest_ring(self.ingest_ring)
+            if self.annotation_config.get("mode","raycast") == "instance_camera":
+                self.collect_client.spawn_instance_cameras()
+            scene_token = self.dataset.update_scene(log_token,scene_config["description"],seed=seed)
             print("scene_token",scene_token)
 
-            for instance in self.collect_client.walkers+self.collect_client.vehicles:
-                # 获取实例（车辆/行人）的基本信息，生成唯一标识 instance_token
-                instance_token = self.dataset.update_instance(*self.collect_client.get_instance(scene_token,instance))
+            for index,instance in enumerate(self.collect_client.walkers+self.collect_client.vehicles):
+                # 获取实例（车辆/行人）的基本信息，按生成顺序生成唯一标识 instance_token
+                instance_token = self.dataset.update_instance(*self.collect_client.get_instance(scene_token,instance,index))
                 # 用 Carla 内部的 actor ID 作为键，存储实例标识（便于后续帧中快速查找）
                 instances_token[instance.get_actor().id] = instance_token
                 # 初始化标注标识（后续关键帧中会更新为实际标注的 token）
                 samples_annotation_token[instance.get_actor().id] = ""
             
             for sensor in self.collect_client.sensors:
+                if sensor.bp_name not in SENSOR_MODALITIES:
+                    continue # 仅用于标注的传感器（语义激光雷达）不写入 sensor/calibrated_sensor 表
                 # 获取传感器的校准参数，生成唯一标识 calibrated_sensor_token
                 calibrated_sensor_token = self.dataset.update_calibrated_sensor(scene_token,*self.collect_client.get_calibrated_sensor(sensor))
                 # 用传感器名称作为键，存储校准标识（便于后续关联传感器数据）
                 calibrated_sensors_token[sensor.name] = calibrated_sensor_token
                 # 初始化传感器数据标识（后续关键帧中会更新为实际数据的 token）
                 samples_data_token[sensor.name] = ""
+                if self.cooperative_config.get("fuse_lidar",False) and sensor.name == self.cooperative_config.get("lidar","LIDAR_TOP"):
+                    # 融合点云通道沿用主车激光雷达的外参，点坐标位于主车激光雷达坐标系
+                    fused_channel = self.cooperative_config.get("channel","LIDAR_TOP_FUSED")
+                    _,_,translation,rotation,intrinsic = self.collect_client.get_calibrated_sensor(sensor)
+                    calibrated_sensors_token[fused_channel] = self.dataset.update_calibrated_sensor(scene_token,generate_token("sensor",fused_channel),
+                                                                                                    fused_channel,translation,rotation,intrinsic)
+                    samples_data_token[fused_channel] = ""
 
-            sample_token = ""   # 关键帧的唯一标识（初始为空，第一帧会生成）
+            for sensor in self.collect_client.rsu_sensors:
+                calibrated_sensors_token[sensor.name] = self.rsu_calibrated_sensors_token[sensor.name]
+                samples_data_token[sensor.name] = ""
+            self.collect_client.set_rsu_listening(True)
+            if self.v2x_network is not None:
+                self.v2x_network.reset(seed)
+            # 场景级状态：关键帧处理阶段按提交顺序更新 sample/sample_data/sample_annotation 的 prev/next 链接
+            scene = {"token":scene_token,
+                     "sample_token":"",   # 关键帧的唯一标识（初始为空，第一帧会生成）
+                     "calibrated_sensors_token":calibrated_sensors_token,
+                     "samples_data_token":samples_data_token,
+                     "instances_token":instances_token,
+                     "samples_annotation_token":samples_annotation_token,
+                     # 处理过程中记录本场景的行，sweep 插值不再扫描整张表（见 collect_scene_rows）
+                     "samples":[],
+                     "sweeps":[],
+                     "annotations":[]}
             # 计算总帧数：场景采集时间 ÷ 模拟器帧间隔（固定为 0.01 秒）
             # 例如：collect_time=1 秒 → 1 / 0.01 = 100 帧
             #按模拟器的最小时间单位（帧）循环推进场景，确保所有动态变化（车辆移动、传感器数据生成）被逐帧捕获。
-            for frame_count in range(int(scene_config["collect_time"]/self.collect_client.settings.fixed_delta_seconds)):
+            frame_total = int(scene_config["collect_time"]/self.collect_client.settings.fixed_delta_seconds)
+            if self.trajectory_config.get("replay",False):
+                frame_total = min(frame_total,len(trajectory_log))
+            self.collect_client.start_scene_clock()
+            for frame_count in range(frame_total):
                 print("frame count:",frame_count)
+                if self.trajectory_config.get("replay",False):
+                    self.collect_client.apply_replay_frame(trajectory_log,frame_count)
                 self.collect_client.tick()## 触发 Carla 模拟器更新一帧
+                if self.drop_sweeps:
+                    self.collect_client.drop_sweeps()
+                if self.trajectory_config.get("record",False) and not self.trajectory_config.get("replay",False):
+                    self.collect_client.record_tick(trajectory_log)
                 # 推进模拟器时间（前进 fixed_delta_seconds 秒，即 0.01 秒）。
                 # 更新所有实体的状态：车辆按轨迹移动、行人行走、主车行驶。
                 # 触发传感器（相机、激光雷达等）生成当前帧的原始数据（如 RGB 图像、点云），并缓存到 sensor.get_data_list() 中。
 
                 # 计算关键帧间隔帧数：keyframe_time ÷ 帧间隔 → 例如 0.5 秒 / 0.01 秒 = 50 帧
                 if (frame_count+1)%int(scene_config["keyframe_time"]/self.collect_client.settings.fixed_delta_seconds) == 0:
-                    i = 0
-                    i += 1
-                    print(f"关键帧，保存数据的帧{i}")
-                    sample_token = self.dataset.update_sample(sample_token,scene_token,*self.collect_client.get_sample())# 更新关键帧信息，生成唯一标识 sample_token
-                    # 遍历所有传感器（只处理指定类型：相机、雷达、激光雷达）
-                    for sensor in self.collect_client.sensors:
-                        if sensor.bp_name in ['sensor.camera.rgb','sensor.other.radar','sensor.lidar.ray_cast']:
-                            # 遍历传感器在当前帧缓存的所有数据（可能有多帧，如雷达可能一次返回多段数据）
-                            for idx,sample_data in enumerate(sensor.get_data_list()):
-                                # 1. 记录主车在该传感器数据采集时的位姿（位置+朝向）
-                                ego_pose_token = self.dataset.update_ego_pose(scene_token,calibrated_sensors_token[sensor.name],*self.collect_client.get_ego_pose(sample_data))
-                                is_key_frame = False # 2. 标记是否为该传感器在当前关键帧的最后一段数据
-                                if idx == len(sensor.get_data_list())-1:
-                                    is_key_frame = True# 最后一段数据标记为关键帧（用于后续数据关联）
-                                # 3. 保存传感器数据到数据集
-                                samples_data_token[sensor.name] = self.dataset.update_sample_data(samples_data_token[sensor.name],calibrated_sensors_token[sensor.name],sample_token,ego_pose_token,is_key_frame,*self.collect_client.get_sample_data(sample_data))
-                    # 遍历所有车辆和行人
-                    for instance in self.collect_client.walkers+self.collect_client.vehicles:
-                        # 只处理可见的实体（在传感器视野内，无遮挡或部分遮挡）
-                        if self.collect_client.get_visibility(instance) > 0:
-                            # 更新该实体在当前关键帧的标注信息
-                            samples_annotation_token[instance.get_actor().id]  = self.dataset.update_sample_annotation(samples_annotation_token[instance.get_actor().id],sample_token,*self.collect_client.get_sample_annotation(scene_token,instance))
-                    for sensor in self.collect_client.sensors:
-                        sensor.get_data_list().clear()
-        except:
+                    print("关键帧，frame count:",frame_count)
+                    # 主线程只抓取关键帧数据，写盘与标注交给处理阶段；pipeline.depth > 0 时与后续 tick 并行
+                    self.pipeline.submit(self.process_keyframe,scene,self.capture_keyframe())
+            self.pipeline.drain()
+            self.annotation_pool.commit(self.dataset,instances_token,samples_annotation_token,block=True,protect=self.collect_client.protect_actors,collected=scene["annotations"])
+            if self.annotation_config.get("interpolate_sweeps",False):
+                self.add_sweep_annotations(scene)
+            if self.trajectory_config.get("record",False) and not self.trajectory_config.get("replay",False):
+                trajectory_log.save(trajectory_path)
+        except Exception as e:
+            if self.supervisor.is_failure(e):
+                raise ServerFailure(str(e)) from e
             traceback.print_exc()
         finally:
-            self.collect_client.destroy_scene()
\ No newline at end of file
+            # 传感器缓存在销毁场景后不再可见，在此之前记录
+            merge_peak_sizes(self.scene_buffers,get_buffer_sizes(self.collect_client))
+            self.pipeline.discard()
+            self.annotation_pool.discard()
+            self.teardown(self.collect_client.destroy_scene)
+            if self.ingest_ring is not None:
+                self.ingest_ring.reset()
+
+    def capture_keyframe(self):
+        # 读取所有依赖模拟器状态的数据（时间戳、实体快照、传感器缓存），随后清空缓存以便继续 tick
+        keyframe = {}
+        keyframe["sample"] = self.collect_client.get_sample()
+        # 抓取当前关键帧的状态快照（实体位姿、包围盒、传感器位姿与点云），标注计算交给工作线程池
+        keyframe["snapshot"] = self.collect_client.get_annotation_snapshot(self.collect_client.walkers+self.collect_client.vehicles,
+                                                                          self.annotation_config.get("mode","raycast"),
+                                                                          self.annotation_config.get("visibility_points",(1,10,30,60)))
+        # 快照中的实体在该关键帧的标注提交前不会被剔除
+        self.collect_client.protect_actors(keyframe["snapshot"]["ids"])
+        # 只处理指定类型的传感器：相机、雷达、激光雷达
+        keyframe["sensor_data"] = [(sensor.name,list(sensor.get_data_list())) for sensor in self.collect_client.sensors+self.collect_client.rsu_sensors
+                                   if sensor.bp_name in ['sensor.camera.rgb','sensor.other.radar','sensor.lidar.ray_cast']]
+        # 缓存在关键帧之间增长，清空前记录峰值
+        merge_peak_sizes(self.scene_buffers,get_buffer_sizes(self.collect_client))
+        keyframe["agent_lidar"] = {}
+        if self.cooperative_config.get("fuse_lidar",False):
+            lidar_name = self.cooperative_config.get("lidar","LIDAR_TOP")
+            keyframe["agent_lidar"][lidar_name] = self.collect_client.collect_agent_lidar(lidar_name)
+        if self.v2x_network is not None:
+            lidar_name = self.v2x_config.get("lidar","LIDAR_TOP")
+            keyframe["agent_lidar"][lidar_name] = self.collect_client.collect_agent_lidar(lidar_name)
+        for sensor in self.collect_client.sensors+self.collect_client.rsu_sensors+(self.collect_client.instance_cameras or []):
+            sensor.get_data_list().clear()
+        self.collect_client.clear_agent_data()
+        return keyframe
+
+    def process_keyframe(self,scene,keyframe):
+        scene["sample_token"] = self.dataset.update_sample(scene["sample_token"],scene["token"],*keyframe["sample"])# 更新关键帧信息，生成唯一标识 sample_token
+        sample_token = scene["sample_token"]
+        scene["samples"].append((sample_token,keyframe["sample"][0]))
+        calibrated_sensors_token = scene["calibrated_sensors_token"]
+        samples_data_token = scene["samples_data_token"]
+        snapshot = keyframe["snapshot"]
+        for name,data_list in keyframe["sensor_data"]:
+            # 遍历传感器在当前帧缓存的所有数据（可能有多帧，如雷达可能一次返回多段数据）
+            # 批量计算该传感器所有数据对应的主车位姿
+            ego_poses = self.collect_client.get_ego_poses(data_list)
+            ego_pose_tokens = mint_tokens("ego_pose",scene["token"],calibrated_sensors_token[name],[ego_pose[0] for ego_pose in ego_poses])
+            for idx,sample_data in enumerate(data_list):
+                # 1. 记录主车在该传感器数据采集时的位姿（位置+朝向）
+                ego_pose_token = self.dataset.update_ego_pose(scene["token"],calibrated_sensors_token[name],*ego_poses[idx],token=ego_pose_tokens[idx])
+                is_key_frame = False # 2. 标记是否为该传感器在当前关键帧的最后一段数据
+                if idx == len(data_list)-1:
+                    is_key_frame = True# 最后一段数据标记为关键帧（用于后续数据关联）
+                # 3. 保存传感器数据到数据集
+                samples_data_token[name] = self.dataset.update_sample_data(samples_data_token[name],calibrated_sensors_token[name],sample_token,ego_pose_token,is_key_frame,*self.collect_client.get_sample_data(sample_data))
+                if not is_key_frame:
+                    scene["sweeps"].append((samples_data_token[name],ego_poses[idx][0],calibrated_sensors_token[name]))
+        fused_channel = self.cooperative_config.get("channel","LIDAR_TOP_FUSED")
+        if fused_channel in calibrated_sensors_token:
+            samples_data_token[fused_channel] = self.add_fused_lidar(scene["token"],sample_token,calibrated_sensors_token[fused_channel],samples_data_token[fused_channel],
+                                                                     snapshot,keyframe["agent_lidar"][self.cooperative_config.get("lidar","LIDAR_TOP")])
+        if self.v2x_network is not None:
+            self.add_v2x_messages(sample_token,snapshot,keyframe["agent_lidar"][self.v2x_config.get("lidar","LIDAR_TOP")])
+        # 提交快照，已完成的标注按关键帧顺序写入数据集
+        self.annotation_pool.submit(sample_token,snapshot)
+        self.annotation_pool.commit(self.dataset,scene["instances_token"],scene["samples_annotation_token"],protect=self.collect_client.protect_actors,collected=scene["annotations"])
+        for _,data_list in keyframe["sensor_data"]:
+            release_slots(data_list)
+
+    def add_sweep_annotations(self,scene):
+        # 场景结束后按相邻关键帧标注批量插值出 sweep 标注，不再逐帧调用模拟器
+        channels = self.annotation_config.get("sweep_channels")
+        calibrated_sensor_tokens = None
+        if channels is not None:
+            calibrated_sensor_tokens = set(scene["calibrated_sensors_token"][channel] for channel in channels if channel in scene["calibrated_sensors_token"])
+        interpolated = interpolate_sweep_annotations(*collect_scene_rows(scene["samples"],scene["annotations"],scene["sweeps"],calibrated_sensor_tokens))
+        if interpolated is not None:
+            self.dataset.update_sweep_annotations(interpolated)
+
+    def add_fused_lidar(self,scene_token,sample_token,calibrated_sensor_token,prev,snapshot,agent_lidar):
+        # 将主车与辅助车辆的激光雷达点云统一变换到主车激光雷达坐标系，写入融合通道（第 6 列为 agent id）
+        fused_lidar = fuse_agent_lidar(agent_lidar)
+        if fused_lidar is None:
+            return prev
+        sample_data,reference_matrix,points = fused_lidar
+        snapshot["fused"] = (reference_matrix,points)
+        ego_pose_token = self.dataset.update_ego_pose(scene_token,calibrated_sensor_token,*self.collect_client.get_ego_pose(sample_data))
+        return self.dataset.update_sample_data(prev,calibrated_sensor_token,sample_token,ego_pose_token,True,(sample_data[0],points),0,0)
+
+    def add_v2x_messages(self,sample_token,snapshot,agent_lidar):
+        # 辅助车辆经模拟 V2X 链路向主车发送点云与目标框，记录到达情况与时延
+        messages = build_v2x_messages(agent_lidar,snapshot,self.v2x_network.encoding,self.v2x_network.box_range)
+        timestamp = self.dataset.get_item("sample",sample_token)["timestamp"]/10e6 # transform_timestamp 的逆变换
+        for record in self.v2x_network.exchange(timestamp,messages):
+            self.dataset.update_v2x_message(sample_token,*record)
@@ -0,0 +1,206 @@
+import queue
+import threading
+import numpy as np
+import multiprocessing
+from multiprocessing import shared_memory
+
+class RingSlot:
+    # 环形缓冲区中的一帧传感器数据，提供与 carla 测量对象相同的常用属性（raw_data、timestamp 等）
+    def __init__(self,ring,index,nbytes,kind,timestamp,frame,width=0,height=0,channel_counts=None):
+        self.ring = ring
+        self.index = index
+        self.nbytes = nbytes
+        self.kind = kind
+        self.timestamp = timestamp
+        self.frame = frame
+        self.width = width
+        self.height = height
+        self.channel_counts = channel_counts
+
+    @property
+    def raw_data(self):
+        return self.ring.view(self.index)[:self.nbytes]
+
+    @property
+    def channels(self):
+        return len(self.channel_counts)
+
+    def get_point_count(self,channel):
+        return self.channel_counts[channel]
+
+    def release(self):
+        self.ring.release(self.index)
+
+class IngestFailure(Exception):
+    pass
+
+def release_slots(data_list):
+    for _,data in data_list:
+        if isinstance(data,RingSlot):
+            data.release()
+
+def write_payload(buffer,kind,width,height,channel_counts,path,processing=None):
+    # 返回激光雷达处理前后的点数，其余类型返回 None
+    if kind == "camera":
+        from PIL import Image
+        Image.frombuffer("RGBA",(width,height),bytes(buffer),"raw","BGRA",0,1).convert("RGB").save(path)
+    elif kind == "lidar":
+        from .sensor import parse_lidar_buffer,process_point_cloud
+        points = parse_lidar_buffer(buffer,channel_counts)
+        num_points = len(points)
+        if processing:
+            points = process_point_cloud(points,**processing)
+        points.tofile(path)
+        return num_points,len(points)
+    elif kind == "radar":
+        np.frombuffer(buffer,dtype=np.dtype('f4')).tofile(path)
+    else:
+        raise ValueError("unknown payload kind: "+str(kind))
+
+def write_worker(shm_name,slot_size,jobs,results):
+    shm = shared_memory.SharedMemory(name=shm_name)
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        index,nbytes,kind,width,height,channel_counts,path,filename,processing = job
+        buffer = shm.buf[index*slot_size:index*slot_size+nbytes]
+        counts = None
+        error = None
+        try:
+            counts = write_payload(buffer,kind,width,height,channel_counts,path,processing)
+        except Exception as e:
+            error = repr(e)
+        finally:
+            buffer.release()
+        results.put((index,filename,path,counts,error))
+    shm.close()
+
+class IngestRing:
+    # 传感器回调只把 raw_data 拷贝进预分配的共享内存槽位；解码、编码与写盘在独立进程中完成
+    # 槽位引用计数：主进程持有一份（关键帧处理结束后释放），每个写盘任务持有一份
+    # 入口脚本没有 __main__ 保护，默认 fork；应在连接 carla 之前创建，避免复制客户端线程
+    def __init__(self,slot_size=8<<20,slots=64,workers=4,context="fork",poll_interval=1.0):
+        self.slot_size = slot_size
+        self.poll_interval = poll_interval
+        self.slots = slots
+        self.shm = shared_memory.SharedMemory(create=True,size=slot_size*slots)
+        self.free = queue.Queue()
+        for index in range(slots):
+            self.free.put(index)
+        self.refs = [0]*slots
+        self.lock = threading.Lock()
+        self.done = threading.Condition(self.lock)
+        self.pending = 0
+        self.written = []
+        self.errors = []
+        mp_context = multiprocessing.get_context(context)
+        self.jobs = mp_context.Queue()
+        self.results = mp_context.Queue()
+        self.workers = [mp_context.Process(target=write_worker,args=(self.shm.name,slot_size,self.jobs,self.results),daemon=True)
+                        for _ in range(workers)]
+        for worker in self.workers:
+            worker.start()
+        self.reclaimer = threading.Thread(target=self.reclaim,daemon=True)
+        self.reclaimer.start()
+
+    def view(self,index):
+        return self.shm.buf[index*self.slot_size:(index+1)*self.slot_size]
+
+    def acquire(self,data,kind):
+        # 在 carla 回调线程中调用；数据过大或槽位耗尽时立即返回 None，由调用方保留原始对象（不阻塞回调线程）
+        raw = memoryview(data.raw_data).cast("B")
+        if len(raw) > self.slot_size:
+            return None
+        try:
+            index = self.free.get_nowait()
+        except queue.Empty:
+            return None
+        with self.lock:
+            self.refs[index] = 1
+        self.view(index)[:len(raw)] = raw
+        width = getattr(data,"width",0) if kind == "camera" else 0
+        height = getattr(data,"height",0) if kind == "camera" else 0
+        channel_counts = [data.get_point_count(channel) for channel in range(data.channels)] if kind == "lidar" else None
+        return RingSlot(self,index,len(raw),kind,data.timestamp,data.frame,width,height,channel_counts)
+
+    def write(self,slot,path,filename,processing=None):
+        with self.lock:
+            self.refs[slot.index] += 1
+            self.pending += 1
+        self.jobs.put((slot.index,slot.nbytes,slot.kind,slot.width,slot.height,slot.channel_counts,path,filename,processing))
+
+    def release(self,index):
+        with self.lock:
+            self.refs[index] -= 1
+            if self.refs[index] == 0:
+                self.free.put(index)
+
+    def reclaim(self):
+        while True:
+            result = self.results.get()
+            if result is None:
+                return
+            index,filename,path,counts,error = result
+            with self.done:
+                if error is None:
+                    self.written.append((filename,path,counts))
+                else:
+                    self.errors.append((filename,error))
+                self.pending -= 1
+                self.done.notify_all()
+            self.release(index)
+
+    def check_workers(self):
+        dead = [worker for worker in self.workers if not worker.is_alive()]
+        if dead:
+            raise IngestFailure("writer process exited (pid "+", ".join(str(worker.pid)+" code "+str(worker.exitcode) for worker in dead)+"), "
+                                +str(self.pending)+" sensor files not written")
+
+    def wait(self):
+        # 写盘进程被杀死（如 OOM）时它的任务不会返回，定期检查进程状态，避免 save/recover/shutdown 永久阻塞
+        with self.done:
+            while self.pending > 0:
+                self.check_workers()
+                self.done.wait(self.poll_interval)
+
+    def flush(self):
+        # 等待所有写盘任务完成，返回已写入的 (filename,path,counts)
+        self.wait()
+        with self.lock:
+            written,self.written = self.written,[]
+            errors,self.errors = self.errors,[]
+        if errors:
+            raise RuntimeError("failed to write sensor files: "+"; ".join(filename+": "+error for filename,error in errors))
+        return written
+
+    def reset(self,clear_written=False):
+        # 场景结束后回收仍被缓存引用的槽位（这些数据不会再被写入）
+        self.wait()
+        with self.lock:
+            self.refs = [0]*self.slots
+            self.free = queue.Queue()
+            for index in range(self.slots):
+                self.free.put(index)
+            if clear_written:
+                self.written = []
+                self.errors = []
+
+    def close(self):
+        # 写盘进程异常退出时结束其余进程（任务队列可能已不可用），仍然释放共享内存
+        failed = True
+        try:
+            self.wait()
+            failed = False
+        finally:
+            for worker in self.workers:
+                if failed:
+                    worker.terminate()
+                else:
+                    self.jobs.put(None)
+            for worker in self.workers:
+                worker.join()
+            self.results.put(None)
+            self.reclaimer.join()
+            self.shm.close()
+            self.shm.unlink()
@@ -0,0 +1,73 @@
+import numpy as np
+
+def slerp(q0,q1,t):
+    # 四元数 [w,x,y,z] 的批量球面线性插值，取最短路径
+    q0 = np.asarray(q0,dtype=np.float64)
+    q1 = np.asarray(q1,dtype=np.float64)
+    t = np.asarray(t,dtype=np.float64)
+    dot = np.sum(q0*q1,axis=1)
+    q1 = np.where(dot[:,None] < 0,-q1,q1)
+    dot = np.clip(np.abs(dot),0.0,1.0)
+    theta = np.arccos(dot)
+    sin_theta = np.sin(theta)
+    small = sin_theta < 1e-6
+    safe_sin = np.where(small,1.0,sin_theta)
+    w0 = np.where(small,1-t,np.sin((1-t)*theta)/safe_sin)
+    w1 = np.where(small,t,np.sin(t*theta)/safe_sin)
+    q = w0[:,None]*q0+w1[:,None]*q1
+    return q/np.linalg.norm(q,axis=1,keepdims=True)
+
+def collect_scene_rows(samples,annotations,sweeps,calibrated_sensor_tokens=None):
+    # 输入为处理场景时按提交顺序记录的行，不再扫描整张表
+    # annotations: [(token,sample_token,instance_token,prev,translation,rotation,size)]；sweeps: [(sample_data_token,timestamp,calibrated_sensor_token)]
+    following = {annotation[3]:annotation[0] for annotation in annotations if annotation[3] != ""}
+    annotations = [(token,sample_token,instance_token,following.get(token,""),translation,rotation,size)
+                   for token,sample_token,instance_token,_,translation,rotation,size in annotations]
+    sweeps = [(token,timestamp) for token,timestamp,calibrated_sensor_token in sweeps
+              if calibrated_sensor_tokens is None or calibrated_sensor_token in calibrated_sensor_tokens]
+    return samples,annotations,sweeps
+
+def interpolate_sweep_annotations(samples,annotations,sweeps):
+    # samples: [(token,timestamp)]；annotations: [(token,sample_token,instance_token,next,translation,rotation,size)]
+    # sweeps: [(sample_data_token,timestamp)]
+    # 对落在相邻关键帧之间的每个 sweep，插值两帧中都出现的实例：平移/尺寸线性插值，朝向 slerp
+    samples = sorted(samples,key=lambda sample:sample[1])
+    if len(samples) < 2 or not annotations or not sweeps:
+        return None
+    sample_index = {token:i for i,(token,_) in enumerate(samples)}
+    sample_times = np.array([timestamp for _,timestamp in samples],dtype=np.float64)
+    annotation_index = {annotation[0]:i for i,annotation in enumerate(annotations)}
+    # 相邻关键帧之间的标注对，按区间排序
+    pairs = [(sample_index[annotation[1]],i,annotation_index[annotation[3]]) for i,annotation in enumerate(annotations)
+             if annotation[3] in annotation_index and sample_index[annotations[annotation_index[annotation[3]]][1]] == sample_index[annotation[1]]+1]
+    if not pairs:
+        return None
+    pairs = np.array(sorted(pairs),dtype=np.int64)
+    sweep_times = np.array([timestamp for _,timestamp in sweeps],dtype=np.float64)
+    sweep_intervals = np.searchsorted(sample_times,sweep_times,side="right")-1
+    valid = np.flatnonzero((sweep_intervals >= 0) & (sweep_intervals < len(samples)-1))
+    valid = valid[np.argsort(sweep_intervals[valid],kind="stable")]
+    pair_counts = np.bincount(pairs[:,0],minlength=len(samples))
+    pair_starts = np.concatenate([[0],np.cumsum(pair_counts)[:-1]])
+    # 区间内所有 sweep 与所有标注对的笛卡尔积
+    repeats = pair_counts[sweep_intervals[valid]]
+    sweep_rows = np.repeat(valid,repeats)
+    offsets = np.arange(len(sweep_rows))-np.repeat(np.cumsum(repeats)-repeats,repeats)
+    if len(sweep_rows) == 0:
+        return None
+    pair_rows = pair_starts[sweep_intervals[sweep_rows]]+offsets
+    interval = sweep_intervals[sweep_rows]
+    t = (sweep_times[sweep_rows]-sample_times[interval])/(sample_times[interval+1]-sample_times[interval])
+    first = pairs[pair_rows,1]
+    second = pairs[pair_rows,2]
+    translations = np.array([annotation[4] for annotation in annotations],dtype=np.float64)
+    rotations = np.array([annotation[5] for annotation in annotations],dtype=np.float64)
+    sizes = np.array([annotation[6] for annotation in annotations],dtype=np.float64)
+    return {"sample_data_tokens":[sweeps[i][0] for i in sweep_rows],
+            "instance_tokens":[annotations[i][2] for i in first],
+            "prev_tokens":[annotations[i][0] for i in first],
+            "next_tokens":[annotations[i][0] for i in second],
+            "timestamps":sweep_times[sweep_rows].astype(np.int64),
+            "translations":translations[first]+t[:,None]*(translations[second]-translations[first]),
+            "rotations":slerp(rotations[first],rotations[second],t),
+            "sizes":sizes[first]+t[:,None]*(sizes[second]-sizes[first])}
@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import time
+import resource
+import tracemalloc
+from itertools import islice
+from .table import Table
+
+ACTIONS = ["flush","drop_sweeps","stop"]
+
+class MemoryBudgetExceeded(Exception):
+    pass
+
+def get_rss():
+    # 当前常驻内存（字节）；非 Linux 时退化为峰值 RSS
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1])*1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+def estimate_rows_bytes(rows,sample_size=100):
+    # 按前 sample_size 行的平均大小估算列表表的内存占用
+    if not rows:
+        return sys.getsizeof(rows)
+    sample = list(islice(iter(rows),sample_size))
+    row_bytes = sum(sys.getsizeof(row)+sum(sys.getsizeof(value) for value in row.values()) for row in sample)/len(sample)
+    return int(sys.getsizeof(rows)+row_bytes*len(rows))
+
+def get_table_sizes(dataset):
+    sizes = {}
+    for key,rows in dataset.data.items():
+        if isinstance(rows,Table):
+            sizes[key] = {"rows":len(rows),"bytes":rows.nbytes()}
+        elif isinstance(rows,list):
+            sizes[key] = {"rows":len(rows),"bytes":estimate_rows_bytes(rows)}
+    return sizes
+
+def get_data_bytes(data):
+    nbytes = getattr(data,"nbytes",None)
+    if nbytes is not None:
+        return nbytes
+    return len(data.raw_data)
+
+def get_buffer_sizes(client):
+    # 各传感器缓存中未处理的数据帧数与字节数；辅助车辆传感器单独统计
+    groups = {"sensors":client.sensors or [],
+              "rsu_sensors":client.rsu_sensors or [],
+              "instance_cameras":client.instance_cameras or []}
+    for agent_id,sensors in client.get_agent_sensors()[1:]:
+        groups["aux_sensors"+str(agent_id)] = sensors
+    sizes = {}
+    for group,sensors in groups.items():
+        data_lists = [list(sensor.get_data_list()) for sensor in sensors]
+        sizes[group] = {"items":sum(len(data_list) for data_list in data_lists),
+                        "bytes":sum(get_data_bytes(data) for data_list in data_lists for _,data in data_list)}
+    return sizes
+
+def merge_peak_sizes(peak,sizes):
+    # 按分组保留场景内观察到的最大帧数与字节数
+    for group,size in sizes.items():
+        previous = peak.get(group,{"items":0,"bytes":0})
+        peak[group] = {key:max(previous[key],size[key]) for key in ["items","bytes"]}
+    return peak
+
+class MemoryMonitor:
+    # 每个场景保存后记录 RSS 与主要数据结构大小；超出预算时按 actions 顺序逐级处理（每次超出升级一级）
+    def __init__(self,report=None,budget_mb=None,actions=None,tracemalloc_top=0):
+        self.report_path = report
+        self.budget = budget_mb*(1<<20) if budget_mb else None
+        self.actions = list(actions or ACTIONS)
+        for action in self.actions:
+            if action not in ACTIONS:
+                raise ValueError("unknown memory action: "+str(action))
+        self.level = 0
+        self.tracemalloc_top = tracemalloc_top
+        self.last_snapshot = None
+        if tracemalloc_top > 0 and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def get_tracemalloc_diff(self):
+        snapshot = tracemalloc.take_snapshot().filter_traces([tracemalloc.Filter(False,tracemalloc.__file__)])
+        previous,self.last_snapshot = self.last_snapshot,snapshot
+        if previous is None:
+            stats = snapshot.statistics("lineno")[:self.tracemalloc_top]
+            return [{"location":str(stat.traceback),"size":stat.size,"count":stat.count} for stat in stats]
+        stats = snapshot.compare_to(previous,"lineno")[:self.tracemalloc_top]
+        return [{"location":str(stat.traceback),"size":stat.size,"size_diff":stat.size_diff,"count_diff":stat.count_diff} for stat in stats]
+
+    def report(self,scene_name,dataset,buffers):
+        # buffers 为场景中（销毁传感器之前）记录的传感器缓存峰值，见 merge_peak_sizes
+        record = {"time":time.time(),
+                  "scene":scene_name,
+                  "progress":dict(dataset.data["progress"]),
+                  "rss":get_rss(),
+                  "tables":get_table_sizes(dataset),
+                  "buffers":buffers}
+        if self.tracemalloc_top > 0:
+            record["tracemalloc"] = self.get_tracemalloc_diff()
+        if self.report_path is not None:
+            os.makedirs(os.path.dirname(self.report_path) or ".",exist_ok=True)
+            with open(self.report_path,"a") as f:
+                f.write(json.dumps(record)+"\n")
+        return record
+
+    def check(self,rss=None):
+        # 返回本次需要执行的动作，未超预算时返回 None
+        if self.budget is None or not self.actions:
+            return None
+        rss = get_rss() if rss is None else rss
+        if rss <= self.budget:
+            return None
+        action = self.actions[min(self.level,len(self.actions)-1)]
+        self.level += 1
+        print("memory budget exceeded:",rss>>20,"MB >",self.budget>>20,"MB, action:",action)
+        return action
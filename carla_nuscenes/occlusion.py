@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+import numpy as np
+import carla
+
+def get_grid_path(cache_dir,map_name,resolution,labels):
+    # 遮挡物类别不同的栅格不能复用，文件名包含排序后类别的摘要
+    digest = hashlib.md5(json.dumps(sorted(labels)).encode('utf-8')).hexdigest()[:8]
+    return os.path.join(cache_dir,map_name+"_"+str(resolution)+"_"+digest)
+
+class OcclusionGrid:
+    def __init__(self,heights,origin,resolution):
+        # heights[0] 为静态遮挡物底部高度，heights[1] 为顶部高度，空栅格为 (inf,-inf)
+        self.heights = heights
+        self.origin = np.asarray(origin,dtype=np.float64)
+        self.resolution = resolution
+
+    @classmethod
+    def build(cls,world,resolution=0.5,labels=("Buildings","Walls","Fences","Vegetation")):
+        boxes = []
+        for label in labels:
+            boxes.extend(world.get_level_bbs(getattr(carla.CityObjectLabel,label)))
+        vertices = np.array([[[v.x,v.y,v.z] for v in box.get_world_vertices(carla.Transform())] for box in boxes]).reshape(-1,8,3)
+        if len(vertices) == 0:
+            return cls(np.array([[[np.inf]],[[-np.inf]]],dtype=np.float32),(0,0),resolution)
+        origin = vertices[:,:,:2].min(axis=(0,1))
+        shape = (np.ceil((vertices[:,:,:2].max(axis=(0,1))-origin)/resolution).astype(int)+1)[::-1]
+        heights = np.empty((2,*shape),dtype=np.float32)
+        heights[0] = np.inf
+        heights[1] = -np.inf
+        for box,box_vertices in zip(boxes,vertices):
+            yaw = np.deg2rad(box.rotation.yaw)
+            axes = np.array([[np.cos(yaw),np.sin(yaw)],[-np.sin(yaw),np.cos(yaw)]])
+            center = box_vertices[:,:2].mean(axis=0)
+            half_extent = np.abs((box_vertices[:,:2]-center)@axes.T).max(axis=0)+resolution*0.5
+            low = np.floor((box_vertices[:,:2].min(axis=0)-origin)/resolution).astype(int)
+            high = np.floor((box_vertices[:,:2].max(axis=0)-origin)/resolution).astype(int)+1
+            xs = origin[0]+(np.arange(low[0],high[0])+0.5)*resolution
+            ys = origin[1]+(np.arange(low[1],high[1])+0.5)*resolution
+            cells = np.stack(np.meshgrid(xs,ys),axis=-1)-center
+            inside = np.all(np.abs(cells@axes.T)<=half_extent,axis=-1)
+            region = (slice(low[1],high[1]),slice(low[0],high[0]))
+            heights[0][region] = np.where(inside,np.minimum(heights[0][region],box_vertices[:,2].min()),heights[0][region])
+            heights[1][region] = np.where(inside,np.maximum(heights[1][region],box_vertices[:,2].max()),heights[1][region])
+        return cls(heights,origin,resolution)
+
+    def save(self,path):
+        np.save(path+".npy",np.asarray(self.heights))
+        with open(path+".json","w") as f:
+            json.dump({"origin":self.origin.tolist(),"resolution":self.resolution},f)
+
+    @classmethod
+    def load(cls,path):
+        with open(path+".json","r") as f:
+            meta = json.load(f)
+        return cls(np.load(path+".npy",mmap_mode="r"),meta["origin"],meta["resolution"])
+
+    def is_occluded(self,start,end,margin=0.5):
+        start = np.asarray(start,dtype=np.float64)
+        end = np.asarray(end,dtype=np.float64)
+        length = np.linalg.norm(end-start)
+        if length <= margin*2:
+            return False
+        t = np.arange(margin,length-margin,self.resolution*0.5)/length
+        points = start+t[:,None]*(end-start)
+        cols,rows = np.floor((points[:,:2]-self.origin)/self.resolution).astype(int).T
+        valid = (rows>=0)&(rows<self.heights.shape[1])&(cols>=0)&(cols<self.heights.shape[2])
+        rows,cols,z = rows[valid],cols[valid],points[valid,2]
+        return bool(np.any((self.heights[0][rows,cols]<=z)&(z<=self.heights[1][rows,cols])))
+
+def load_occlusion_grid(world,map_name,cache_dir,resolution=0.5,labels=("Buildings","Walls","Fences","Vegetation")):
+    path = get_grid_path(cache_dir,map_name,resolution,labels)
+    if not os.path.exists(path+".npy"):
+        os.makedirs(cache_dir,exist_ok=True)
+        OcclusionGrid.build(world,resolution,labels).save(path)
+    return OcclusionGrid.load(path)
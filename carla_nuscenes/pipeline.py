@@ -0,0 +1,59 @@
+import threading
+from queue import Queue
+
+class KeyframePipeline:
+    # 单个处理线程按提交顺序执行关键帧任务，队列深度限制在途关键帧数量（及其占用的传感器数据内存）
+    # depth 为 0 时在调用线程中同步执行
+    def __init__(self,depth=2):
+        self.depth = depth
+        self.error = None
+        self.queue = None
+        self.thread = None
+        if depth > 0:
+            self.queue = Queue(maxsize=depth)
+            self.thread = threading.Thread(target=self.run,daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            task = self.queue.get()
+            try:
+                if task is None:
+                    return
+                if self.error is None:
+                    function,args = task
+                    function(*args)
+            except BaseException as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def raise_error(self):
+        if self.error is not None:
+            error,self.error = self.error,None
+            raise error
+
+    def submit(self,function,*args):
+        self.raise_error()
+        if self.queue is None:
+            function(*args)
+        else:
+            self.queue.put((function,args))
+
+    def drain(self):
+        # 等待所有已提交的关键帧处理完毕，并抛出处理线程中的异常
+        if self.queue is not None:
+            self.queue.join()
+        self.raise_error()
+
+    def discard(self):
+        # 场景失败时等待在途任务结束（出错后的任务会被跳过），丢弃异常
+        if self.queue is not None:
+            self.queue.join()
+        self.error = None
+
+    def shutdown(self):
+        if self.queue is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.queue = None
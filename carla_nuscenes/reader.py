@@ -0,0 +1,243 @@
+import os
+import io
+import re
+import json
+import pickle
+import threading
+import numpy as np
+from collections import deque,OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from .utils import load
+from .shards import ShardIndex
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+INDEX_NAME = "reader_index.pkl"
+INDEX_VERSION = 2
+# 小表整表放入索引；大表只记录 token、所属场景与行在 JSON 文件中的字节范围，按场景读取
+INDEX_TABLES = ["scene","calibrated_sensor","sensor"]
+# (表, 决定所属场景的字段, 该字段取值所在的表)
+SCENE_TABLES = [("sample","scene_token","scene"),("sample_data","sample_token","sample"),
+                ("ego_pose","token","sample_data"),("sample_annotation","sample_token","sample")]
+LIDAR_DTYPE = np.dtype("f8")
+LIDAR_COLUMNS = 5
+FUSED_LIDAR_COLUMNS = 6
+RADAR_DTYPE = np.dtype("f4")
+RADAR_COLUMNS = 4
+# 未记录列数的 sensor 行按文件格式取默认值
+DEFAULT_COLUMNS = {"pcd.bin":LIDAR_COLUMNS,"pcd":RADAR_COLUMNS}
+ROW_SEPARATOR = re.compile(r"[\s,]*")
+MAX_READ_GAP = 4096
+
+def scan_rows(path):
+    # 逐行解析 JSON 数组，返回 (行,起始字节,结束字节)；按 latin-1 解码使字符位置与字节位置一致
+    with open(path,"rb") as f:
+        text = f.read().decode("latin-1")
+    decoder = json.JSONDecoder()
+    position = ROW_SEPARATOR.match(text,text.index("[")+1).end()
+    while text[position] != "]":
+        row,end = decoder.raw_decode(text,position)
+        yield row,position,end
+        position = ROW_SEPARATOR.match(text,end).end()
+
+def read_rows(path,starts,ends):
+    # 按文件顺序读取指定字节范围的行，间隔较小的相邻行合并为一次读取
+    order = np.argsort(starts,kind="stable")
+    rows = [None]*len(order)
+    with open(path,"rb") as f:
+        i = 0
+        while i < len(order):
+            j = i
+            while j+1 < len(order) and starts[order[j+1]]-ends[order[j]] <= MAX_READ_GAP:
+                j += 1
+            offset = starts[order[i]]
+            f.seek(offset)
+            block = f.read(ends[order[j]]-offset)
+            for k in order[i:j+1]:
+                rows[k] = json.loads(block[starts[k]-offset:ends[k]-offset])
+            i = j+1
+    return rows
+
+def build_index(json_dir):
+    tables = {key:load(os.path.join(json_dir,key+".json")) for key in INDEX_TABLES}
+    sensors = {sensor["token"]:sensor for sensor in tables["sensor"]}
+    calibrated_sensors = {}
+    for item in tables["calibrated_sensor"]:
+        sensor = sensors.get(item["sensor_token"],{})
+        calibrated_sensors[item["token"]] = dict(item,channel=sensor.get("channel"),columns=sensor.get("columns"))
+    scene_tokens = [item["token"] for item in tables["scene"]]
+    owners = {"scene":{token:i for i,token in enumerate(scene_tokens)}}
+    index = {"version":INDEX_VERSION,
+             "scene":{item["token"]:item for item in tables["scene"]},
+             "calibrated_sensor":calibrated_sensors,
+             "sensor":sensors,
+             "scene_tokens":scene_tokens}
+    for key,field,owner in SCENE_TABLES:
+        tokens,scenes,starts,ends = [],[],[],[]
+        for row,start,end in scan_rows(os.path.join(json_dir,key+".json")):
+            tokens.append(row["token"])
+            scenes.append(owners[owner].get(row[field],-1))
+            starts.append(start)
+            ends.append(end)
+        # 只有下游表需要 token -> 场景的映射，建完即丢弃
+        owners[key] = dict(zip(tokens,scenes)) if any(owner == key for _,_,owner in SCENE_TABLES) else None
+        tokens = np.array(tokens,dtype="S")
+        scenes = np.array(scenes,dtype=np.int32)
+        token_order = np.argsort(tokens,kind="stable")
+        scene_order = np.lexsort((np.array(starts,dtype=np.int64),scenes))
+        index[key] = {
+            "tokens":tokens[token_order],
+            "token_rows":token_order.astype(np.int64),
+            "scenes":scenes,
+            "starts":np.array(starts,dtype=np.int64),
+            "ends":np.array(ends,dtype=np.int64),
+            "scene_rows":scene_order.astype(np.int64), # 按场景、文件顺序排列的行号，场景 i 为 scene_rows[bounds[i]:bounds[i+1]]
+            "bounds":np.searchsorted(scenes[scene_order],np.arange(len(scene_tokens)+1))
+        }
+    return index
+
+class SampleData:
+    def __init__(self,reader,record):
+        self.reader = reader
+        self.record = record
+
+    def __getitem__(self,key):
+        return self.record[key]
+
+    def load(self):
+        return self.reader.load_file(self.record)
+
+class DatasetReader:
+    def __init__(self,root,version,rebuild=False,cache_scenes=2):
+        # 索引只含 token 与行位置，场景的行在首次访问时读取，最多缓存 cache_scenes 个场景
+        self.root = root
+        self.json_dir = os.path.join(root,version)
+        self.shard_index = ShardIndex(root)
+        self.cache_scenes = cache_scenes
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        index_path = os.path.join(self.json_dir,INDEX_NAME)
+        json_mtime = max(os.path.getmtime(os.path.join(self.json_dir,key+".json")) for key in INDEX_TABLES+[key for key,_,_ in SCENE_TABLES])
+        self.index = None
+        if not rebuild and os.path.exists(index_path) and os.path.getmtime(index_path) >= json_mtime:
+            with open(index_path,"rb") as f:
+                self.index = pickle.load(f)
+        if self.index is None or self.index.get("version") != INDEX_VERSION:
+            self.index = build_index(self.json_dir)
+            with open(index_path,"wb") as f:
+                pickle.dump(self.index,f,protocol=pickle.HIGHEST_PROTOCOL)
+        self.scene_positions = {token:i for i,token in enumerate(self.index["scene_tokens"])}
+
+    def find_scene(self,key,token):
+        table = self.index[key]
+        i = np.searchsorted(table["tokens"],token.encode())
+        if i == len(table["tokens"]) or table["tokens"][i] != token.encode():
+            raise KeyError(token)
+        scene = table["scenes"][table["token_rows"][i]]
+        if scene < 0:
+            raise KeyError(token)
+        return self.index["scene_tokens"][scene]
+
+    def load_scene(self,scene_token):
+        with self.lock:
+            if scene_token in self.cache:
+                self.cache.move_to_end(scene_token)
+                return self.cache[scene_token]
+        scene_index = self.scene_positions[scene_token]
+        rows = {}
+        for key,_,_ in SCENE_TABLES:
+            table = self.index[key]
+            row_ids = table["scene_rows"][table["bounds"][scene_index]:table["bounds"][scene_index+1]]
+            rows[key] = read_rows(os.path.join(self.json_dir,key+".json"),table["starts"][row_ids],table["ends"][row_ids])
+        calibrated_sensors = self.index["calibrated_sensor"]
+        samples = {item["token"]:dict(item,data={},anns=[]) for item in rows["sample"]}
+        sample_data = {}
+        for item in rows["sample_data"]:
+            calibrated_sensor = calibrated_sensors[item["calibrated_sensor_token"]]
+            item["channel"] = calibrated_sensor["channel"]
+            item["columns"] = calibrated_sensor["columns"] or DEFAULT_COLUMNS.get(item["fileformat"])
+            sample_data[item["token"]] = item
+            if item["is_key_frame"] and item["sample_token"] in samples:
+                samples[item["sample_token"]]["data"][item["channel"]] = item["token"]
+        sample_annotations = {}
+        for item in rows["sample_annotation"]:
+            sample_annotations[item["token"]] = item
+            if item["sample_token"] in samples:
+                samples[item["sample_token"]]["anns"].append(item["token"])
+        scene = {"sample":samples,"sample_data":sample_data,"ego_pose":{item["token"]:item for item in rows["ego_pose"]},
+                 "sample_annotation":sample_annotations}
+        with self.lock:
+            self.cache[scene_token] = scene
+            while len(self.cache) > self.cache_scenes:
+                self.cache.popitem(last=False)
+        return scene
+
+    def get(self,key,token):
+        if key in INDEX_TABLES:
+            return self.index[key][token]
+        with self.lock:
+            scenes = list(self.cache.values())
+        for scene in scenes:
+            if token in scene[key]:
+                return scene[key][token]
+        return self.load_scene(self.find_scene(key,token))[key][token]
+
+    def scenes(self):
+        return list(self.index["scene"].values())
+
+    def sample_tokens(self,scene_token):
+        samples = self.load_scene(scene_token)["sample"]
+        token = self.index["scene"][scene_token]["first_sample_token"]
+        while token != "":
+            yield token
+            token = samples[token]["next"]
+
+    def get_sample(self,token):
+        sample = self.get("sample",token)
+        return {
+            "token":token,
+            "scene_token":sample["scene_token"],
+            "timestamp":sample["timestamp"],
+            "data":{channel:SampleData(self,self.get("sample_data",sd_token)) for channel,sd_token in sample["data"].items()},
+            "anns":[self.get("sample_annotation",ann_token) for ann_token in sample["anns"]]
+        }
+
+    def load_file(self,record):
+        path,offset,size = self.shard_index.resolve(record["filename"])
+        if record["fileformat"] == "pcd.bin":
+            # 列数记录在 sensor 表中（协同融合通道多一列 agent id）
+            columns = record["columns"]
+            count = (size if size is not None else os.path.getsize(path))//(LIDAR_DTYPE.itemsize*columns)
+            return np.memmap(path,dtype=LIDAR_DTYPE,mode="r",offset=offset,shape=(count,columns))
+        elif record["fileformat"] == "pcd":
+            columns = record["columns"]
+            count = (size if size is not None else os.path.getsize(path))//(RADAR_DTYPE.itemsize*columns)
+            return np.memmap(path,dtype=RADAR_DTYPE,mode="r",offset=offset,shape=(count,columns))
+        if Image is None:
+            raise ImportError("decoding camera images requires Pillow")
+        if size is None:
+            return np.asarray(Image.open(path).convert("RGB"))
+        return np.asarray(Image.open(io.BytesIO(self.shard_index.read(record["filename"]))).convert("RGB"))
+
+    def load_sample(self,token,channels=None):
+        sample = self.get_sample(token)
+        sample["data"] = {channel:data.load() for channel,data in sample["data"].items() if channels is None or channel in channels}
+        return sample
+
+    def iter_samples(self,scene_tokens=None,channels=None,num_workers=0,prefetch=8):
+        scene_tokens = list(self.index["scene"]) if scene_tokens is None else scene_tokens
+        tokens = (token for scene_token in scene_tokens for token in self.sample_tokens(scene_token))
+        if num_workers <= 0:
+            for token in tokens:
+                yield self.load_sample(token,channels)
+            return
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            pending = deque()
+            for token in tokens:
+                pending.append(executor.submit(self.load_sample,token,channels))
+                if len(pending) >= prefetch:
+                    yield pending.popleft().result()
+            while pending:
+                yield pending.popleft().result()
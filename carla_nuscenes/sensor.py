@@ -1,6 +1,10 @@
 import numpy as np
 import carla
 from .actor import Actor
+from .utils import get_transform_matrices,get_location_rotation_from_matrix
+from .v2x import voxel_downsample
+
+SENSOR_MODALITIES = {"sensor.camera.rgb":"camera","sensor.lidar.ray_cast":"lidar","sensor.other.radar":"radar"}
 
 def parse_image(image):
     array = np.ndarray(
@@ -20,10 +24,57 @@ def parse_lidar_data(lidar_data):
         points.append(point)
     return np.array(points)
 
+def get_channel_counts(lidar_data):
+    return [lidar_data.get_point_count(channel) for channel in range(lidar_data.channels)]
+
+def get_channel_boundaries(channel_counts,num_points):
+    # 与 parse_lidar_data 的逐点计数保持一致：边界点仍属于前一通道，空通道之后不再切换
+    boundaries = []
+    current_channel = 0
+    end_idx = channel_counts[0] if len(channel_counts) > 0 else 0
+    while end_idx < num_points and current_channel+1 < len(channel_counts):
+        boundaries.append(end_idx)
+        current_channel += 1
+        if channel_counts[current_channel] == 0:
+            break
+        end_idx += channel_counts[current_channel]
+    return np.array(boundaries,dtype=np.int64)
+
+def parse_lidar_buffer(raw_data,channel_counts):
+    points = np.frombuffer(raw_data, dtype=np.dtype('f4')).reshape(-1,4)
+    boundaries = get_channel_boundaries(channel_counts,len(points))
+    channels = np.searchsorted(boundaries,np.arange(len(points)),side="left")
+    return np.column_stack([points.astype(np.float64),channels.astype(np.float64)])
+
+def process_point_cloud(points,roi=None,voxel_size=None):
+    # 写盘前的可选处理：roi 为传感器坐标系下的 [xmin,ymin,zmin,xmax,ymax,zmax]，voxel_size 为体素边长（每个体素保留第一个点）
+    if roi is not None:
+        roi = np.asarray(roi,dtype=np.float64)
+        points = points[np.all((points[:,:3] >= roi[:3]) & (points[:,:3] <= roi[3:]),axis=1)]
+    if voxel_size:
+        points = voxel_downsample(points,voxel_size)
+    return points
+
 def parse_radar_data(radar_data):
     points = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4')).copy()
     return points
 
+def get_lidar_points(lidar_data):
+    points = np.frombuffer(lidar_data.raw_data, dtype=np.dtype('f4')).reshape(-1,4)
+    return points[:,:3].astype(np.float64)
+
+def get_semantic_lidar_ids(semantic_lidar_data):
+    points = np.frombuffer(semantic_lidar_data.raw_data, dtype=np.dtype([
+        ('x','f4'),('y','f4'),('z','f4'),('cos_inc_angle','f4'),('object_idx','u4'),('object_tag','u4')]))
+    return points['object_idx'].astype(np.int64)
+
+def get_radar_points(radar_data):
+    detections = np.frombuffer(radar_data.raw_data, dtype=np.dtype('f4')).reshape(-1,4).astype(np.float64)
+    azimuth,altitude,depth = detections[:,1],detections[:,2],detections[:,3]
+    return np.stack([depth*np.cos(altitude)*np.cos(azimuth),
+                    depth*np.sin(altitude)*np.cos(azimuth),
+                    depth*np.sin(azimuth)],axis=1)
+
 def parse_data(data):
     if isinstance(data,carla.Image):
         return parse_image(data)
@@ -42,6 +93,7 @@ class Sensor(Actor):
         super().__init__(**args)
         self.name = name
         self.data_list = []
+        self.ring = None
     
     def get_data_list(self):
         return self.data_list
@@ -60,8 +112,40 @@ class Sensor(Actor):
         else:
             return None
             
+    def wrap_data(self,data):
+        # 启用共享内存采集时只拷贝 raw_data，槽位不足时保留原始数据对象
+        if self.ring is None:
+            return data
+        return self.ring.acquire(data,SENSOR_MODALITIES[self.bp_name]) or data
+
     def add_data(self,data):
-        self.data_list.append((self.actor.parent.get_transform(),data))
+        self.data_list.append((self.actor.parent.get_transform(),self.wrap_data(data)))
 
     def get_transform(self):
-        return self.actor.get_transform()
\ No newline at end of file
+        return self.actor.get_transform()
+
+class RoadsideSensor(Sensor):
+    # 路侧单元（RSU）传感器：每个世界只生成一次，不挂载到车辆
+    # transform 为相对 RSU 的安装位姿（用于 calibrated_sensor），rsu_transform 作为固定的 ego_pose 记录
+    def __init__(self,rsu_name,rsu_location,rsu_rotation,name,location,rotation,**args):
+        rsu_matrix,mount_matrix = get_transform_matrices([[rsu_location[key] for key in ["x","y","z"]],[location[key] for key in ["x","y","z"]]],
+                                                        [[rsu_rotation.get(key,0) for key in ["pitch","yaw","roll"]],
+                                                        [rotation.get(key,0) for key in ["pitch","yaw","roll"]]])
+        super().__init__(name=rsu_name+"_"+name,location=location,rotation=rotation,**args)
+        spawn_location,spawn_rotation = get_location_rotation_from_matrix(rsu_matrix@mount_matrix)
+        self.spawn_transform = carla.Transform(carla.Location(**spawn_location),carla.Rotation(**spawn_rotation))
+        self.rsu_transform = carla.Transform(carla.Location(**rsu_location),carla.Rotation(**rsu_rotation))
+        self.listening = False
+
+    def spawn_actor(self):
+        self.actor = self.world.spawn_actor(self.blueprint,self.spawn_transform)
+        self.actor.listen(self.add_data)
+
+    def set_listening(self,listening):
+        # 场景之间不缓存数据，传感器本身保持不变
+        self.listening = listening
+        self.data_list.clear()
+
+    def add_data(self,data):
+        if self.listening:
+            self.data_list.append((self.rsu_transform,self.wrap_data(data)))
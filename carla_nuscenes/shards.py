@@ -0,0 +1,107 @@
+import os
+import json
+import tarfile
+from concurrent.futures import ThreadPoolExecutor
+
+INDEX_NAME = "index.jsonl"
+
+class ShardWriter:
+    def __init__(self,root,shard_size=1<<30,tmp_dir=None):
+        self.root = root
+        self.shard_dir = os.path.join(root,"shards")
+        self.shard_size = shard_size
+        self.tmp_dir = tmp_dir if tmp_dir is not None else os.path.join(self.shard_dir,"tmp")
+        os.makedirs(self.tmp_dir,exist_ok=True)
+        self.writers = {}
+        self.entries = []
+
+    def get_tmp_path(self,filename):
+        return os.path.join(self.tmp_dir,os.path.basename(filename))
+
+    def open_shard(self,channel):
+        channel_dir = os.path.join(self.shard_dir,channel)
+        os.makedirs(channel_dir,exist_ok=True)
+        seq = len([name for name in os.listdir(channel_dir) if name.endswith(".tar")])
+        shard = os.path.join("shards",channel,channel+"-"+str(seq).zfill(6)+".tar")
+        self.writers[channel] = (tarfile.open(os.path.join(self.root,shard),"w",format=tarfile.GNU_FORMAT),shard)
+        return self.writers[channel]
+
+    def add_file(self,filename,path):
+        channel = filename.split(os.sep)[1]
+        writer,shard = self.writers.get(channel) or self.open_shard(channel)
+        tarinfo = writer.gettarinfo(path,arcname=filename)
+        with open(path,"rb") as f:
+            writer.addfile(tarinfo,f)
+        offset = writer.offset-(tarinfo.size+tarfile.BLOCKSIZE-1)//tarfile.BLOCKSIZE*tarfile.BLOCKSIZE
+        self.entries.append([filename,shard,offset,tarinfo.size])
+        os.remove(path)
+        if writer.offset >= self.shard_size:
+            self.close_shard(channel)
+
+    def close_shard(self,channel):
+        writer,_ = self.writers.pop(channel)
+        writer.close()
+
+    def close(self):
+        for channel in list(self.writers):
+            self.close_shard(channel)
+        if self.entries:
+            with open(os.path.join(self.shard_dir,INDEX_NAME),"a") as f:
+                for entry in self.entries:
+                    f.write(json.dumps(entry)+"\n")
+            self.entries = []
+
+    def discard(self):
+        # 丢弃未写入索引的条目（用于从检查点恢复）
+        self.entries = []
+        for channel in list(self.writers):
+            self.close_shard(channel)
+
+class ShardIndex:
+    def __init__(self,root):
+        self.root = root
+        self.entries = {}
+        index_path = os.path.join(root,"shards",INDEX_NAME)
+        if os.path.exists(index_path):
+            with open(index_path,"r") as f:
+                for line in f:
+                    filename,shard,offset,size = json.loads(line)
+                    self.entries[filename] = (shard,offset,size)
+
+    def __contains__(self,filename):
+        return filename in self.entries
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resolve(self,filename):
+        path = os.path.join(self.root,filename)
+        if filename not in self.entries or os.path.exists(path):
+            return path,0,None
+        shard,offset,size = self.entries[filename]
+        return os.path.join(self.root,shard),offset,size
+
+    def read(self,filename):
+        path,offset,size = self.resolve(filename)
+        with open(path,"rb") as f:
+            f.seek(offset)
+            return f.read() if size is None else f.read(size)
+
+def expand_shards(root,workers=8):
+    index = ShardIndex(root)
+    shards = {}
+    for filename,(shard,offset,size) in index.entries.items():
+        shards.setdefault(shard,[]).append((filename,offset,size))
+
+    def expand(shard):
+        with open(os.path.join(root,shard),"rb") as src:
+            for filename,offset,size in shards[shard]:
+                path = os.path.join(root,filename)
+                os.makedirs(os.path.dirname(path),exist_ok=True)
+                src.seek(offset)
+                with open(path,"wb") as dst:
+                    dst.write(src.read(size))
+        return len(shards[shard])
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return sum(executor.map(expand,shards))
@@ -0,0 +1,81 @@
+import os
+import json
+import random
+import hashlib
+import numpy as np
+import carla
+
+# 与自定义场景中的车辆蓝图筛选一致：四轮且排除部分车型
+EXCLUDED_VEHICLES = ('isetta','carlacola','cybertruck','t2')
+
+def get_plan_path(cache_dir,map_name,config):
+    digest = hashlib.md5(json.dumps(config,sort_keys=True).encode('utf-8')).hexdigest()[:12]
+    return os.path.join(cache_dir,map_name+"_"+digest+".npz")
+
+def get_plan_seed(map_name,config):
+    # 由地图与计划配置导出种子，缓存失效后重新构建得到相同的行人位置
+    return int(hashlib.md5(json.dumps([map_name,config],sort_keys=True).encode('utf-8')).hexdigest()[:8],16)
+
+def is_safe_spawn(world,blueprint,transform):
+    try:
+        world.spawn_actor(blueprint,transform).destroy()
+        return True
+    except Exception as e:
+        return "collision" not in str(e).lower()
+
+class SpawnPlan:
+    # 每张地图可复用的生成数据：车辆生成点 [x,y,z,pitch,yaw,roll]、经碰撞检测的行人位置 [x,y,z]、可用蓝图 id
+    # 覆盖整张地图，生成区域（spawn_center/spawn_radius）在采样时筛选，同一计划可用于不同场景
+    def __init__(self,vehicle_transforms,walker_locations,vehicle_blueprints,walker_blueprints):
+        self.vehicle_transforms = np.asarray(vehicle_transforms,dtype=np.float64).reshape(-1,6)
+        self.walker_locations = np.asarray(walker_locations,dtype=np.float64).reshape(-1,3)
+        self.vehicle_blueprints = list(vehicle_blueprints)
+        self.walker_blueprints = list(walker_blueprints)
+
+    @classmethod
+    def build(cls,world,walker_locations=1000,max_attempts=None,seed=0):
+        # 在生成任何场景实体之前构建，只与静态场景发生碰撞；导航采样使用 seed 设置行人随机种子，微调位置使用独立的随机数发生器
+        spawn_points = world.get_map().get_spawn_points()
+        vehicle_transforms = [[t.location.x,t.location.y,t.location.z,t.rotation.pitch,t.rotation.yaw,t.rotation.roll] for t in spawn_points]
+        library = world.get_blueprint_library()
+        vehicle_blueprints = sorted(bp.id for bp in library.filter("vehicle.*")
+                                    if int(bp.get_attribute('number_of_wheels')) == 4 and not bp.id.endswith(EXCLUDED_VEHICLES))
+        walker_blueprints = sorted(bp.id for bp in library.filter("walker.pedestrian.*"))
+        locations = []
+        if walker_blueprints:
+            probe = library.find(walker_blueprints[0])
+            world.set_pedestrians_seed(seed)
+            rng = random.Random(seed)
+            max_attempts = walker_locations*10 if max_attempts is None else max_attempts
+            for _ in range(max_attempts):
+                if len(locations) >= walker_locations:
+                    break
+                location = world.get_random_location_from_navigation()
+                if location is None:
+                    continue
+                for _ in range(3):
+                    if is_safe_spawn(world,probe,carla.Transform(location)):
+                        locations.append([location.x,location.y,location.z])
+                        break
+                    location = carla.Location(location.x+rng.uniform(-0.5,0.5),location.y+rng.uniform(-0.5,0.5),location.z)
+        return cls(vehicle_transforms,locations,vehicle_blueprints,walker_blueprints)
+
+    def save(self,path):
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        np.savez(path,
+                 vehicle_transforms=self.vehicle_transforms,
+                 walker_locations=self.walker_locations,
+                 vehicle_blueprints=np.array(self.vehicle_blueprints,dtype=str),
+                 walker_blueprints=np.array(self.walker_blueprints,dtype=str))
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as data:
+            return cls(data["vehicle_transforms"],data["walker_locations"],data["vehicle_blueprints"].tolist(),data["walker_blueprints"].tolist())
+
+def load_spawn_plan(world,map_name,cache_dir,walker_locations=1000,max_attempts=None):
+    config = {"walker_locations":walker_locations,"max_attempts":max_attempts,"excluded":list(EXCLUDED_VEHICLES)}
+    path = get_plan_path(cache_dir,map_name,config)
+    if not os.path.exists(path):
+        SpawnPlan.build(world,walker_locations,max_attempts,get_plan_seed(map_name,config)).save(path)
+    return SpawnPlan.load(path)
@@ -0,0 +1,113 @@
+import os
+import time
+import shlex
+import signal
+import socket
+import subprocess
+
+TIMEOUT_PATTERNS = ["time-out","timeout","timed out","connection refused","connection reset","broken pipe","rpc::"]
+
+class ServerFailure(Exception):
+    pass
+
+def is_port_open(host,port,timeout=1.0):
+    try:
+        with socket.create_connection((host,port),timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+def probe_server(host,port,timeout=5.0):
+    # 端口可连接不代表服务器可用（加载地图或卡死时端口仍然打开），用一次 RPC 判断
+    import carla
+    try:
+        client = carla.Client(host,port)
+        client.set_timeout(timeout)
+        client.get_server_version()
+        return True
+    except Exception:
+        return False
+
+def is_server_failure(exception):
+    # CARLA 客户端在 RPC 超时或连接断开时抛出 RuntimeError，只能通过消息判断
+    if isinstance(exception,(ServerFailure,ConnectionError,socket.timeout,TimeoutError)):
+        return True
+    message = str(exception).lower()
+    return isinstance(exception,RuntimeError) and any(pattern in message for pattern in TIMEOUT_PATTERNS)
+
+class ServerSupervisor:
+    def __init__(self,host,port,command=None,startup_timeout=60.0,poll_interval=1.0,max_restarts=3,probe_timeout=5.0,probe=None):
+        # command 为空时不负责启动服务器，只等待外部进程恢复服务；probe(host,port,timeout) 判断服务器能否响应 RPC
+        self.host = host
+        self.port = port
+        self.command = command
+        self.startup_timeout = startup_timeout
+        self.poll_interval = poll_interval
+        self.max_restarts = max_restarts
+        self.probe_timeout = probe_timeout
+        self.probe = probe_server if probe is None else probe
+        self.restarts = 0
+        self.process = None
+
+    def start(self):
+        if self.command is None or self.is_running():
+            return
+        self.process = subprocess.Popen(shlex.split(self.command),stdout=subprocess.DEVNULL,stderr=subprocess.DEVNULL,
+                                        start_new_session=True)
+
+    def stop(self,timeout=10.0):
+        if self.process is None:
+            return
+        if self.process.poll() is None:
+            # 服务器脚本通常会再拉起子进程，按进程组结束
+            os.killpg(self.process.pid,signal.SIGTERM)
+            try:
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid,signal.SIGKILL)
+                self.process.wait()
+        self.process = None
+
+    def is_running(self):
+        return self.process is not None and self.process.poll() is None
+
+    def is_alive(self):
+        if self.command is not None and not self.is_running():
+            return False
+        return is_port_open(self.host,self.port)
+
+    def is_failure(self,exception):
+        return is_server_failure(exception) or not self.is_alive()
+
+    def is_ready(self):
+        return self.is_alive() and self.probe(self.host,self.port,self.probe_timeout)
+
+    def wait_ready(self):
+        deadline = time.time()+self.startup_timeout
+        while time.time() < deadline:
+            if self.is_ready():
+                return True
+            time.sleep(self.poll_interval)
+        return False
+
+    def restart(self):
+        if self.restarts >= self.max_restarts:
+            raise ServerFailure("server restarted "+str(self.restarts)+" times, giving up")
+        self.restarts += 1
+        print("restarting simulator server ("+str(self.restarts)+"/"+str(self.max_restarts)+")")
+        self.stop()
+        self.start()
+
+    def recover(self,connect):
+        # 反复重启直到服务器响应 RPC 且 connect() 成功，用完 max_restarts 时抛出 ServerFailure；其它异常直接抛出
+        while True:
+            self.restart()
+            if not self.wait_ready():
+                print("server not ready at "+self.host+":"+str(self.port)+" after "+str(self.startup_timeout)+"s")
+                continue
+            try:
+                return connect()
+            except Exception as e:
+                if not is_server_failure(e):
+                    raise
+                print("reconnect failed:",e)
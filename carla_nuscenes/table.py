@@ -0,0 +1,222 @@
+import sys
+import numpy as np
+
+TOKEN_DTYPE = np.dtype("S32")
+
+SCHEMAS = {
+    "ego_pose":[
+        ("token","token",()),
+        ("timestamp","int",()),
+        ("rotation","float",(4,)),
+        ("translation","float",(3,))
+    ],
+    "sample_data":[
+        ("token","token",()),
+        ("sample_token","token",()),
+        ("ego_pose_token","token",()),
+        ("calibrated_sensor_token","token",()),
+        ("timestamp","int",()),
+        ("fileformat","interned",()),
+        ("is_key_frame","bool",()),
+        ("height","int",()),
+        ("width","int",()),
+        ("prev","token",()),
+        ("next","token",()),
+        ("filename","object",())
+    ],
+    "sample_annotation":[
+        ("token","token",()),
+        ("sample_token","token",()),
+        ("instance_token","token",()),
+        ("visibility_token","token",()),
+        ("attribute_tokens","interned",()),
+        ("translation","float",(3,)),
+        ("rotation","float",(4,)),
+        ("size","float",(3,)),
+        ("prev","token",()),
+        ("next","token",()),
+        ("num_lidar_pts","int",()),
+        ("num_radar_pts","int",())
+    ]
+}
+
+KIND_DTYPES = {"token":TOKEN_DTYPE,"int":np.dtype("i8"),"float":np.dtype("f8"),"bool":np.dtype("?")}
+
+class Row:
+    def __init__(self,table,index):
+        self.table = table
+        self.index = index
+
+    def __getitem__(self,key):
+        return self.table.get_value(self.index,key)
+
+    def __setitem__(self,key,value):
+        self.table.set_value(self.index,key,value)
+
+    def __contains__(self,key):
+        return key in self.table.kinds
+
+    def __iter__(self):
+        return iter(self.table.kinds)
+
+    def keys(self):
+        return self.table.kinds.keys()
+
+    def get(self,key,default=None):
+        return self[key] if key in self.table.kinds else default
+
+    def to_dict(self):
+        return {key:self[key] for key in self.table.kinds}
+
+    def __repr__(self):
+        return repr(self.to_dict())
+
+class Table:
+    def __init__(self,schema,capacity=1024):
+        self.kinds = {name:kind for name,kind,_ in schema}
+        self.shapes = {name:shape for name,_,shape in schema}
+        self.columns = {}
+        for name,kind,shape in schema:
+            if kind in ["object","interned"]:
+                self.columns[name] = []
+            else:
+                self.columns[name] = np.zeros((capacity,*shape),dtype=KIND_DTYPES[kind])
+        self.interned = {}
+        # token 索引：已排序的 token 数组 + 最近追加行的小字典，定期合并
+        self.sorted_tokens = np.zeros(0,dtype=TOKEN_DTYPE)
+        self.sorted_rows = np.zeros(0,dtype=np.int64)
+        self.recent = {}
+        self.length = 0
+
+    @classmethod
+    def from_list(cls,schema,items):
+        table = cls(schema,max(len(items),1024))
+        for item in items:
+            table.append(item)
+        return table
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield Row(self,i)
+
+    def __getitem__(self,i):
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return Row(self,i)
+
+    def intern(self,value):
+        key = tuple(value) if isinstance(value,list) else value
+        return self.interned.setdefault(key,key)
+
+    def grow(self):
+        for name,column in self.columns.items():
+            if self.kinds[name] not in ["object","interned"] and len(column) <= self.length:
+                grown = np.zeros((len(column)*2,*column.shape[1:]),dtype=column.dtype)
+                grown[:len(column)] = column
+                self.columns[name] = grown
+
+    def append(self,item):
+        extra = set(item)-set(self.kinds)
+        if extra:
+            raise KeyError("unknown columns: "+",".join(sorted(extra)))
+        self.grow()
+        for name,kind in self.kinds.items():
+            if kind == "object":
+                self.columns[name].append(item[name])
+            elif kind == "interned":
+                self.columns[name].append(self.intern(item[name]))
+            else:
+                self.set_value(self.length,name,item[name])
+        self.add_index(bytes(self.columns["token"][self.length]),self.length)
+        self.length += 1
+
+    def add_index(self,token,i):
+        self.recent[token] = i
+        if len(self.recent) >= 4096:
+            self.merge_index()
+
+    def merge_index(self):
+        tokens = np.array(list(self.recent.keys()),dtype=TOKEN_DTYPE)
+        rows = np.array(list(self.recent.values()),dtype=np.int64)
+        order = np.argsort(tokens)
+        position = np.searchsorted(self.sorted_tokens,tokens[order])
+        self.sorted_tokens = np.insert(self.sorted_tokens,position,tokens[order])
+        self.sorted_rows = np.insert(self.sorted_rows,position,rows[order])
+        self.recent = {}
+
+    def rebuild_index(self):
+        order = np.argsort(self.columns["token"][:self.length],kind="stable")
+        self.sorted_tokens = self.columns["token"][:self.length][order]
+        self.sorted_rows = order.astype(np.int64)
+        self.recent = {}
+
+    def find(self,token):
+        i = self.recent.get(token)
+        if i is not None:
+            return i
+        position = np.searchsorted(self.sorted_tokens,token)
+        if position < len(self.sorted_tokens) and self.sorted_tokens[position] == token:
+            return int(self.sorted_rows[position])
+        return None
+
+    def get_value(self,i,key):
+        kind = self.kinds[key]
+        value = self.columns[key][i]
+        if kind == "token":
+            return value.decode("ascii")
+        elif kind in ["object","interned"]:
+            return list(value) if isinstance(value,tuple) else value
+        elif self.shapes[key]:
+            return value.tolist()
+        elif kind == "int":
+            return int(value)
+        elif kind == "bool":
+            return bool(value)
+        return float(value)
+
+    def set_value(self,i,key,value):
+        if self.kinds[key] == "object":
+            self.columns[key][i] = value
+            return
+        elif self.kinds[key] == "interned":
+            self.columns[key][i] = self.intern(value)
+            return
+        if self.kinds[key] == "token":
+            value = value.encode("ascii")
+        self.columns[key][i] = value
+        if key == "token" and i < self.length:
+            self.rebuild_index()
+
+    def get(self,token):
+        i = self.find(token.encode("ascii"))
+        return None if i is None else Row(self,i)
+
+    def remove(self,row):
+        keep = np.ones(self.length,dtype=bool)
+        keep[row.index] = False
+        for name,column in self.columns.items():
+            if self.kinds[name] in ["object","interned"]:
+                self.columns[name] = [value for value,kept in zip(column,keep) if kept]
+            else:
+                self.columns[name] = np.concatenate([column[:self.length][keep],column[self.length:]])
+        self.length -= 1
+        self.rebuild_index()
+
+    def to_list(self):
+        return [row.to_dict() for row in self]
+
+    def nbytes(self):
+        size = 0
+        for name,column in self.columns.items():
+            if self.kinds[name] == "object":
+                size += sum(sys.getsizeof(value) for value in column)+len(column)*8
+            elif self.kinds[name] == "interned":
+                size += len(column)*8
+            else:
+                size += column.nbytes
+        return size+self.sorted_tokens.nbytes+self.sorted_rows.nbytes
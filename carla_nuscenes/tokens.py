@@ -0,0 +1,38 @@
+import hashlib
+import numpy as np
+
+# 高频表（ego_pose/sample_data、sample_annotation、sweep_annotation）的 token 按关键帧批量生成：
+# 逐行计算 128 位 blake2b，开头的标量列只编码一次；结果只依赖行内容，与批次大小、进程、PYTHONHASHSEED 无关
+
+def is_scalar(column):
+    return isinstance(column,(str,int,np.integer))
+
+def hash_rows(key,columns,length):
+    # 开头的标量列与 key 一起写入哈希状态，每行复制该状态后追加本行的值；各值以 \0 分隔
+    head = 0
+    while head < len(columns)-1 and is_scalar(columns[head]):
+        head += 1
+    prefix = hashlib.blake2b(("\0".join(str(value) for value in (key,)+tuple(columns[:head]))+"\0").encode('utf-8'),digest_size=16)
+    rows = zip(*[[column]*length if is_scalar(column) else column for column in columns[head:]])
+    tokens = []
+    for row in rows:
+        h = prefix.copy()
+        h.update("\0".join(map(str,row)).encode('utf-8'))
+        tokens.append(h.hexdigest())
+    return tokens
+
+def mint_tokens(key,*columns):
+    # 每列为等长的 token/字符串列表或整数数组（标量会广播），返回每行一个 token
+    length = max((len(column) for column in columns if not is_scalar(column)),default=1)
+    if length == 0:
+        return []
+    return hash_rows(key,columns,length)
+
+def mint_token(key,*values):
+    # 与 mint_tokens 对同一行的结果相同
+    return hashlib.blake2b("\0".join(map(str,(key,)+values)).encode('utf-8'),digest_size=16).hexdigest()
+
+def get_instance_key(scene_token,index):
+    # 代替 hash((scene_token,actor_id))：内置 hash 对字符串加盐，续跑时 instance token 会变化
+    # index 为场景内的生成顺序而非 actor id，重新生成同一场景时 instance token 不变
+    return scene_token+"_"+str(index)
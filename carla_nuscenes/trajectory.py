@@ -0,0 +1,46 @@
+import os
+import json
+import numpy as np
+
+ROLES = ["ego","aux1","aux2","aux3","aux4","vehicle","walker"]
+
+def get_trajectory_path(trajectory_dir,log_token,scene_name):
+    return os.path.join(trajectory_dir,log_token+"_"+scene_name+".npz")
+
+class TrajectoryLog:
+    # 每个 tick 记录所有实体的根位姿 [x,y,z,pitch,yaw,roll]（float32），用于离线重放
+    def __init__(self,ids,roles,blueprints,weather=None):
+        self.ids = np.asarray(ids,dtype=np.int64)
+        self.roles = list(roles)
+        self.blueprints = list(blueprints)
+        self.weather = weather or {}
+        self.timestamps = []
+        self.frames = []
+
+    def __len__(self):
+        return len(self.frames)
+
+    def append(self,timestamp,transforms):
+        self.timestamps.append(timestamp)
+        self.frames.append(np.asarray(transforms,dtype=np.float32).reshape(len(self.ids),6))
+
+    def get_frame(self,index):
+        return self.frames[index]
+
+    def save(self,path):
+        os.makedirs(os.path.dirname(path) or ".",exist_ok=True)
+        np.savez_compressed(path,
+                            ids=self.ids,
+                            roles=np.array([ROLES.index(role) for role in self.roles],dtype=np.uint8),
+                            blueprints=np.array(self.blueprints),
+                            weather=np.array(json.dumps(self.weather)),
+                            timestamps=np.asarray(self.timestamps,dtype=np.float64),
+                            transforms=np.stack(self.frames) if self.frames else np.zeros((0,len(self.ids),6),dtype=np.float32))
+
+    @classmethod
+    def load(cls,path):
+        with np.load(path) as data:
+            log = cls(data["ids"],[ROLES[role] for role in data["roles"]],data["blueprints"].tolist(),json.loads(str(data["weather"])))
+            log.timestamps = data["timestamps"].tolist()
+            log.frames = list(data["transforms"])
+        return log
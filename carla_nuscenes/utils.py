@@ -16,6 +16,21 @@ def dump(data,path):
     with open(path, "w") as filedata:
         json.dump(data, filedata, indent=0, separators=(',',':'))
 
+def append_json(data,path):
+    if not data:
+        return
+    text = json.dumps(data, indent=0, separators=(',',':')).encode('utf-8')
+    inner = text[1:-1].strip()
+    with open(path, "rb+") as filedata:
+        filedata.seek(0,2)
+        offset = max(filedata.tell()-64,0)
+        filedata.seek(offset)
+        tail = filedata.read()
+        body = tail[:tail.rindex(b"]")].rstrip()
+        filedata.seek(offset+len(body))
+        filedata.truncate()
+        filedata.write((b"\n" if body.endswith(b"[") else b",\n")+inner+b"\n]")
+
 def load(path):
     with open(path, "r") as filedata:
         return json.load(filedata)
@@ -32,6 +47,13 @@ def get_nuscenes_rt(transform,mode=None):
     translation = [transform.location.x,
                 -transform.location.y,
                 transform.location.z]
+    quat,_ = get_nuscenes_rt_from_matrix(np.array(transform.get_matrix()),mode)
+    return quat,translation
+
+def get_nuscenes_rt_from_matrix(matrix,mode=None):
+    translation = [float(matrix[0,3]),
+                -float(matrix[1,3]),
+                float(matrix[2,3])]
     if mode == "zxy":
         rotation_matrix1 = np.array([
             [0,0,1],
@@ -45,7 +67,7 @@ def get_nuscenes_rt(transform,mode=None):
             [0,0,1]
         ])
 
-    rotation_matrix2 = np.array(transform.get_matrix())[:3,:3]
+    rotation_matrix2 = matrix[:3,:3]
     rotation_matrix3 = np.array([
             [1,0,0],
             [0,-1,0],
@@ -55,5 +77,83 @@ def get_nuscenes_rt(transform,mode=None):
     quat = Quaternion(matrix=rotation_matrix,rtol=1, atol=1).elements.tolist()
     return quat,translation
 
+def get_transform_matrices(locations,rotations):
+    locations = np.asarray(locations,dtype=np.float64).reshape(-1,3)
+    pitch,yaw,roll = np.deg2rad(np.asarray(rotations,dtype=np.float64).reshape(-1,3)).T
+    cy,sy = np.cos(yaw),np.sin(yaw)
+    cr,sr = np.cos(roll),np.sin(roll)
+    cp,sp = np.cos(pitch),np.sin(pitch)
+    matrices = np.zeros((len(locations),4,4))
+    matrices[:,0,:3] = np.stack([cp*cy,cy*sp*sr-sy*cr,-cy*sp*cr-sy*sr],axis=1)
+    matrices[:,1,:3] = np.stack([cp*sy,sy*sp*sr+cy*cr,-sy*sp*cr+cy*sr],axis=1)
+    matrices[:,2,:3] = np.stack([sp,-cp*sr,cp*cr],axis=1)
+    matrices[:,:3,3] = locations
+    matrices[:,3,3] = 1
+    return matrices
+
+def get_location_rotation_from_matrix(matrix):
+    # get_transform_matrices 的逆变换，返回可直接用于 Actor 配置的 location/rotation（角度制）
+    matrix = np.asarray(matrix,dtype=np.float64)
+    pitch = np.rad2deg(np.arcsin(np.clip(matrix[2,0],-1.0,1.0)))
+    yaw = np.rad2deg(np.arctan2(matrix[1,0],matrix[0,0]))
+    roll = np.rad2deg(np.arctan2(-matrix[2,1],matrix[2,2]))
+    location = {"x":float(matrix[0,3]),"y":float(matrix[1,3]),"z":float(matrix[2,3])}
+    rotation = {"pitch":float(pitch),"yaw":float(yaw),"roll":float(roll)}
+    return location,rotation
+
+def rotation_matrices_to_quaternions(rotation_matrices):
+    m = np.swapaxes(rotation_matrices,1,2)
+    m00,m01,m02 = m[:,0,0],m[:,0,1],m[:,0,2]
+    m10,m11,m12 = m[:,1,0],m[:,1,1],m[:,1,2]
+    m20,m21,m22 = m[:,2,0],m[:,2,1],m[:,2,2]
+    cases = [(m22<0)&(m00>m11),(m22<0)&(m00<=m11),(m22>=0)&(m00<-m11)]
+    t = np.select(cases,[1+m00-m11-m22,1-m00+m11-m22,1-m00-m11+m22],1+m00+m11+m22)
+    q = np.select([case[:,None] for case in cases],[
+            np.stack([m12-m21,t,m01+m10,m20+m02],axis=1),
+            np.stack([m20-m02,m01+m10,t,m12+m21],axis=1),
+            np.stack([m01-m10,m20+m02,m12+m21,t],axis=1)],
+            np.stack([t,m12-m21,m20-m02,m01-m10],axis=1))
+    return q*(0.5/np.sqrt(t))[:,None]
+
+def quaternions_to_rotation_matrices(quaternions):
+    # nuScenes 四元数 [w,x,y,z] 批量转旋转矩阵
+    q = np.asarray(quaternions,dtype=np.float64).reshape(-1,4)
+    q = q/np.linalg.norm(q,axis=1,keepdims=True)
+    w,x,y,z = q.T
+    return np.stack([1-2*(y*y+z*z),2*(x*y-z*w),2*(x*z+y*w),
+                     2*(x*y+z*w),1-2*(x*x+z*z),2*(y*z-x*w),
+                     2*(x*z-y*w),2*(y*z+x*w),1-2*(x*x+y*y)],axis=1).reshape(-1,3,3)
+
+def get_pose_matrices(translations,rotations):
+    # nuScenes 表中的 translation/rotation 批量转 4x4 位姿矩阵
+    translations = np.asarray(translations,dtype=np.float64).reshape(-1,3)
+    matrices = np.tile(np.identity(4),(len(translations),1,1))
+    matrices[:,:3,:3] = quaternions_to_rotation_matrices(rotations)
+    matrices[:,:3,3] = translations
+    return matrices
+
+def get_nuscenes_rt_batch(matrices,mode=None):
+    matrices = np.asarray(matrices,dtype=np.float64).reshape(-1,4,4)
+    translations = matrices[:,:3,3]*np.array([1,-1,1])
+    if mode == "zxy":
+        rotation_matrix1 = np.array([
+            [0,0,1],
+            [1,0,0],
+            [0,-1,0]
+        ])
+    else:
+        rotation_matrix1 = np.array([
+            [1,0,0],
+            [0,-1,0],
+            [0,0,1]
+        ])
+    rotation_matrix3 = np.array([
+            [1,0,0],
+            [0,-1,0],
+            [0,0,1]
+        ])
+    rotation_matrices = rotation_matrix3@matrices[:,:3,:3]@rotation_matrix1
+    return rotation_matrices_to_quaternions(rotation_matrices),translations
+
 def clamp(value, minimum=0.0, maximum=100.0):
     return max(minimum, min(value, maximum))
\ No newline at end of file
@@ -0,0 +1,110 @@
+import math
+import struct
+import numpy as np
+
+POINT_HEADER = struct.Struct("<BIf")
+BOX_HEADER = struct.Struct("<I3f")
+ENCODINGS = {"raw":0,"quantized":1,"voxel":2}
+
+def voxel_downsample(points,voxel_size):
+    # 每个体素保留第一个点
+    if len(points) == 0:
+        return points
+    voxels = np.floor(points[:,:3]/voxel_size).astype(np.int64)
+    voxels -= voxels.min(axis=0)
+    keys = np.ravel_multi_index(voxels.T,voxels.max(axis=0)+1)
+    _,keep = np.unique(keys,return_index=True)
+    return points[np.sort(keep)]
+
+def encode_points(points,mode="quantized",resolution=0.02,voxel_size=0.2):
+    # points: (N,>=4) 传感器坐标系点云，仅编码 x,y,z,intensity
+    if mode == "voxel":
+        points = voxel_downsample(points,voxel_size)
+    if mode == "raw":
+        body = np.ascontiguousarray(points[:,:4],dtype=np.float32).tobytes()
+    else:
+        xyz = np.clip(np.round(points[:,:3]/resolution),-32768,32767).astype("<i2")
+        intensity = np.round(np.clip(points[:,3],0,1)*255).astype(np.uint8)
+        body = xyz.tobytes()+intensity.tobytes()
+    return POINT_HEADER.pack(ENCODINGS[mode],len(points),resolution)+body
+
+def decode_points(payload):
+    mode,count,resolution = POINT_HEADER.unpack_from(payload)
+    body = memoryview(payload)[POINT_HEADER.size:]
+    if mode == ENCODINGS["raw"]:
+        return np.frombuffer(body,dtype=np.float32).reshape(count,4).astype(np.float64)
+    points = np.empty((count,4),dtype=np.float64)
+    points[:,:3] = np.frombuffer(body,dtype="<i2",count=count*3).reshape(count,3)*np.float64(resolution)
+    points[:,3] = np.frombuffer(body,dtype=np.uint8,count=count,offset=count*6)/255.0
+    return points
+
+def encode_boxes(ids,box_matrices,extents,origin):
+    # 框列表：actor id (u4) + 相对发送方的中心、半尺寸、航向角（float16）
+    origin = np.asarray(origin,dtype=np.float64)
+    boxes = np.empty((len(ids),7),dtype="<f2")
+    boxes[:,:3] = box_matrices[:,:3,3]-origin
+    boxes[:,3:6] = extents
+    boxes[:,6] = np.arctan2(box_matrices[:,1,0],box_matrices[:,0,0])
+    return BOX_HEADER.pack(len(ids),*origin)+np.asarray(ids,dtype="<u4").tobytes()+boxes.tobytes()
+
+def decode_boxes(payload):
+    count,*origin = BOX_HEADER.unpack_from(payload)
+    ids = np.frombuffer(payload,dtype="<u4",count=count,offset=BOX_HEADER.size)
+    boxes = np.frombuffer(payload,dtype="<f2",count=count*7,offset=BOX_HEADER.size+count*4).reshape(count,7).astype(np.float64)
+    boxes[:,:3] += origin
+    return ids,boxes
+
+class V2XChannel:
+    def __init__(self,latency=0.02,jitter=0.005,bandwidth=6e6,loss=0.01,packet_size=1400,seed=0):
+        # latency/jitter 单位秒，bandwidth 单位 bit/s，loss 为单个数据包丢失概率
+        self.latency = latency
+        self.jitter = jitter
+        self.bandwidth = bandwidth
+        self.loss = loss
+        self.packet_size = packet_size
+        self.rng = np.random.default_rng(seed)
+        self.busy_until = 0.0
+
+    def reset(self):
+        self.busy_until = 0.0
+
+    def send(self,timestamp,size):
+        # 返回 (是否到达, 时延秒)；链路串行发送，超出带宽的消息在队列中等待
+        packets = max(1,math.ceil(size/self.packet_size))
+        start = max(timestamp,self.busy_until)
+        self.busy_until = start+size*8/self.bandwidth
+        delay = self.busy_until-timestamp+max(0.0,self.latency+self.rng.normal(0.0,self.jitter))
+        arrived = bool(np.all(self.rng.random(packets) >= self.loss))
+        return arrived,delay
+
+class V2XNetwork:
+    def __init__(self,links=None,encoding=None,max_delay=0.1,box_range=70.0,seed=0):
+        self.link_config = links or {}
+        self.encoding = encoding or {}
+        self.max_delay = max_delay
+        self.box_range = box_range
+        self.seed = seed
+        self.channels = {}
+
+    def get_channel(self,agent_id):
+        if agent_id not in self.channels:
+            config = dict(self.link_config.get("default",{}),**self.link_config.get(agent_id,{}))
+            self.channels[agent_id] = V2XChannel(**config,seed=self.seed+agent_id)
+        return self.channels[agent_id]
+
+    def reset(self,seed=None):
+        # 传入场景种子时重建各链路的随机数发生器，丢包与时延只取决于场景本身
+        if seed is not None:
+            self.seed = seed
+            self.channels = {}
+        for channel in self.channels.values():
+            channel.reset()
+
+    def exchange(self,timestamp,agent_messages):
+        # agent_messages: [(agent_id,kind,payload,encode_time)]，timestamp 单位秒
+        records = []
+        for agent_id,kind,payload,encode_time in agent_messages:
+            arrived,delay = self.get_channel(agent_id).send(timestamp+encode_time,len(payload))
+            delay += encode_time
+            records.append((agent_id,kind,len(payload),encode_time,arrived and delay <= self.max_delay,delay))
+        return records
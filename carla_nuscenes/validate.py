@@ -0,0 +1,293 @@
+import os
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from .utils import load
+from .table import Table
+from .shards import ShardIndex
+from .reader import LIDAR_DTYPE,RADAR_DTYPE,DEFAULT_COLUMNS
+
+TABLES = ["attribute","calibrated_sensor","category","ego_pose","instance","log","map","sample","sample_annotation","sample_data",
+          "scene","sensor","visibility","sample_annotation_agent","v2x_message","sweep_annotation","lidar_processing"]
+# (表, 字段, 被引用的表)；字段为空字符串时不检查，列表字段逐项检查
+FOREIGN_KEYS = [
+    ("calibrated_sensor","sensor_token","sensor"),
+    ("map","log_tokens","log"),
+    ("scene","log_token","log"),
+    ("scene","first_sample_token","sample"),
+    ("scene","last_sample_token","sample"),
+    ("sample","scene_token","scene"),
+    ("sample_data","sample_token","sample"),
+    ("sample_data","ego_pose_token","ego_pose"),
+    ("sample_data","calibrated_sensor_token","calibrated_sensor"),
+    ("instance","category_token","category"),
+    ("instance","first_annotation_token","sample_annotation"),
+    ("instance","last_annotation_token","sample_annotation"),
+    ("sample_annotation","sample_token","sample"),
+    ("sample_annotation","instance_token","instance"),
+    ("sample_annotation","visibility_token","visibility"),
+    ("sample_annotation","attribute_tokens","attribute"),
+    ("sample_annotation_agent","sample_annotation_token","sample_annotation"),
+    ("v2x_message","sample_token","sample"),
+    ("sweep_annotation","sample_data_token","sample_data"),
+    ("sweep_annotation","instance_token","instance"),
+    ("sweep_annotation","prev_annotation_token","sample_annotation"),
+    ("sweep_annotation","next_annotation_token","sample_annotation"),
+    ("lidar_processing","sample_data_token","sample_data")
+]
+# (表, 同一链表内必须一致的字段, 是否检查时间戳递增)
+LINKED_LISTS = [("sample","scene_token",True),("sample_data","calibrated_sensor_token",True),("sample_annotation","instance_token",False)]
+# 从场景向下收集行：(表, 字段, 字段取值所在的表)
+SCENE_ROWS = [
+    ("sample","scene_token","scene"),
+    ("sample_data","sample_token","sample"),
+    ("ego_pose","token","sample_data"),
+    ("sample_annotation","sample_token","sample"),
+    ("sample_annotation_agent","sample_annotation_token","sample_annotation"),
+    ("v2x_message","sample_token","sample"),
+    ("sweep_annotation","sample_data_token","sample_data"),
+    ("lidar_processing","sample_data_token","sample_data")
+]
+# 被场景中的行引用的表：(表, 引用字段, 引用它的表)
+SCENE_REFERENCES = [("calibrated_sensor","calibrated_sensor_token","sample_data"),("instance","instance_token","sample_annotation")]
+# 由墙钟时间测得的字段（编码耗时及由它决定的时延、到达情况），重新生成的场景不要求一致
+VOLATILE_FIELDS = {"v2x_message":["encode_time","arrived","delay"]}
+# 点云每个值的类型，与 DatasetReader 的解析方式一致；每个点的列数取自 sensor 表
+POINT_DTYPES = {"pcd.bin":LIDAR_DTYPE,"pcd":RADAR_DTYPE}
+
+class ValidationReport:
+    def __init__(self,max_examples=20):
+        self.max_examples = max_examples
+        self.counts = Counter()
+        self.examples = {}
+        self.stats = {}
+
+    def add(self,check,detail):
+        self.counts[check] += 1
+        examples = self.examples.setdefault(check,[])
+        if len(examples) < self.max_examples:
+            examples.append(detail)
+
+    def to_dict(self):
+        return {"ok":not self.counts,
+                "errors":dict(sorted(self.counts.items())),
+                "examples":{check:self.examples[check] for check in sorted(self.examples)},
+                "stats":self.stats}
+
+def get_rows(tables,key):
+    rows = tables.get(key) or []
+    return rows.to_list() if isinstance(rows,Table) else rows
+
+def build_indexes(tables,report):
+    indexes = {}
+    for key,rows in tables.items():
+        index = {}
+        for row in rows:
+            if row["token"] in index:
+                report.add(key+".duplicate_token",row["token"])
+            index[row["token"]] = row
+        indexes[key] = index
+    return indexes
+
+def check_foreign_keys(tables,indexes,report):
+    for key,field,target in FOREIGN_KEYS:
+        if key not in tables or target not in indexes:
+            continue
+        index = indexes[target]
+        for row in tables[key]:
+            values = row.get(field)
+            if values is None:
+                report.add(key+"."+field+".missing_field",row["token"])
+                continue
+            for value in (values if isinstance(values,list) else [values]):
+                if value != "" and value not in index:
+                    report.add(key+"."+field+".dangling",{"token":row["token"],field:value})
+    # 旧版本的 update_log 在续跑时会把同一个 log 重复加入 map.log_tokens
+    for row in tables.get("map",[]):
+        for token,count in Counter(row["log_tokens"]).items():
+            if count > 1:
+                report.add("map.log_tokens.duplicate",{"token":row["token"],"log_token":token,"count":count})
+
+def check_linked_list(key,group_field,ordered,rows,index,report):
+    # 每个节点的 prev/next 互相指向，链内分组字段一致、时间戳递增；从表头遍历，未被访问的节点属于环或断链
+    heads = []
+    for row in rows:
+        token = row["token"]
+        if row["next"] != "":
+            following = index.get(row["next"])
+            if following is None:
+                report.add(key+".next.dangling",{"token":token,"next":row["next"]})
+            elif following["prev"] != token:
+                report.add(key+".next.not_linked_back",{"token":token,"next":row["next"],"next.prev":following["prev"]})
+            elif following[group_field] != row[group_field]:
+                report.add(key+".next."+group_field+"_mismatch",{"token":token,"next":row["next"]})
+            elif ordered and following["timestamp"] <= row["timestamp"]:
+                report.add(key+".next.timestamp_not_increasing",{"token":token,"next":row["next"]})
+        if row["prev"] == "":
+            heads.append(token)
+        else:
+            previous = index.get(row["prev"])
+            if previous is None:
+                report.add(key+".prev.dangling",{"token":token,"prev":row["prev"]})
+            elif previous["next"] != token:
+                report.add(key+".prev.not_linked_forward",{"token":token,"prev":row["prev"],"prev.next":previous["next"]})
+    visited = set()
+    for token in heads:
+        while token != "" and token in index and token not in visited:
+            visited.add(token)
+            token = index[token]["next"]
+    for row in rows:
+        if row["token"] not in visited:
+            report.add(key+".unreachable",row["token"])
+    report.stats[key+".chains"] = len(heads)
+
+def check_chain_owner(key,first_field,last_field,count_field,list_key,owner_field,tables,indexes,report):
+    # scene -> sample、instance -> sample_annotation：遍历链表核对首尾 token 与数量
+    index = indexes[list_key]
+    totals = Counter(row[owner_field] for row in tables[list_key])
+    for row in tables[key]:
+        token = row[first_field]
+        count = 0
+        last = ""
+        seen = set()
+        while token != "" and token in index and token not in seen:
+            seen.add(token)
+            if index[token][owner_field] != row["token"]:
+                report.add(key+"."+first_field+".foreign_node",{"token":row["token"],list_key:token})
+                break
+            last = token
+            count += 1
+            token = index[token]["next"]
+        if last != row[last_field]:
+            report.add(key+"."+last_field+".mismatch",{"token":row["token"],last_field:row[last_field],"walked":last})
+        if count != row[count_field]:
+            report.add(key+"."+count_field+".mismatch",{"token":row["token"],count_field:row[count_field],"walked":count})
+        if totals[row["token"]] != row[count_field]:
+            report.add(key+"."+count_field+".rows_mismatch",{"token":row["token"],count_field:row[count_field],"rows":totals[row["token"]]})
+
+def check_file(root,shard_index,shard_sizes,record,columns=None):
+    # 返回错误类型，文件正常时返回 None
+    path,offset,size = shard_index.resolve(record["filename"])
+    if size is None:
+        try:
+            size = os.stat(path).st_size
+        except OSError:
+            return "missing"
+    elif shard_sizes.get(path) is None:
+        return "missing_shard"
+    elif offset+size > shard_sizes[path]:
+        return "truncated_shard"
+    dtype = POINT_DTYPES.get(record["fileformat"])
+    if dtype is None:
+        return "empty" if size == 0 else None
+    return "bad_size" if size%(dtype.itemsize*(columns or DEFAULT_COLUMNS[record["fileformat"]])) != 0 else None
+
+def check_files(root,rows,report,workers=16,chunk_size=1024,orphans=True,columns=None):
+    # columns: calibrated_sensor token -> 每个点的列数
+    columns = columns or {}
+    shard_index = ShardIndex(root)
+    shard_sizes = {}
+    for shard,_,_ in shard_index.entries.values():
+        path = os.path.join(root,shard)
+        if path not in shard_sizes:
+            shard_sizes[path] = os.path.getsize(path) if os.path.exists(path) else None
+
+    def check_chunk(chunk):
+        return [(record,check_file(root,shard_index,shard_sizes,record,columns.get(record["calibrated_sensor_token"]))) for record in chunk]
+
+    chunks = [rows[i:i+chunk_size] for i in range(0,len(rows),chunk_size)]
+    with ThreadPoolExecutor(max_workers=max(workers,1)) as executor:
+        for results in executor.map(check_chunk,chunks):
+            for record,error in results:
+                if error is not None:
+                    report.add("sample_data.file."+error,{"token":record["token"],"filename":record["filename"]})
+    report.stats["files"] = len(rows)
+    if orphans:
+        # 崩溃后残留的、未被 sample_data 引用的传感器文件
+        referenced = set(record["filename"] for record in rows)
+        count = 0
+        for dir in ["samples","sweeps"]:
+            dir_path = os.path.join(root,dir)
+            if not os.path.isdir(dir_path):
+                continue
+            for channel in os.scandir(dir_path):
+                if not channel.is_dir():
+                    continue
+                for entry in os.scandir(channel.path):
+                    count += 1
+                    filename = os.path.join(dir,channel.name,entry.name)
+                    if filename not in referenced:
+                        report.add("sample_data.file.orphan",filename)
+        report.stats["files_on_disk"] = count
+
+def validate_tables(tables,root=None,workers=16,files=True,orphans=True,max_examples=20):
+    # tables: 表名 -> 行列表（也可以直接传入 Dataset.data），root 不为空时检查传感器文件
+    start = time.perf_counter()
+    report = ValidationReport(max_examples)
+    tables = {key:get_rows(tables,key) for key in TABLES if key in tables}
+    report.stats["rows"] = {key:len(rows) for key,rows in tables.items()}
+    indexes = build_indexes(tables,report)
+    check_foreign_keys(tables,indexes,report)
+    for key,group_field,ordered in LINKED_LISTS:
+        if key in tables:
+            check_linked_list(key,group_field,ordered,tables[key],indexes[key],report)
+    if "scene" in tables and "sample" in tables:
+        check_chain_owner("scene","first_sample_token","last_sample_token","nbr_samples","sample","scene_token",tables,indexes,report)
+    if "instance" in tables and "sample_annotation" in tables:
+        check_chain_owner("instance","first_annotation_token","last_annotation_token","nbr_annotations","sample_annotation","instance_token",tables,indexes,report)
+    report.stats["tables_time"] = time.perf_counter()-start
+    if files and root is not None and "sample_data" in tables:
+        sensor_columns = {row["token"]:row.get("columns") for row in tables.get("sensor",[])}
+        columns = {row["token"]:sensor_columns.get(row["sensor_token"]) for row in tables.get("calibrated_sensor",[])}
+        check_files(root,tables["sample_data"],report,workers,orphans=orphans,columns=columns)
+    report.stats["time"] = time.perf_counter()-start
+    return report.to_dict()
+
+def load_tables(root,version):
+    json_dir = os.path.join(root,version)
+    return {key:load(os.path.join(json_dir,key+".json")) for key in TABLES if os.path.exists(os.path.join(json_dir,key+".json"))}
+
+def validate_dataset(root,version,report_path=None,**options):
+    tables = load_tables(root,version)
+    result = dict(validate_tables(tables,root,**options),root=root,version=version)
+    if report_path is not None:
+        os.makedirs(os.path.dirname(report_path) or ".",exist_ok=True)
+        with open(report_path,"w") as f:
+            json.dump(result,f,indent=1)
+    return result
+
+def get_scene_rows(tables,scene_token):
+    rows = {"scene":[row for row in get_rows(tables,"scene") if row["token"] == scene_token]}
+    tokens = {"scene":set(row["token"] for row in rows["scene"])}
+    for key,field,owner in SCENE_ROWS:
+        rows[key] = [row for row in get_rows(tables,key) if row[field] in tokens[owner]]
+        tokens[key] = set(row["token"] for row in rows[key])
+    for key,field,referrer in SCENE_REFERENCES:
+        referenced = set(row[field] for row in rows[referrer])
+        rows[key] = [row for row in get_rows(tables,key) if row["token"] in referenced]
+    return rows
+
+def dump_scene_rows(rows):
+    # 每张表按 token 排序后序列化为紧凑 JSON，用于逐字节比较
+    dumped = {}
+    for key,items in rows.items():
+        volatile = VOLATILE_FIELDS.get(key,[])
+        items = sorted(({field:value for field,value in item.items() if field not in volatile} for item in items),key=lambda item:item["token"])
+        dumped[key] = json.dumps(items,sort_keys=True,separators=(",",":")).encode("utf-8")
+    return dumped
+
+def compare_scenes(root,other_root,version,scene_tokens):
+    # 比较两个数据集中同一场景的各表 JSON，返回 场景 token -> 内容不一致的表名；全部一致时返回空字典
+    tables = load_tables(root,version)
+    other_tables = load_tables(other_root,version)
+    mismatches = {}
+    for scene_token in scene_tokens:
+        rows = get_scene_rows(tables,scene_token)
+        other_rows = get_scene_rows(other_tables,scene_token)
+        dumped = dump_scene_rows(rows)
+        other_dumped = dump_scene_rows(other_rows)
+        keys = [key for key in dumped if dumped[key] != other_dumped[key]]
+        if not rows["scene"] or not other_rows["scene"] or keys:
+            mismatches[scene_token] = keys or ["scene"]
+    return mismatches
@@ -0,0 +1,8 @@
+from carla_nuscenes.shards import expand_shards
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+config_path = "./configs/config.yaml"
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+print("expanded files:",expand_shards(config["dataset"]["root"]))
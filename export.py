@@ -0,0 +1,13 @@
+from carla_nuscenes.export import export_dataset
+import sys
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+# 用法: python export.py kitti|openlabel out_dir [config_path]
+export_format = sys.argv[1]
+out_dir = sys.argv[2]
+config_path = sys.argv[3] if len(sys.argv) > 3 else "./configs/config.yaml"
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+counts = export_dataset(config["dataset"]["root"],config["dataset"]["version"],out_dir,export_format,**config.get("export",{}))
+print("exported frames:",sum(counts.values()),"scenes:",len(counts))
@@ -0,0 +1,27 @@
+from carla_nuscenes.generator import Generator
+from carla_nuscenes.validate import compare_scenes
+import os
+import sys
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+# 用法: python regenerate.py config_path world,capture,scene,count [world,capture,scene,count ...] [--compare original_root]
+# count 与场景名 scene-<scene>-<count> 一致；可在多个 CARLA 服务上分别指定 dataset.root 与 client.port 并行重新生成
+# 指定 --compare 时与原数据集中的同一场景逐表比较 JSON，存在差异时以状态码 1 退出
+args = sys.argv[1:]
+original_root = None
+if "--compare" in args:
+    original_root = args.pop(args.index("--compare")+1)
+    args.remove("--compare")
+config_path = args[0]
+scenes = [tuple(int(value) for value in arg.split(",")) for arg in args[1:]]
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+runner = Generator(config)
+scene_tokens = runner.regenerate_scenes(scenes,os.path.exists(config["dataset"]["root"]))
+if original_root is not None:
+    mismatches = compare_scenes(original_root,config["dataset"]["root"],config["dataset"]["version"],scene_tokens)
+    for scene_token,keys in mismatches.items():
+        print("mismatch",scene_token,keys)
+    print("identical" if not mismatches else "differs",len(scene_tokens)-len(mismatches),"/",len(scene_tokens))
+    sys.exit(1 if mismatches else 0)
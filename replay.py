@@ -0,0 +1,14 @@
+from carla_nuscenes.generator import Generator
+import os
+import sys
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+# 用法: python replay.py [config_path]
+# 不同传感器配置可各自指定 dataset.root 与 client.port，在多个 CARLA 服务上并行重放同一批轨迹
+config_path = sys.argv[1] if len(sys.argv) > 1 else "./configs/config.yaml"
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+config.setdefault("trajectory",{})["replay"] = True
+runner = Generator(config)
+runner.generate_dataset(os.path.exists(config["dataset"]["root"]))
@@ -0,0 +1,41 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from carla_nuscenes.annotation import get_box_corners,get_projected_box_areas,get_camera_visibility_levels,get_convex_hull
+
+WIDTH,HEIGHT = 800,600
+INTRINSIC = np.array([[400,0,WIDTH/2],[0,400,HEIGHT/2],[0,0,1]],dtype=np.float64)
+
+def get_box_matrix(yaw,translation):
+    matrix = np.identity(4)
+    matrix[:3,:3] = [[np.cos(yaw),-np.sin(yaw),0],[np.sin(yaw),np.cos(yaw),0],[0,0,1]]
+    matrix[:3,3] = translation
+    return matrix
+
+def render_silhouette(corners):
+    # 按像素中心判断是否在投影凸包内，模拟完全可见实体的实例分割像素
+    uv = np.stack([INTRINSIC[0,0]*corners[:,1]/corners[:,0]+INTRINSIC[0,2],-INTRINSIC[1,1]*corners[:,2]/corners[:,0]+INTRINSIC[1,2]],axis=1)
+    hull = np.array(get_convex_hull(uv))
+    u,v = np.meshgrid(np.arange(WIDTH)+0.5,np.arange(HEIGHT)+0.5)
+    inside = np.ones((HEIGHT,WIDTH),dtype=bool)
+    for k in range(len(hull)):
+        a,b = hull[k-1],hull[k]
+        inside &= (b[0]-a[0])*(v-a[1])-(b[1]-a[1])*(u-a[0]) >= 0
+    return inside
+
+def test_projected_area_matches_silhouette():
+    boxes = np.stack([get_box_matrix(0.6,[10,1,0]),get_box_matrix(0.3,[2,0,0]),get_box_matrix(0,[-5,0,0])])
+    corners = get_box_corners(boxes,np.array([[2.3,1,0.8]]*3))
+    areas = get_projected_box_areas(corners,np.identity(4),INTRINSIC,WIDTH,HEIGHT)
+    assert abs(areas[0]-render_silhouette(corners[0]).sum()) < 0.01*areas[0]
+    assert areas[1] == WIDTH*HEIGHT # 跨越相机的实体在近平面截断，覆盖整幅图像
+    assert areas[2] == 0
+
+def test_fully_visible_in_overlapping_cameras():
+    boxes = get_box_matrix(0.6,[10,1,0])[None]
+    extents = np.array([[2.3,1,0.8]])
+    image = np.zeros((HEIGHT,WIDTH,4),dtype=np.uint8)
+    image[render_silhouette(get_box_corners(boxes,extents)[0]),1] = 7
+    cameras = [(np.identity(4),INTRINSIC,image),(np.identity(4),INTRINSIC,image)]
+    assert get_camera_visibility_levels(cameras,[7],boxes,extents).tolist() == [4]
@@ -0,0 +1,88 @@
+import os
+import sys
+import pytest
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+pytest.importorskip("carla")
+from carla_nuscenes import generator
+from test_supervisor import STAND_IN_SERVER,ping,get_free_port
+
+HANG_ERROR = "time-out of 6000ms while waiting for the simulator"
+
+class HangingClient:
+    # 第一次加载地图时让服务器卡死（标记文件存在时 stand-in 不再回复），之后的 RPC 都按超时处理直到重连
+    def __init__(self,config):
+        self.client = self
+        self.flag = config["hang_flag"]
+        self.rsu_sensors = []
+        self.hung = False
+        self.calls = []
+
+    def get_available_maps(self):
+        return []
+
+    def generate_world(self,world_config):
+        self.calls.append("generate_world")
+        if "reconnect" not in self.calls:
+            open(self.flag,"w").close()
+            self.hung = True
+            raise RuntimeError(HANG_ERROR)
+
+    def destroy_world(self):
+        self.calls.append("destroy_world")
+        if self.hung:
+            raise RuntimeError(HANG_ERROR)
+
+    def reconnect(self):
+        self.calls.append("reconnect")
+        self.hung = False
+
+@pytest.fixture
+def make_generator(tmp_path,monkeypatch):
+    script = tmp_path/"server.py"
+    script.write_text(STAND_IN_SERVER)
+    flag = str(tmp_path/"hang")
+    monkeypatch.setattr(generator,"Client",HangingClient)
+    generators = []
+
+    def make(**supervisor_options):
+        port = get_free_port()
+        supervisor_config = dict({"command":sys.executable+" "+str(script)+" "+str(port)+" "+flag,"startup_timeout":5.0,
+                                  "poll_interval":0.05,"max_restarts":2,"probe_timeout":0.2,"probe":ping},**supervisor_options)
+        config = {"client":{"host":"127.0.0.1","port":port,"hang_flag":flag},
+                  "supervisor":supervisor_config,
+                  "dataset":{"root":str(tmp_path/"dataset"),"version":"v1.14"},
+                  "annotation":{"workers":0},
+                  "sensors":[],"categories":[],"attributes":[],"visibility":[],
+                  "worlds":[{"map_name":"Town01","map_category":"semantic_prior","captures":[]}]}
+        instance = generator.Generator(config)
+        generators.append(instance)
+        return instance
+
+    yield make
+    for instance in generators:
+        instance.supervisor.stop()
+
+def test_hung_server_recovers_through_generator(make_generator):
+    instance = make_generator()
+    instance.generate_dataset()
+    # 卡死期间不调用清理 RPC，重启并重连后重新加载地图，正常结束时销毁世界
+    assert instance.collect_client.calls == ["generate_world","reconnect","generate_world","destroy_world"]
+    assert instance.supervisor.restarts == 1
+    assert instance.dataset.data["progress"]["current_world_index"] == 1
+
+def test_teardown_error_does_not_replace_server_failure(make_generator,monkeypatch):
+    instance = make_generator()
+    # 探测误判为可用时清理 RPC 仍会超时，异常只记录，ServerFailure 照常进入恢复
+    monkeypatch.setattr(instance.supervisor,"is_ready",lambda:True)
+    instance.generate_dataset()
+    assert instance.collect_client.calls == ["generate_world","destroy_world","reconnect","generate_world","destroy_world"]
+
+def test_server_not_ready_at_startup(make_generator):
+    with pytest.raises(generator.ServerFailure):
+        make_generator(command=None,startup_timeout=0.3)
+
+def test_semantic_lidar_mode_requires_semantic_lidar():
+    scene_config = {"calibrated_sensors":{"sensors":[{"name":"LIDAR_TOP","bp_name":"sensor.lidar.ray_cast"}]}}
+    config = {"annotation":{"mode":"semantic_lidar"},"worlds":[{"captures":[{"scenes":[scene_config]}]}]}
+    with pytest.raises(ValueError,match="ray_cast_semantic"):
+        generator.Generator(config)
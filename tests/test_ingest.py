@@ -0,0 +1,34 @@
+import os
+import sys
+import signal
+import pytest
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from carla_nuscenes.ingest import IngestRing,IngestFailure
+
+class RadarMeasurement:
+    def __init__(self,nbytes):
+        self.raw_data = bytes(nbytes)
+        self.timestamp = 0.0
+        self.frame = 0
+
+def test_flush_writes_files(tmp_path):
+    ring = IngestRing(slot_size=1024,slots=4,workers=2,poll_interval=0.05)
+    try:
+        slot = ring.acquire(RadarMeasurement(64),"radar")
+        ring.write(slot,str(tmp_path/"radar.pcd"),"radar.pcd")
+        slot.release()
+        assert [filename for filename,_,_ in ring.flush()] == ["radar.pcd"]
+        assert os.path.getsize(tmp_path/"radar.pcd") == 64
+    finally:
+        ring.close()
+
+def test_dead_writer_raises_instead_of_blocking(tmp_path):
+    ring = IngestRing(slot_size=1024,slots=4,workers=1,poll_interval=0.05)
+    # 模拟 OOM：写盘进程被 SIGKILL，之后提交的任务不会返回
+    os.kill(ring.workers[0].pid,signal.SIGKILL)
+    ring.workers[0].join()
+    ring.write(ring.acquire(RadarMeasurement(64),"radar"),str(tmp_path/"radar.pcd"),"radar.pcd")
+    with pytest.raises(IngestFailure):
+        ring.flush()
+    with pytest.raises(IngestFailure):
+        ring.close()
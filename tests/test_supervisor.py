@@ -0,0 +1,111 @@
+import os
+import sys
+import socket
+import pytest
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from carla_nuscenes.supervisor import ServerSupervisor,ServerFailure
+
+# 代替 CARLA 的本地服务：收到 ping 回复 pong；hang 模式只接受连接不回复（端口打开但 RPC 超时）
+# flag 模式在标记文件存在时表现为 hang，启动时删除标记文件（运行中卡死、重启后恢复）
+STAND_IN_SERVER = """
+import os,socket,sys
+port,mode = int(sys.argv[1]),sys.argv[2]
+if mode != "ok" and mode != "hang" and os.path.exists(mode):
+    os.remove(mode)
+server = socket.socket()
+server.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+server.bind(("127.0.0.1",port))
+server.listen(16)
+connections = []
+while True:
+    connection,_ = server.accept()
+    connections.append(connection)
+    if (mode == "ok" or mode != "hang" and not os.path.exists(mode)) and connection.recv(4) == b"ping":
+        connection.sendall(b"pong")
+"""
+
+def ping(host,port,timeout):
+    try:
+        with socket.create_connection((host,port),timeout=timeout) as connection:
+            connection.settimeout(timeout)
+            connection.sendall(b"ping")
+            return connection.recv(4) == b"pong"
+    except OSError:
+        return False
+
+def get_free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1",0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def make_supervisor(tmp_path):
+    script = tmp_path/"server.py"
+    script.write_text(STAND_IN_SERVER)
+    supervisors = []
+
+    def make(mode="ok",**options):
+        port = get_free_port()
+        options = dict({"startup_timeout":5.0,"poll_interval":0.05,"max_restarts":3,"probe_timeout":0.2,"probe":ping},**options)
+        supervisor = ServerSupervisor("127.0.0.1",port,sys.executable+" "+str(script)+" "+str(port)+" "+mode,**options)
+        supervisors.append(supervisor)
+        return supervisor
+
+    yield make
+    for supervisor in supervisors:
+        supervisor.stop()
+
+def test_wait_ready(make_supervisor):
+    supervisor = make_supervisor()
+    supervisor.start()
+    assert supervisor.wait_ready()
+    assert supervisor.is_ready()
+
+def test_hung_server_is_not_ready(make_supervisor):
+    supervisor = make_supervisor("hang",startup_timeout=1.0)
+    supervisor.start()
+    assert not supervisor.wait_ready()
+    assert supervisor.is_alive() # 端口可连接，只有 RPC 检查能发现卡死
+
+def test_recover_restarts_dead_server(make_supervisor):
+    supervisor = make_supervisor()
+    supervisor.start()
+    assert supervisor.wait_ready()
+    supervisor.process.kill()
+    supervisor.process.wait()
+    assert not supervisor.is_alive()
+    assert supervisor.recover(lambda:"connected") == "connected"
+    assert supervisor.restarts == 1
+    assert supervisor.is_ready()
+
+def test_recover_retries_failed_connect(make_supervisor):
+    supervisor = make_supervisor()
+    supervisor.start()
+    attempts = []
+
+    def connect():
+        attempts.append(supervisor.restarts)
+        if len(attempts) < 3:
+            raise RuntimeError("time-out of 6000ms while waiting for the simulator")
+        return "connected"
+
+    assert supervisor.recover(connect) == "connected"
+    assert attempts == [1,2,3]
+
+def test_recover_gives_up_after_max_restarts(make_supervisor):
+    supervisor = make_supervisor("hang",startup_timeout=0.5,max_restarts=2)
+    supervisor.start()
+    with pytest.raises(ServerFailure):
+        supervisor.recover(lambda:"connected")
+    assert supervisor.restarts == 2
+
+def test_recover_raises_other_errors(make_supervisor):
+    supervisor = make_supervisor()
+    supervisor.start()
+
+    def connect():
+        raise ValueError("bad config")
+
+    with pytest.raises(ValueError):
+        supervisor.recover(connect)
+    assert supervisor.restarts == 1
@@ -0,0 +1,19 @@
+import os
+import sys
+import numpy as np
+sys.path.insert(0,os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from carla_nuscenes.utils import generate_token
+from carla_nuscenes.tokens import mint_token,mint_tokens
+
+def test_token_independent_of_batch_size():
+    sample_token = generate_token("sample","scene-0-0"+"1000000")
+    instance_tokens = [generate_token("instance",str(i)) for i in range(300)]
+    expected = mint_token("sample_annotation",sample_token,instance_tokens[0])
+    for size in [1,255,256,300]:
+        assert mint_tokens("sample_annotation",sample_token,instance_tokens[:size])[0] == expected
+
+def test_integer_columns_match_mint_token():
+    timestamps = np.arange(1000000,1000300,dtype=np.int64)
+    tokens = mint_tokens("ego_pose","scene","sensor",timestamps)
+    assert tokens[299] == mint_token("ego_pose","scene","sensor",1000299)
+    assert len(set(tokens)) == len(tokens)
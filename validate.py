@@ -0,0 +1,16 @@
+from carla_nuscenes.validate import validate_dataset
+import sys
+import json
+import yaml
+from yamlinclude import YamlIncludeConstructor
+YamlIncludeConstructor.add_to_loader_class(loader_class=yaml.FullLoader)
+# 用法: python validate.py [config_path]
+# 检查链表、外键、计数与传感器文件，报告写入 validate.report；存在错误时以状态码 1 退出
+config_path = sys.argv[1] if len(sys.argv) > 1 else "./configs/config.yaml"
+with open(config_path,'r') as f:
+    config = yaml.load(f.read(),Loader=yaml.FullLoader)
+validate_config = dict(config.get("validate",{}))
+report = validate_dataset(config["dataset"]["root"],config["dataset"]["version"],validate_config.pop("report",None),**validate_config)
+print(json.dumps(report["errors"],indent=1))
+print("ok" if report["ok"] else "failed","in %.1fs"%report["stats"]["time"])
+sys.exit(0 if report["ok"] else 1)